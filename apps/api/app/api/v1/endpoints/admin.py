@@ -1,10 +1,10 @@
 from fastapi import APIRouter, Depends, Header, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
 from app.core.config import get_settings
-from app.models.request import RequestRecord
+from app.models.usage import UsageDaily
 
 router = APIRouter()
 
@@ -16,33 +16,36 @@ def verify_admin(x_admin_secret: str | None = Header(default=None)):
 
 
 @router.get("/usage")
-async def usage(db: Session = Depends(get_db), _=Depends(verify_admin)):
-    total = db.query(func.count(RequestRecord.id)).scalar() or 0
+async def usage(db: AsyncSession = Depends(get_db), _=Depends(verify_admin)):
     by_provider = (
-        db.query(RequestRecord.model_provider, func.count(RequestRecord.id))
-        .group_by(RequestRecord.model_provider)
-        .all()
-    )
+        await db.execute(
+            select(
+                UsageDaily.model_provider,
+                func.sum(UsageDaily.count),
+                func.sum(UsageDaily.tokens_in),
+                func.sum(UsageDaily.tokens_out),
+                func.sum(UsageDaily.cost_usd),
+            ).group_by(UsageDaily.model_provider)
+        )
+    ).all()
     by_model = (
-        db.query(RequestRecord.model, func.count(RequestRecord.id))
-        .group_by(RequestRecord.model)
-        .order_by(func.count(RequestRecord.id).desc())
-        .limit(20)
-        .all()
-    )
-    tokens_in_sum = db.query(func.coalesce(func.sum(RequestRecord.tokens_in), 0)).scalar() or 0
-    tokens_out_sum = db.query(func.coalesce(func.sum(RequestRecord.tokens_out), 0)).scalar() or 0
-    cost_sum = db.query(func.coalesce(func.sum(RequestRecord.cost_usd), 0.0)).scalar() or 0.0
+        await db.execute(
+            select(UsageDaily.model, func.sum(UsageDaily.count))
+            .group_by(UsageDaily.model)
+            .order_by(func.sum(UsageDaily.count).desc())
+            .limit(20)
+        )
+    ).all()
     return {
-        "total": total,
-        "tokens_in": int(tokens_in_sum),
-        "tokens_out": int(tokens_out_sum),
-        "cost_usd": float(cost_sum),
-        "by_provider": [{"provider": p, "count": c} for p, c in by_provider],
-        "by_model": [{"model": m, "count": c} for m, c in by_model],
+        "total": sum(int(row[1] or 0) for row in by_provider),
+        "tokens_in": sum(int(row[2] or 0) for row in by_provider),
+        "tokens_out": sum(int(row[3] or 0) for row in by_provider),
+        "cost_usd": float(sum(float(row[4] or 0.0) for row in by_provider)),
+        "by_provider": [{"provider": row[0], "count": int(row[1] or 0)} for row in by_provider],
+        "by_model": [{"model": m, "count": int(c or 0)} for m, c in by_model],
     }
 
 
 @router.get("/requests")
 async def requests():
-    return {"detail": "requests not implemented"} 
\ No newline at end of file
+    return {"detail": "requests not implemented"}
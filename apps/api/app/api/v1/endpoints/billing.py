@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import stripe
 
 from app.api.deps import get_current_user, get_db
 from app.core.config import get_settings
+from app.core.principal import invalidate_principal
 from app.models.user import User
 
 router = APIRouter()
@@ -19,7 +21,7 @@ def _get_billing_settings(user: User) -> dict:
 
 
 @router.post("/subscribe")
-async def subscribe(plan: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def subscribe(plan: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     settings = get_settings()
     if not settings.stripe_secret_key:
         raise HTTPException(status_code=500, detail="Stripe not configured")
@@ -41,7 +43,7 @@ async def subscribe(plan: str, db: Session = Depends(get_db), current_user: User
             customer = stripe.Customer.create(email=current_user.email, metadata={"user_id": str(current_user.id)})
             billing["stripe_customer_id"] = customer.id
             db.add(current_user)
-            db.commit()
+            await db.commit()
             customer_id = customer.id
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to create customer: {e}")
@@ -68,7 +70,7 @@ async def subscribe(plan: str, db: Session = Depends(get_db), current_user: User
 
 
 @router.post("/portal")
-async def create_billing_portal(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def create_billing_portal(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     settings = get_settings()
     if not settings.stripe_secret_key:
         raise HTTPException(status_code=500, detail="Stripe not configured")
@@ -82,7 +84,7 @@ async def create_billing_portal(db: Session = Depends(get_db), current_user: Use
             cust = candidates.data[0] if candidates.data else stripe.Customer.create(email=current_user.email, metadata={"user_id": str(current_user.id)})
             billing["stripe_customer_id"] = cust.id
             db.add(current_user)
-            db.commit()
+            await db.commit()
             customer_id = cust.id
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"No Stripe customer on file and lookup failed: {e}")
@@ -98,7 +100,7 @@ async def create_billing_portal(db: Session = Depends(get_db), current_user: Use
 
 
 @router.post("/webhook")
-async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
+async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_db)):
     settings = get_settings()
     if not settings.stripe_webhook_secret:
         return JSONResponse(status_code=200, content={"received": True})
@@ -130,7 +132,7 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
         user = None
         uid = data.get("client_reference_id")
         if uid:
-            user = db.query(User).filter(User.id == uid).first()
+            user = await db.scalar(select(User).where(User.id == uid))
         if user:
             billing = _get_billing_settings(user)
             if data.get("customer"):
@@ -142,18 +144,19 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
                 price_id = data["line_items"]["data"][0]["price"]["id"]
             set_plan_from_price(user, price_id)
             db.add(user)
-            db.commit()
+            await db.commit()
+            await invalidate_principal(user.id)
 
     elif etype in {"customer.subscription.created", "customer.subscription.updated"}:
         sub = data
         uid = (sub.get("metadata") or {}).get("user_id")
         user = None
         if uid:
-            user = db.query(User).filter(User.id == uid).first()
+            user = await db.scalar(select(User).where(User.id == uid))
         if not user:
             cust_id = sub.get("customer")
             if cust_id:
-                user = db.query(User).filter(User.settings["billing"]["stripe_customer_id"].astext == cust_id).first()  # type: ignore
+                user = await db.scalar(select(User).where(User.settings["billing"]["stripe_customer_id"].astext == cust_id))  # type: ignore
         if user:
             billing = _get_billing_settings(user)
             if sub.get("customer"):
@@ -170,23 +173,25 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
                     price_id = items[0]["price"]["id"]
                 set_plan_from_price(user, price_id)
             db.add(user)
-            db.commit()
+            await db.commit()
+            await invalidate_principal(user.id)
 
     elif etype == "customer.subscription.deleted":
         sub = data
         uid = (sub.get("metadata") or {}).get("user_id")
         user = None
         if uid:
-            user = db.query(User).filter(User.id == uid).first()
+            user = await db.scalar(select(User).where(User.id == uid))
         if not user:
             cust_id = sub.get("customer")
             if cust_id:
-                user = db.query(User).filter(User.settings["billing"]["stripe_customer_id"].astext == cust_id).first()  # type: ignore
+                user = await db.scalar(select(User).where(User.settings["billing"]["stripe_customer_id"].astext == cust_id))  # type: ignore
         if user:
             billing = _get_billing_settings(user)
             billing["stripe_subscription_id"] = None
             user.plan_id = "Basic"
             db.add(user)
-            db.commit()
+            await db.commit()
+            await invalidate_principal(user.id)
 
     return JSONResponse(status_code=200, content={"received": True})
\ No newline at end of file
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends
+
+from app.api.deps import get_current_principal
+from app.core.principal import Principal
+from app.schemas.context import ContextChunkUpload, ContextManifest, ContextManifestResponse
+from app.services.context_store import context_store
+
+router = APIRouter()
+
+
+@router.post("/manifest", response_model=ContextManifestResponse)
+async def put_manifest(payload: ContextManifest, current_user: Principal = Depends(get_current_principal)):
+    missing = await context_store.put_manifest(str(current_user.id), payload.page_text_hash, payload.chunks)
+    return ContextManifestResponse(page_text_hash=payload.page_text_hash, missing=missing)
+
+
+@router.put("/chunks")
+async def put_chunks(payload: ContextChunkUpload, current_user: Principal = Depends(get_current_principal)):
+    stored = await context_store.put_chunks(str(current_user.id), payload.chunks)
+    return {"stored": stored}
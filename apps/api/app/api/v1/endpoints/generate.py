@@ -1,125 +1,141 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from fastapi.responses import StreamingResponse
-
-from app.api.deps import get_current_user, get_db
-from app.core.crypto import decrypt_value
-from app.core.rate_limit import check_rate_limit
-from app.core.billing import estimate_tokens, compute_cost_usd
-from app.core.quota import quota_remaining
-from app.models.key import ApiKey
-from app.models.user import User
+import uuid
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.deps import get_current_principal, get_db
+from app.core.config import get_settings
+from app.core.deadline import request_deadline
+from app.core.principal import Principal
 from app.models.request import RequestRecord
-from app.schemas.generate import GenerationRequest, GenerationResponse
-from app.services.adapters import get_adapter
+from app.schemas.generate import GenerationRequest, GenerationResponse, PrepareRequest, PrepareResponse
+from app.services.admission import admission
+from app.services.generation import begin_generation, open_stream, run_generation
+from app.services.idempotency import idempotency
+from app.services.jobs import enqueue_generation, get_job, wait_for_job
+from app.services.prepare import consume_prepared, prepare_generation
+from app.services.sse import encode_stream, watch_disconnect
 
 router = APIRouter()
+settings = get_settings()
 
 
-def _resolve_user_key(db: Session, user_id, provider: str) -> str:
-  key_row = (
-      db.query(ApiKey)
-      .filter(ApiKey.user_id == user_id, ApiKey.provider == provider)
-      .order_by(ApiKey.created_at.desc())
-      .first()
-  )
-  if not key_row:
-      raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No user key found for provider")
-  return decrypt_value(key_row.key_encrypted)
+@router.post("/generate/prepare", response_model=PrepareResponse)
+async def prepare(
+    req: PrepareRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal),
+):
+    token, quota_left = await prepare_generation(db, current_user, req.model_provider, req.model)
+    return PrepareResponse(prepare_token=token, expires_in=settings.prepare_token_ttl_seconds, quota_remaining=quota_left)
 
 
 @router.post("/generate", response_model=GenerationResponse)
-async def generate(req: GenerationRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    allowed, remaining = check_rate_limit(str(current_user.id))
-    if not allowed:
-        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded")
-
-    prompt_text = (req.prompt or "")
-    if req.context and req.context.selected_text:
-        prompt_text += "\n\nSelected:\n" + req.context.selected_text
-    needed_in = estimate_tokens(req.model_provider, prompt_text, req.model)
-    if quota_remaining(db, current_user) <= needed_in:
-        raise HTTPException(status_code=402, detail="Monthly quota exceeded")
-
-    if not req.use_user_key:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Server key flow not configured")
-
-    api_key = _resolve_user_key(db, current_user.id, req.model_provider)
-    adapter = get_adapter(req.model_provider)
-
-    url_str = str(req.context.url) if (req.context and req.context.url) else None
-    domain, path = RequestRecord.parse_domain_path(url_str)
-    rec = RequestRecord(user_id=current_user.id, domain=domain, path=path, model=req.model, model_provider=req.model_provider, status="started")
-    db.add(rec)
-    db.commit()
-    db.refresh(rec)
-
-    try:
-        result = adapter.generate(current_user, req, api_key)
-        tin = needed_in
-        tout = estimate_tokens(req.model_provider, result.output_text, req.model)
-        rec.tokens_in = tin
-        rec.tokens_out = tout
-        rec.cost_usd = compute_cost_usd(req.model_provider, req.model, tin, tout)
-        rec.status = "success"
-        db.add(rec)
-        db.commit()
-        return result
-    except Exception as e:
-        rec.status = "error"
-        db.add(rec)
-        db.commit()
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+async def generate(
+    req: GenerationRequest,
+    response: Response,
+    mode: Literal["sync", "async"] = Query(default="sync"),
+    idempotency_key: str | None = Header(default=None),
+    x_request_deadline: str | None = Header(default=None),
+    x_request_timeout: str | None = Header(default=None),
+    x_prepare_token: str | None = Header(default=None),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal),
+):
+    if mode == "async":
+        # Queued jobs bypass admission: the JOB_WORKERS consumers bound how many run at once
+        headers: dict[str, str] = {}
+
+        async def enqueue() -> dict:
+            call = await begin_generation(current_user, req)
+            headers.update(call.rate_limit.headers())
+            return await enqueue_generation(call)
+
+        job = await idempotency.run_job(current_user.id, idempotency_key, req, enqueue) if idempotency_key else await enqueue()
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=job, headers=headers)
+
+    deadline = request_deadline(x_request_deadline, x_request_timeout)
+    prepared = consume_prepared(x_prepare_token, current_user, req.model_provider) is not None
+
+    async def produce() -> GenerationResponse:
+        call = await begin_generation(current_user, req, deadline, prepared)
+        response.headers.update(call.rate_limit.headers())
+        async with admission.slot(current_user.plan, deadline):
+            return await run_generation(db, call)
+
+    if idempotency_key:
+        return await idempotency.run(current_user.id, idempotency_key, req, produce)
+    return await produce()
 
 
 @router.post("/generate/stream")
-async def generate_stream(req: GenerationRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    allowed, remaining = check_rate_limit(str(current_user.id))
-    if not allowed:
-        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded")
-
-    prompt_text = (req.prompt or "")
-    if req.context and req.context.selected_text:
-        prompt_text += "\n\nSelected:\n" + req.context.selected_text
-    needed_in = estimate_tokens(req.model_provider, prompt_text, req.model)
-    if quota_remaining(db, current_user) <= needed_in:
-        raise HTTPException(status_code=402, detail="Monthly quota exceeded")
-
-    if not req.use_user_key:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Server key flow not configured")
-
-    api_key = _resolve_user_key(db, current_user.id, req.model_provider)
-    adapter = get_adapter(req.model_provider)
-
-    url_str = str(req.context.url) if (req.context and req.context.url) else None
-    domain, path = RequestRecord.parse_domain_path(url_str)
-    rec = RequestRecord(user_id=current_user.id, domain=domain, path=path, model=req.model, model_provider=req.model_provider, status="streaming")
-    rec.tokens_in = needed_in
-    db.add(rec)
-    db.commit()
-
-    def event_gen():
-        out_total = 0
+async def generate_stream(
+    req: GenerationRequest,
+    request: Request,
+    idempotency_key: str | None = Header(default=None),
+    x_request_deadline: str | None = Header(default=None),
+    x_request_timeout: str | None = Header(default=None),
+    x_prepare_token: str | None = Header(default=None),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal),
+):
+    headers: dict[str, str] = {}
+    deadline = request_deadline(x_request_deadline, x_request_timeout)
+    prepared = consume_prepared(x_prepare_token, current_user, req.model_provider) is not None
+
+    async def produce():
+        call = await begin_generation(current_user, req, deadline, prepared)
+        headers.update(call.rate_limit.headers())
+        ticket = await admission.admit(current_user.plan, deadline)
         try:
-            for delta in adapter.generate_stream(current_user, req, api_key):
-                out_total += estimate_tokens(req.model_provider, delta, req.model)
-                yield f"data: {delta}\n\n"
-            yield "data: [DONE]\n\n"
-            rec.tokens_out = out_total
-            rec.cost_usd = compute_cost_usd(req.model_provider, req.model, rec.tokens_in or 0, rec.tokens_out or 0)
-            rec.status = "success"
-            db.add(rec)
-            db.commit()
-        except Exception as e:
-            rec.status = "canceled" if out_total > 0 else "error"
-            db.add(rec)
-            db.commit()
-            if out_total == 0:
-                yield f"event: error\ndata: {str(e)}\n\n"
-
-    return StreamingResponse(event_gen(), media_type="text/event-stream")
+            deltas = await open_stream(db, call)
+        except BaseException:
+            ticket.release()
+            raise
+        return await admission.hold(ticket, deltas)
+
+    if idempotency_key:
+        deltas = await idempotency.run_stream(current_user.id, idempotency_key, req, produce)
+    else:
+        deltas = await produce()
+
+    headers["Cache-Control"] = "no-cache"
+    headers["X-Accel-Buffering"] = "no"
+    return StreamingResponse(encode_stream(deltas, watch_disconnect(request)), media_type="text/event-stream", headers=headers)
 
 
 @router.get("/generate/{request_id}/status")
-async def generate_status(request_id: str):
-    return {"detail": f"status for {request_id} not implemented"} 
\ No newline at end of file
+async def generate_status(
+    request_id: str,
+    wait: float = Query(default=0, ge=0),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal),
+):
+    job = await get_job(request_id)
+    if job is not None:
+        if job.get("user_id") != str(current_user.id):
+            raise HTTPException(status_code=404, detail="Request not found")
+        if wait > 0:
+            job = await wait_for_job(request_id, min(wait, settings.job_max_wait_seconds)) or job
+        return {
+            "id": request_id,
+            "status": job.get("status"),
+            "output_text": job.get("output_text"),
+            "model": job.get("model"),
+            "provider": job.get("provider"),
+            "error": job.get("error"),
+        }
+
+    # Job results expire from Redis; fall back to the request log for the final status
+    try:
+        rid = uuid.UUID(request_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Request not found")
+    res = await db.execute(select(RequestRecord).where(RequestRecord.id == rid, RequestRecord.user_id == current_user.id))
+    rec = res.scalar_one_or_none()
+    if rec is None:
+        raise HTTPException(status_code=404, detail="Request not found")
+    return {"id": request_id, "status": rec.status, "model": rec.model, "provider": rec.model_provider}
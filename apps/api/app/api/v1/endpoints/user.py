@@ -1,14 +1,15 @@
 from typing import Any
 
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_current_user, get_db
 from app.models.user import User
 from app.schemas.user import UserPublic
-from app.models.request import RequestRecord
-from app.core.quota import get_user_plan, monthly_tokens_used, quota_remaining
+from app.models.usage import UsageDaily
+from app.core.principal import invalidate_principal
+from app.core.quota import get_month_start, get_user_plan
 
 router = APIRouter()
 
@@ -19,58 +20,44 @@ async def get_me(current_user: User = Depends(get_current_user)):
 
 
 @router.put("/me/settings", response_model=UserPublic)
-async def update_settings(payload: dict[str, Any], current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_settings(payload: dict[str, Any], current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     current_user.settings = payload
     db.add(current_user)
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
+    await invalidate_principal(current_user.id)
     return current_user
 
 
 @router.get("/usage")
-async def my_usage(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    total = (
-        db.query(func.count(RequestRecord.id))
-        .filter(RequestRecord.user_id == current_user.id)
-        .scalar()
-        or 0
-    )
-    tokens_in_sum = (
-        db.query(func.coalesce(func.sum(RequestRecord.tokens_in), 0))
-        .filter(RequestRecord.user_id == current_user.id)
-        .scalar()
-        or 0
-    )
-    tokens_out_sum = (
-        db.query(func.coalesce(func.sum(RequestRecord.tokens_out), 0))
-        .filter(RequestRecord.user_id == current_user.id)
-        .scalar()
-        or 0
-    )
-    cost_sum = (
-        db.query(func.coalesce(func.sum(RequestRecord.cost_usd), 0.0))
-        .filter(RequestRecord.user_id == current_user.id)
-        .scalar()
-        or 0.0
-    )
+async def my_usage(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    month_start = get_month_start().date()
     by_provider = (
-        db.query(RequestRecord.model_provider, func.count(RequestRecord.id))
-        .filter(RequestRecord.user_id == current_user.id)
-        .group_by(RequestRecord.model_provider)
-        .all()
-    )
-
-    plan = get_user_plan(db, current_user)
-    monthly_used = monthly_tokens_used(db, current_user)
-    monthly_remaining = quota_remaining(db, current_user)
+        await db.execute(
+            select(
+                UsageDaily.model_provider,
+                func.sum(UsageDaily.count),
+                func.sum(UsageDaily.tokens_in),
+                func.sum(UsageDaily.tokens_out),
+                func.sum(UsageDaily.cost_usd),
+                func.sum(case((UsageDaily.day >= month_start, UsageDaily.tokens_in + UsageDaily.tokens_out), else_=0)),
+            )
+            .where(UsageDaily.user_id == current_user.id)
+            .group_by(UsageDaily.model_provider)
+        )
+    ).all()
+
+    plan = await get_user_plan(db, current_user)
+    monthly_used = sum(int(row[5] or 0) for row in by_provider)
+    monthly_remaining = max(0, int(plan.token_quota) - monthly_used)
 
     return {
-        "total": int(total),
-        "tokens_in": int(tokens_in_sum),
-        "tokens_out": int(tokens_out_sum),
-        "cost_usd": float(cost_sum),
-        "by_provider": [{"provider": p, "count": c} for p, c in by_provider],
+        "total": sum(int(row[1] or 0) for row in by_provider),
+        "tokens_in": sum(int(row[2] or 0) for row in by_provider),
+        "tokens_out": sum(int(row[3] or 0) for row in by_provider),
+        "cost_usd": float(sum(float(row[4] or 0.0) for row in by_provider)),
+        "by_provider": [{"provider": row[0], "count": int(row[1] or 0)} for row in by_provider],
         "plan": {"name": plan.name, "token_quota": int(plan.token_quota)},
         "monthly_used": int(monthly_used),
         "monthly_remaining": int(monthly_remaining),
-    } 
\ No newline at end of file
+    }
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+from typing import Any
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+
+from app.core.config import get_settings
+from app.core.deadline import DeadlineExceeded, request_deadline
+from app.core.principal import Principal, resolve_principal
+from app.db.session import AsyncSessionLocal
+from app.schemas.generate import GenerationRequest
+from app.services.admission import admission
+from app.services.generation import begin_generation, open_stream
+from app.services.prepare import consume_prepared
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+settings = get_settings()
+
+# Protocol (JSON text frames):
+#   -> {"type": "auth", "token": "..."}                       <- {"type": "ready"}
+#   -> {"type": "generate", "id": "c1", "request": {...}, "timeout": 30, "prepare_token": "..."}
+#   <- {"type": "start", "id": "c1", "request_id": "..."}
+#   <- {"type": "delta", "id": "c1", "text": "..."}  (one credit each)
+#   <- {"type": "done", "id": "c1"} | {"type": "error", "id": "c1", "status": 429, "detail": "..."}
+#   -> {"type": "ack", "id": "c1", "credits": 16}  grants more delta frames
+#   -> {"type": "cancel", "id": "c1"}
+
+
+class _Stream:
+    def __init__(self, credits: int):
+        self.credits = asyncio.Semaphore(credits)
+        self.task: asyncio.Task | None = None
+        # Set once an error frame has ended the stream, so no "canceled" follows it
+        self.failed = False
+
+
+class _Connection:
+    def __init__(self, websocket: WebSocket, token: str):
+        self.websocket = websocket
+        self.token = token
+        self.streams: dict[str, _Stream] = {}
+        # A single writer keeps frames from concurrent streams from interleaving on the socket
+        self.outbox: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+
+    async def writer(self) -> None:
+        while True:
+            frame = await self.outbox.get()
+            await self.websocket.send_text(json.dumps(frame, separators=(",", ":")))
+
+    def send(self, frame: dict[str, Any]) -> None:
+        self.outbox.put_nowait(frame)
+
+    async def principal(self) -> Principal:
+        # Served from the principal cache, so expiry and plan changes apply without re-auth
+        principal = await resolve_principal(self.token)
+        if principal is None or not principal.is_active:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
+        return principal
+
+    def handle(self, msg: dict[str, Any]) -> None:
+        kind, sid = msg.get("type"), str(msg.get("id") or "")
+        if kind == "generate":
+            if not sid or sid in self.streams:
+                self.send({"type": "error", "id": sid, "status": 400, "detail": "Missing or duplicate stream id"})
+            elif len(self.streams) >= settings.ws_max_streams:
+                self.send({"type": "error", "id": sid, "status": 429, "detail": "Too many concurrent streams"})
+            else:
+                stream = _Stream(settings.ws_initial_credits)
+                self.streams[sid] = stream
+                stream.task = asyncio.create_task(self.run(sid, stream, msg))
+        elif kind == "cancel":
+            stream = self.streams.get(sid)
+            if stream is not None and stream.task is not None:
+                stream.task.cancel()
+        elif kind == "ack":
+            stream = self.streams.get(sid)
+            if stream is None:
+                return
+            credits = msg.get("credits") or 1
+            if not isinstance(credits, int) or isinstance(credits, bool):
+                self.fail(sid, stream, 400, "credits must be an integer")
+                return
+            for _ in range(max(0, min(credits, settings.ws_initial_credits))):
+                stream.credits.release()
+        elif kind != "ping":
+            self.send({"type": "error", "id": sid, "status": 400, "detail": f"Unknown message type: {kind}"})
+
+    def fail(self, sid: str, stream: _Stream, code: int, detail: str) -> None:
+        stream.failed = True
+        self.send({"type": "error", "id": sid, "status": code, "detail": detail})
+        if stream.task is not None:
+            stream.task.cancel()
+
+    async def run(self, sid: str, stream: _Stream, msg: dict[str, Any]) -> None:
+        deltas = None
+        try:
+            req = GenerationRequest.model_validate(msg.get("request") or {})
+            timeout = msg.get("timeout")
+            deadline = request_deadline(None, str(timeout) if timeout is not None else None)
+            principal = await self.principal()
+            prepared = consume_prepared(msg.get("prepare_token"), principal, req.model_provider) is not None
+            call = await begin_generation(principal, req, deadline, prepared)
+            async with admission.slot(principal.plan, deadline), AsyncSessionLocal() as db:
+                deltas = await open_stream(db, call)
+                self.send({"type": "start", "id": sid, "request_id": call.request_id})
+                async for delta in deltas:
+                    # A client that stops acking must not hold its admission slot, quota and upstream past the deadline
+                    try:
+                        async with asyncio.timeout(call.time_left()):
+                            await stream.credits.acquire()
+                    except TimeoutError:
+                        raise DeadlineExceeded() from None
+                    self.send({"type": "delta", "id": sid, "text": delta})
+            self.send({"type": "done", "id": sid})
+        except asyncio.CancelledError:
+            if not stream.failed:
+                self.send({"type": "canceled", "id": sid})
+        except ValidationError as e:
+            self.send({"type": "error", "id": sid, "status": 422, "detail": e.errors(include_url=False)})
+        except HTTPException as e:
+            frame = {"type": "error", "id": sid, "status": e.status_code, "detail": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                frame["retry_after"] = int(e.headers["Retry-After"])
+            self.send(frame)
+        except Exception:
+            logger.exception("websocket stream %s failed", sid)
+            self.send({"type": "error", "id": sid, "status": 500, "detail": "Generation failed"})
+        finally:
+            if deltas is not None:
+                await deltas.aclose()
+            self.streams.pop(sid, None)
+
+    async def close(self) -> None:
+        tasks = [s.task for s in self.streams.values() if s.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@router.websocket("/ws")
+async def generation_socket(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        hello = await asyncio.wait_for(websocket.receive_json(), timeout=settings.ws_auth_timeout_seconds)
+    except (asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    token = hello.get("token") if isinstance(hello, dict) and hello.get("type") == "auth" else None
+    principal = await resolve_principal(token) if token else None
+    if principal is None or not principal.is_active:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid authentication credentials")
+        return
+
+    conn = _Connection(websocket, token)
+    writer = asyncio.create_task(conn.writer())
+    conn.send({"type": "ready"})
+    try:
+        while True:
+            msg = await websocket.receive_json()
+            if isinstance(msg, dict):
+                conn.handle(msg)
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        # Cancelling the streams stops the upstream provider calls and settles billing
+        await conn.close()
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
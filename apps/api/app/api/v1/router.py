@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.v1.endpoints import auth, user, keys, generate, billing, admin
+from app.api.v1.endpoints import auth, user, keys, generate, billing, admin, ws, context
 from app.api.v1.endpoints import requests as requests_ep
 
 api_router = APIRouter()
@@ -9,6 +9,8 @@ api_router.include_router(auth.router, prefix="/auth", tags=["auth"])
 api_router.include_router(user.router, prefix="/user", tags=["user"])
 api_router.include_router(keys.router, prefix="/keys", tags=["keys"])
 api_router.include_router(generate.router, tags=["generate"])  # /generate
+api_router.include_router(ws.router, tags=["generate"])  # /ws
+api_router.include_router(context.router, prefix="/context", tags=["context"])
 api_router.include_router(billing.router, prefix="/billing", tags=["billing"])
 api_router.include_router(admin.router, prefix="/admin", tags=["admin"])
 api_router.include_router(requests_ep.router, prefix="/requests", tags=["requests"]) 
\ No newline at end of file
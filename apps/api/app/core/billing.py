@@ -1,29 +1,15 @@
 from __future__ import annotations
 from typing import Tuple
 
-try:
-    import tiktoken  # type: ignore
-except Exception:
-    tiktoken = None  # type: ignore
+from app.core.tokenizer import count_tokens
 
 
 def estimate_tokens_openai(text: str, model: str) -> int:
-    if not text:
-        return 0
-    if tiktoken is None:
-        return max(1, len(text) // 4)
-    try:
-        enc = tiktoken.encoding_for_model(model)  # may fallback
-    except Exception:
-        enc = tiktoken.get_encoding("cl100k_base")
-    return len(enc.encode(text))
+    return count_tokens("openai", text, model)
 
 
 def estimate_tokens(provider: str, text: str, model: str) -> int:
-    if provider == "openai":
-        return estimate_tokens_openai(text, model)
-    # Simple fallback for others
-    return max(1, len(text) // 4)
+    return count_tokens(provider, text, model)
 
 
 # USD per 1K tokens rough rates (example values; adjust as needed)
@@ -41,6 +27,13 @@ GEMINI_RATES = {
 }
 
 
+RATE_TABLES = {"openai": OPENAI_RATES, "anthropic": ANTHROPIC_RATES, "gemini": GEMINI_RATES}
+
+
+def priced_models() -> list[tuple[str, str]]:
+    return [(provider, model) for provider, table in RATE_TABLES.items() for model in table]
+
+
 def get_rates(provider: str, model: str) -> Tuple[float, float]:
     if provider == "openai":
         return OPENAI_RATES.get(model, (0.005, 0.015))
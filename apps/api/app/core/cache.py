@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+        touch_on_get: bool = False,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        # touch_on_get turns the TTL into an idle timeout
+        self.touch_on_get = touch_on_get
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        evicted = None
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            now = time.monotonic()
+            if expires_at <= now:
+                del self._data[key]
+                evicted = (key, value)
+                value = default
+            else:
+                self._data.move_to_end(key)
+                if self.touch_on_get:
+                    self._data[key] = (now + self.ttl, value)
+        if evicted:
+            self._evicted(*evicted)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        evicted = []
+        with self._lock:
+            old = self._data.pop(key, _MISSING)
+            if old is not _MISSING and old[1] is not value:
+                evicted.append((key, old[1]))
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._pop_oldest())
+        for k, v in evicted:
+            self._evicted(k, v)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        if item is _MISSING:
+            return default
+        self._evicted(key, item[1])
+        return item[1]
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            items = [(k, self._data.pop(k)[1]) for k in keys]
+        for k, v in items:
+            self._evicted(k, v)
+        return len(items)
+
+    def pop_oldest(self) -> Optional[tuple[Hashable, Any]]:
+        with self._lock:
+            if not self._data:
+                return None
+            key, value = self._pop_oldest()
+        self._evicted(key, value)
+        return key, value
+
+    def expire(self) -> int:
+        now = time.monotonic()
+        return self.pop_where(lambda k: self._data[k][0] <= now)
+
+    def clear(self) -> None:
+        self.pop_where(lambda k: True)
+
+    def keys(self) -> Iterator[Hashable]:
+        with self._lock:
+            return iter(list(self._data.keys()))
+
+    def _pop_oldest(self) -> tuple[Hashable, Any]:
+        key, (_, value) = self._data.popitem(last=False)
+        return key, value
+
+    def _evicted(self, key: Hashable, value: Any) -> None:
+        if self.on_evict is not None:
+            try:
+                self.on_evict(key, value)
+            except Exception:
+                pass
@@ -1,13 +1,14 @@
 import base64
-from typing import Tuple
+from functools import lru_cache
 
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 
 from app.core.config import get_settings
 
 
+@lru_cache(maxsize=16)
 def _derive_key(secret: str, salt: str) -> bytes:
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
@@ -18,10 +19,24 @@ def _derive_key(secret: str, salt: str) -> bytes:
     return base64.urlsafe_b64encode(kdf.derive(secret.encode("utf-8")))
 
 
-def get_fernet() -> Fernet:
+@lru_cache()
+def _get_keyring(secrets: tuple[str, ...], salt: str) -> MultiFernet:
+    # First secret encrypts; the rest are only tried on decrypt
+    return MultiFernet([Fernet(_derive_key(secret, salt)) for secret in secrets])
+
+
+def get_fernet() -> MultiFernet:
+    settings = get_settings()
+    return _get_keyring(tuple(settings.get_encryption_secrets()), settings.encryption_salt)
+
+
+def get_primary_fernet() -> Fernet:
     settings = get_settings()
-    key = _derive_key(settings.encryption_secret, settings.encryption_salt)
-    return Fernet(key)
+    return Fernet(_derive_key(settings.encryption_secret, settings.encryption_salt))
+
+
+def warm_keys() -> None:
+    get_fernet()
 
 
 def encrypt_value(plaintext: str) -> str:
@@ -33,4 +48,16 @@ def encrypt_value(plaintext: str) -> str:
 def decrypt_value(token: str) -> str:
     f = get_fernet()
     plaintext = f.decrypt(token.encode("utf-8"))
-    return plaintext.decode("utf-8") 
\ No newline at end of file
+    return plaintext.decode("utf-8")
+
+
+def is_current_key(token: str) -> bool:
+    try:
+        get_primary_fernet().decrypt(token.encode("utf-8"))
+        return True
+    except InvalidToken:
+        return False
+
+
+def rotate_value(token: str) -> str:
+    return get_fernet().rotate(token.encode("utf-8")).decode("utf-8")
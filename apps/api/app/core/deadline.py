@@ -0,0 +1,45 @@
+import time
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+from app.core.config import get_settings
+
+_settings = get_settings()
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Request deadline exceeded")
+
+
+def _parse_deadline(value: str) -> float:
+    # Absolute wall-clock deadline: unix seconds or ISO 8601
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def request_deadline(deadline: str | None = None, timeout: str | None = None) -> float:
+    # Returns a time.monotonic() deadline, bounded by the server's maximum request time
+    budgets: list[float] = []
+    try:
+        if timeout:
+            budgets.append(float(timeout))
+        if deadline:
+            budgets.append(_parse_deadline(deadline) - time.time())
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid X-Request-Deadline or X-Request-Timeout")
+    budget = min(budgets) if budgets else _settings.request_timeout_seconds
+    budget = min(budget, _settings.request_timeout_max_seconds)
+    if budget <= 0:
+        raise DeadlineExceeded()
+    return time.monotonic() + budget
+
+
+def remaining(deadline: float) -> float:
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+import uuid
+from typing import Callable
+
+from app.core.redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "genz:invalidate"
+
+_origin = uuid.uuid4().hex
+_handlers: dict[str, list[Callable[[str], None]]] = {}
+
+
+def on_invalidate(kind: str, handler: Callable[[str], None]) -> None:
+    _handlers.setdefault(kind, []).append(handler)
+
+
+def _dispatch(kind: str, key: str) -> None:
+    for handler in _handlers.get(kind, []):
+        try:
+            handler(key)
+        except Exception:
+            logger.exception("invalidation handler for %s failed", kind)
+
+
+async def publish(kind: str, key: str) -> None:
+    _dispatch(kind, key)
+    try:
+        await get_redis().publish(CHANNEL, f"{_origin}|{kind}|{key}")
+    except Exception:
+        logger.warning("could not broadcast %s invalidation; other workers rely on TTL", kind)
+
+
+async def listen() -> None:
+    while True:
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(CHANNEL)
+            async for message in pubsub.listen():
+                parts = str(message.get("data", "")).split("|", 2)
+                if len(parts) == 3 and parts[0] != _origin:
+                    _dispatch(parts[1], parts[2])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning("invalidation listener disconnected; retrying")
+            await asyncio.sleep(1.0)
@@ -0,0 +1,50 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+
+KEY_CACHE_HITS = Counter("key_cache_hits_total", "Provider API key cache hits", ["provider"])
+KEY_CACHE_MISSES = Counter("key_cache_misses_total", "Provider API key cache misses", ["provider"])
+
+PROVIDER_CLIENT_POOL_SIZE = Gauge("provider_client_pool_size", "Pooled provider SDK clients", ["provider"])
+PROVIDER_CLIENT_REUSE = Counter("provider_client_requests_total", "Provider SDK client lookups", ["provider", "result"])
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled database connection",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Database connections currently checked out")
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Database connections open beyond pool_size")
+
+REQUEST_LOG_QUEUE_DEPTH = Gauge("request_log_queue_depth", "Request lifecycle events waiting to be persisted")
+REQUEST_LOG_BATCH_ROWS = Histogram(
+    "request_log_batch_rows", "Rows per request log flush", buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+REQUEST_LOG_FLUSH_SECONDS = Histogram("request_log_flush_seconds", "Request log flush latency")
+REQUEST_LOG_DROPPED = Counter("request_log_dropped_total", "Request log rows dropped after repeated flush failures")
+
+RESPONSE_CACHE_REQUESTS = Counter("response_cache_requests_total", "Response cache lookups", ["result"])
+
+GENERATION_TTFT = Histogram(
+    "generation_ttft_seconds",
+    "Time from accepting a streaming generation to its first delta",
+    ["provider", "prepared"],
+    buckets=(0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0),
+)
+ROUTER_DECISIONS = Counter("model_router_decisions_total", "model=auto routing decisions", ["provider", "model", "reason"])
+PREPARE_REQUESTS = Counter("generation_prepare_total", "Prepare tokens by outcome", ["result"])
+HEDGE_OUTCOMES = Counter("generation_hedge_total", "Generations that hedged or fell back, by outcome", ["outcome"])
+
+PROVIDER_BREAKER_STATE = Gauge("provider_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ["provider", "model"])
+PROVIDER_BULKHEAD_QUEUE = Gauge("provider_bulkhead_queue_depth", "Calls waiting for a provider bulkhead slot", ["provider"])
+PROVIDER_BULKHEAD_IN_FLIGHT = Gauge("provider_bulkhead_in_flight", "Provider calls holding a bulkhead slot", ["provider"])
+PROVIDER_RETRIES = Counter("provider_retries_total", "Provider calls retried after a failure that is safe to resend", ["provider"])
+
+ADMISSION_QUEUE_DEPTH = Gauge("admission_queue_depth", "Generations waiting for an admission slot")
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Generations holding an admission slot")
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds",
+    "Time generations waited for an admission slot",
+    ["plan"],
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0),
+)
+ADMISSION_REJECTIONS = Counter("admission_rejections_total", "Generations turned away by admission control", ["plan", "reason"])
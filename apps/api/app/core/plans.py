@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy import select
+
+from app.core.config import get_settings
+from app.core.invalidation import on_invalidate, publish
+from app.db.session import AsyncSessionLocal
+from app.models.plan import Plan
+
+logger = logging.getLogger(__name__)
+_settings = get_settings()
+
+DEFAULT_PLAN = "Basic"
+
+
+@dataclass(frozen=True, slots=True)
+class PlanSnapshot:
+    name: str
+    monthly_price: float
+    token_quota: int
+    rate_limits: str | None
+
+
+_FALLBACK = PlanSnapshot(DEFAULT_PLAN, 0.0, 5000, None)
+
+
+class PlanCatalog:
+    def __init__(self):
+        self._plans: dict[str, PlanSnapshot] = {}
+        self._stale = True
+
+    async def load(self) -> None:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.scalars(select(Plan))).all()
+        self._plans = {
+            p.name: PlanSnapshot(p.name, float(p.monthly_price or 0.0), int(p.token_quota), p.rate_limits) for p in rows
+        }
+        self._stale = False
+
+    def mark_stale(self, _key: str = "") -> None:
+        self._stale = True
+
+    async def get(self, name: str | None) -> PlanSnapshot:
+        if self._stale:
+            try:
+                await self.load()
+            except Exception:
+                if not self._plans:
+                    raise
+                logger.warning("plan catalog refresh failed; serving cached plans")
+        return self._plans.get(name or DEFAULT_PLAN) or self._plans.get(DEFAULT_PLAN) or _FALLBACK
+
+
+plan_catalog = PlanCatalog()
+on_invalidate("plans", plan_catalog.mark_stale)
+
+
+async def invalidate_plans() -> None:
+    await publish("plans", "*")
+
+
+async def run_plan_refresher() -> None:
+    while True:
+        await asyncio.sleep(_settings.plan_refresh_seconds)
+        plan_catalog.mark_stale()
@@ -0,0 +1,104 @@
+import hashlib
+import time
+import uuid
+from dataclasses import dataclass
+
+from sqlalchemy import select
+
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.core.invalidation import on_invalidate, publish
+from app.core.plans import PlanSnapshot, plan_catalog
+from app.core.security import decode_access_token
+from app.db.session import AsyncSessionLocal
+from app.models.user import User
+
+_settings = get_settings()
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    id: uuid.UUID
+    is_active: bool
+    plan: PlanSnapshot
+
+    @property
+    def plan_id(self) -> str:
+        return self.plan.name
+
+    @property
+    def token_quota(self) -> int:
+        return self.plan.token_quota
+
+
+# sha256(token) -> (sub, exp): skips JWT verification for tokens we have already seen
+_tokens = TTLCache(maxsize=_settings.principal_cache_max_entries, ttl=_settings.principal_cache_ttl_seconds)
+# sub -> Principal: skips the users/plans lookups
+_principals = TTLCache(maxsize=_settings.principal_cache_max_entries, ttl=_settings.principal_cache_ttl_seconds)
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _subject_for(token: str) -> str | None:
+    key = _token_key(token)
+    now = time.time()
+    cached = _tokens.get(key)
+    if cached is not None:
+        sub, exp = cached
+        if exp is None or exp > now:
+            return sub
+        _tokens.pop(key)
+        return None
+    payload = decode_access_token(token)
+    if not payload or "sub" not in payload:
+        return None
+    sub, exp = str(payload["sub"]), payload.get("exp")
+    ttl = _settings.principal_cache_ttl_seconds
+    if exp is not None:
+        ttl = min(ttl, max(0.0, float(exp) - now))
+    _tokens.set(key, (sub, exp), ttl=ttl)
+    return sub
+
+
+async def _load_principal(sub: str) -> Principal | None:
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(select(User.id, User.is_active, User.plan_id).where(User.id == sub))).first()
+    if row is None:
+        return None
+    user_id, is_active, plan_id = row
+    return Principal(id=user_id, is_active=bool(is_active), plan=await plan_catalog.get(plan_id))
+
+
+async def resolve_principal(token: str) -> Principal | None:
+    sub = _subject_for(token)
+    if sub is None:
+        return None
+    return await get_principal(sub)
+
+
+async def get_principal(sub: str) -> Principal | None:
+    principal = _principals.get(sub)
+    if principal is None:
+        principal = await _load_principal(sub)
+        if principal is None:
+            return None
+        _principals.set(sub, principal)
+    return principal
+
+
+def _invalidate_local(sub: str) -> None:
+    if sub == "*":
+        _principals.clear()
+    else:
+        _principals.pop(sub)
+
+
+async def invalidate_principal(user_id) -> None:
+    await publish("principal", str(user_id))
+
+
+on_invalidate("principal", _invalidate_local)
+# Principals embed their plan, so a plan change must drop them too
+on_invalidate("plans", lambda _key: _principals.clear())
@@ -1,22 +1,29 @@
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from functools import lru_cache
 
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.core.redis_pool import get_redis
+from app.db.session import AsyncSessionLocal
 from app.models.user import User
 from app.models.request import RequestRecord
-from app.models.plan import Plan
+from app.core.plans import PlanSnapshot, plan_catalog
+from app.core.principal import Principal
+
+logger = logging.getLogger(__name__)
+_settings = get_settings()
 
 
-def get_user_plan(db: Session, user: User) -> Plan:
-    plan_name = user.plan_id or 'Basic'
-    plan = db.query(Plan).filter(Plan.name == plan_name).first()
-    if plan:
-        return plan
-    # default Basic if missing
-    plan = Plan(name='Basic', monthly_price=0.0, token_quota=5000)
-    db.add(plan)
-    db.commit()
-    return plan
+async def get_user_plan(db: AsyncSession, user: User | Principal) -> PlanSnapshot:
+    if isinstance(user, Principal):
+        return user.plan
+    return await plan_catalog.get(user.plan_id)
 
 
 def get_month_start(dt: datetime | None = None) -> datetime:
@@ -24,24 +31,230 @@ def get_month_start(dt: datetime | None = None) -> datetime:
     return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
 
-def monthly_tokens_used(db: Session, user: User) -> int:
-    start = get_month_start()
-    total_in = (
-        db.query(func.coalesce(func.sum(RequestRecord.tokens_in), 0))
-        .filter(RequestRecord.user_id == user.id, RequestRecord.created_at >= start)
-        .scalar()
-        or 0
-    )
-    total_out = (
-        db.query(func.coalesce(func.sum(RequestRecord.tokens_out), 0))
-        .filter(RequestRecord.user_id == user.id, RequestRecord.created_at >= start)
-        .scalar()
-        or 0
+async def _tokens_used_since(db: AsyncSession, user_id, start: datetime) -> int:
+    total_in, total_out = (
+        await db.execute(
+            select(
+                func.coalesce(func.sum(RequestRecord.tokens_in), 0),
+                func.coalesce(func.sum(RequestRecord.tokens_out), 0),
+            ).where(RequestRecord.user_id == user_id, RequestRecord.created_at >= start)
+        )
+    ).one()
+    return int(total_in or 0) + int(total_out or 0)
+
+
+async def monthly_tokens_used(db: AsyncSession, user: User | Principal) -> int:
+    return await _tokens_used_since(db, user.id, get_month_start())
+
+
+async def quota_remaining(db: AsyncSession, user: User | Principal, plan: PlanSnapshot | None = None) -> int:
+    plan = plan or await get_user_plan(db, user)
+    used = await monthly_tokens_used(db, user)
+    return max(0, int(plan.token_quota) - used)
+
+
+# Redis ledger: one hash per user per month holding settled usage ("used"),
+# in-flight reservations ("reserved") and one "r:<id>" field per reservation.
+# A sorted set tracks reservation expiry so crashed workers cannot leak quota.
+_LEDGER_TTL_SECONDS = 40 * 24 * 3600
+
+_RESERVE_LUA = """
+local key = KEYS[1]
+local expiries = KEYS[2]
+local quota = tonumber(ARGV[1])
+local amount = tonumber(ARGV[2])
+local res_id = ARGV[3]
+local res_ttl = tonumber(ARGV[4])
+local key_ttl = tonumber(ARGV[5])
+if redis.call('EXISTS', key) == 0 then
+  return {-1, 0}
+end
+local t = redis.call('TIME')
+local now = tonumber(t[1])
+local expired = redis.call('ZRANGEBYSCORE', expiries, '-inf', now)
+for _, id in ipairs(expired) do
+  local amt = tonumber(redis.call('HGET', key, 'r:' .. id))
+  if amt then
+    redis.call('HDEL', key, 'r:' .. id)
+    redis.call('HINCRBY', key, 'reserved', -amt)
+  end
+end
+if #expired > 0 then
+  redis.call('ZREMRANGEBYSCORE', expiries, '-inf', now)
+end
+local used = tonumber(redis.call('HGET', key, 'used') or '0')
+local reserved = tonumber(redis.call('HGET', key, 'reserved') or '0')
+local remaining = quota - used - reserved
+if remaining < amount then
+  return {0, remaining}
+end
+redis.call('HSET', key, 'r:' .. res_id, amount)
+redis.call('HINCRBY', key, 'reserved', amount)
+redis.call('ZADD', expiries, now + res_ttl, res_id)
+redis.call('EXPIRE', key, key_ttl)
+redis.call('EXPIRE', expiries, key_ttl)
+return {1, remaining - amount}
+"""
+
+_SETTLE_LUA = """
+local key = KEYS[1]
+local expiries = KEYS[2]
+local res_id = ARGV[1]
+local actual = tonumber(ARGV[2])
+local amt = tonumber(redis.call('HGET', key, 'r:' .. res_id))
+if amt then
+  redis.call('HDEL', key, 'r:' .. res_id)
+  redis.call('HINCRBY', key, 'reserved', -amt)
+  redis.call('ZREM', expiries, res_id)
+end
+if actual > 0 and redis.call('EXISTS', key) == 1 then
+  redis.call('HINCRBY', key, 'used', actual)
+end
+return amt or 0
+"""
+
+_INIT_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  redis.call('HSET', KEYS[1], 'used', ARGV[1], 'reserved', 0)
+  redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+redis.call('SADD', KEYS[2], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+# Raises "used" to the SQL total, never lowers it: the requests table lags the ledger
+# (write-behind log, streams settle before they are logged), so a lower SQL sum means
+# not yet persisted, not over-counted.
+_RAISE_USED_LUA = """
+local used = tonumber(redis.call('HGET', KEYS[1], 'used'))
+if used == nil or tonumber(ARGV[1]) <= used then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'used', ARGV[1])
+return 1
+"""
+
+
+@dataclass(frozen=True)
+class QuotaReservation:
+    id: str
+    user_id: str
+    month: str
+    amount: int
+    remaining: int
+    ledger: bool = True
+
+
+def _month_tag(dt: datetime | None = None) -> str:
+    return get_month_start(dt).strftime("%Y%m")
+
+
+def _ledger_keys(user_id: str, month: str) -> list[str]:
+    return [f"quota:{month}:{user_id}", f"quota:{month}:{user_id}:res"]
+
+
+def _active_key(month: str) -> str:
+    return f"quota:{month}:active"
+
+
+@lru_cache()
+def _scripts():
+    redis = get_redis()
+    return redis.register_script(_RESERVE_LUA), redis.register_script(_SETTLE_LUA), redis.register_script(_INIT_LUA)
+
+
+@lru_cache()
+def _raise_used_script():
+    return get_redis().register_script(_RAISE_USED_LUA)
+
+
+async def _load_ledger(db: AsyncSession, user: User | Principal, month: str) -> None:
+    used = await monthly_tokens_used(db, user)
+    _, _, init = _scripts()
+    await init(
+        keys=[_ledger_keys(str(user.id), month)[0], _active_key(month)],
+        args=[used, _LEDGER_TTL_SECONDS, str(user.id)],
     )
-    return int(total_in) + int(total_out)
 
 
-def quota_remaining(db: Session, user: User) -> int:
-    plan = get_user_plan(db, user)
-    used = monthly_tokens_used(db, user)
-    return max(0, int(plan.token_quota) - used) 
\ No newline at end of file
+async def reserve_quota(db: AsyncSession, user: User | Principal, plan: PlanSnapshot, amount: int) -> QuotaReservation | None:
+    user_id, month = str(user.id), _month_tag()
+    reservation_id = uuid.uuid4().hex
+    try:
+        reserve, _, _ = _scripts()
+        args = [int(plan.token_quota), int(amount), reservation_id, _settings.quota_reservation_ttl_seconds, _LEDGER_TTL_SECONDS]
+        status, remaining = await reserve(keys=_ledger_keys(user_id, month), args=args)
+        if int(status) == -1:
+            # Cold cache: rebuild this month's usage from the requests table once
+            await _load_ledger(db, user, month)
+            status, remaining = await reserve(keys=_ledger_keys(user_id, month), args=args)
+        if int(status) != 1:
+            return None
+        return QuotaReservation(reservation_id, user_id, month, int(amount), int(remaining))
+    except Exception:
+        logger.warning("quota ledger unavailable; falling back to SQL aggregates")
+    remaining = await quota_remaining(db, user, plan)
+    if remaining <= amount:
+        return None
+    return QuotaReservation(reservation_id, user_id, month, int(amount), remaining - int(amount), ledger=False)
+
+
+async def settle_quota(reservation: QuotaReservation | None, actual_tokens: int) -> None:
+    if reservation is None or not reservation.ledger:
+        return
+    try:
+        _, settle, _ = _scripts()
+        await settle(keys=_ledger_keys(reservation.user_id, reservation.month), args=[reservation.id, max(0, int(actual_tokens))])
+    except Exception:
+        logger.warning("could not settle quota reservation %s; reconciliation will correct it", reservation.id)
+
+
+async def release_quota(reservation: QuotaReservation | None) -> None:
+    await settle_quota(reservation, 0)
+
+
+async def peek_quota(db: AsyncSession, user: User | Principal, plan: PlanSnapshot) -> int:
+    # Remaining quota without reserving; also loads a cold ledger so the next reservation is one script call
+    user_id, month = str(user.id), _month_tag()
+    key = _ledger_keys(user_id, month)[0]
+    try:
+        used, reserved = await get_redis().hmget(key, "used", "reserved")
+        if used is None:
+            await _load_ledger(db, user, month)
+            used, reserved = await get_redis().hmget(key, "used", "reserved")
+        return max(0, int(plan.token_quota) - int(used or 0) - int(reserved or 0))
+    except Exception:
+        logger.warning("quota ledger unavailable; falling back to SQL aggregates")
+    return await quota_remaining(db, user, plan)
+
+
+async def reconcile_ledgers() -> int:
+    month = _month_tag()
+    redis = get_redis()
+    corrected = 0
+    start = get_month_start()
+    async with AsyncSessionLocal() as db:
+        async for user_id in redis.sscan_iter(_active_key(month)):
+            key = _ledger_keys(user_id, month)[0]
+            if not await redis.exists(key):
+                await redis.srem(_active_key(month), user_id)
+                continue
+            db_used = await _tokens_used_since(db, user_id, start)
+            # Atomic compare-and-raise, so a settlement landing meanwhile is never overwritten
+            if await _raise_used_script()(keys=[key], args=[db_used]):
+                corrected += 1
+    return corrected
+
+
+async def run_reconciler() -> None:
+    while True:
+        await asyncio.sleep(_settings.quota_reconcile_interval_seconds)
+        try:
+            corrected = await reconcile_ledgers()
+            if corrected:
+                logger.info("reconciled %d quota ledgers against the requests table", corrected)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("quota reconciliation failed")
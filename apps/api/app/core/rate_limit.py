@@ -1,28 +1,111 @@
-import time
-from typing import Tuple
-import redis
+import math
+import re
+from dataclasses import dataclass
+from functools import lru_cache
 
 from app.core.config import get_settings
+from app.core.redis_pool import get_redis
+from app.core.plans import PlanSnapshot
 
 _settings = get_settings()
 
-_client = redis.from_url(_settings.redis_url, decode_responses=True)
+# Token bucket refilled continuously at rate/ms, using Redis server time so
+# every worker agrees on the clock. Returns allowed, remaining, retry_ms, reset_ms.
+_TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+  tokens = capacity
+  ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_ms = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+else
+  retry_ms = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', key, math.ceil(capacity / rate) + 1000)
+return {allowed, math.floor(tokens), retry_ms, math.ceil((capacity - tokens) / rate)}
+"""
 
+_PERIODS = {"s": 1, "sec": 1, "second": 1, "m": 60, "min": 60, "minute": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+_SPEC = re.compile(r"^\s*(\d+)\s*/\s*([a-z]+)\s*(?:;\s*burst\s*=\s*(\d+))?\s*$")
 
-def _bucket_key(user_id: str) -> str:
-    now = int(time.time()) // 60
-    return f"rl:{user_id}:{now}"
 
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    limit: int
+    window_seconds: int
+    burst: int
 
-def check_rate_limit(user_id: str) -> Tuple[bool, int]:
-    key = _bucket_key(user_id)
+    @property
+    def refill_per_ms(self) -> float:
+        return self.limit / (self.window_seconds * 1000.0)
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    policy: RateLimitPolicy
+    remaining: int
+    reset_seconds: int
+    retry_after_seconds: int
+
+    def headers(self) -> dict[str, str]:
+        headers = {
+            "RateLimit-Limit": str(self.policy.burst),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset_seconds),
+            "RateLimit-Policy": f"{self.policy.limit};w={self.policy.window_seconds};burst={self.policy.burst}",
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after_seconds)
+        return headers
+
+
+@lru_cache(maxsize=64)
+def parse_rate_limits(spec: str | None) -> RateLimitPolicy:
+    # Plan.rate_limits format: "<requests>/<period>[;burst=<n>]", e.g. "60/minute;burst=10"
+    default = RateLimitPolicy(_settings.rate_limit_requests_per_minute, 60, _settings.rate_limit_requests_per_minute)
+    match = _SPEC.match((spec or "").lower())
+    if not match or match.group(2) not in _PERIODS:
+        return default
+    limit = int(match.group(1))
+    if limit <= 0:
+        return default
+    burst = int(match.group(3)) if match.group(3) else limit
+    return RateLimitPolicy(limit, _PERIODS[match.group(2)], max(1, burst))
+
+
+@lru_cache()
+def _bucket_script():
+    return get_redis().register_script(_TOKEN_BUCKET_LUA)
+
+
+def policy_for_plan(plan: PlanSnapshot | None) -> RateLimitPolicy:
+    return parse_rate_limits(plan.rate_limits if plan is not None else None)
+
+
+async def check_rate_limit(user_id: str, plan: PlanSnapshot | None = None) -> RateLimitResult:
+    policy = policy_for_plan(plan)
     try:
-        with _client.pipeline() as p:
-            p.incr(key)
-            p.expire(key, 90)
-            count, _ = p.execute()
-        allowed = int(count) <= _settings.rate_limit_requests_per_minute
-        remaining = max(0, _settings.rate_limit_requests_per_minute - int(count))
-        return allowed, remaining
+        allowed, remaining, retry_ms, reset_ms = await _bucket_script()(keys=[f"rl:{user_id}"], args=[policy.burst, policy.refill_per_ms])
+        return RateLimitResult(
+            allowed=bool(int(allowed)),
+            policy=policy,
+            remaining=int(remaining),
+            reset_seconds=math.ceil(int(reset_ms) / 1000),
+            retry_after_seconds=max(1, math.ceil(int(retry_ms) / 1000)),
+        )
     except Exception:
-        return True, _settings.rate_limit_requests_per_minute
\ No newline at end of file
+        return RateLimitResult(True, policy, policy.burst, 0, 0)
@@ -0,0 +1,22 @@
+from functools import lru_cache
+
+import redis.asyncio as aioredis
+
+from app.core.config import get_settings
+
+
+@lru_cache()
+def get_redis() -> aioredis.Redis:
+    settings = get_settings()
+    pool = aioredis.ConnectionPool.from_url(
+        settings.redis_url,
+        decode_responses=True,
+        max_connections=settings.redis_max_connections,
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+
+async def close_redis() -> None:
+    if get_redis.cache_info().currsize:
+        await get_redis().aclose()
+        get_redis.cache_clear()
@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta, timezone
 from typing import Any, Optional
+import uuid
 
 from jose import jwt, JWTError
 from passlib.context import CryptContext
@@ -22,7 +23,7 @@ def get_password_hash(password: str) -> str:
 def create_access_token(subject: str, expires_delta_minutes: Optional[int] = None) -> str:
     expire_minutes = expires_delta_minutes or _settings.access_token_expire_minutes
     expire = datetime.now(tz=timezone.utc) + timedelta(minutes=expire_minutes)
-    to_encode: dict[str, Any] = {"sub": subject, "exp": expire}
+    to_encode: dict[str, Any] = {"sub": subject, "exp": expire, "jti": uuid.uuid4().hex}
     return jwt.encode(to_encode, _settings.jwt_secret_key, algorithm=_settings.jwt_algorithm)
 
 
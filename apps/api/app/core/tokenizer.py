@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import math
+from functools import lru_cache
+from typing import Iterable, Sequence
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import get_settings
+
+try:
+    import tiktoken  # type: ignore
+except Exception:
+    tiktoken = None  # type: ignore
+
+_settings = get_settings()
+
+_BASE_ENCODING = "cl100k_base"
+
+# Short strings (deltas, tones, one-line prompts) repeat a lot, so their counts are memoised
+FAST_PATH_CHARS = 64
+
+
+@lru_cache(maxsize=None)
+def _base_encoder():
+    return tiktoken.get_encoding(_BASE_ENCODING) if tiktoken is not None else None
+
+
+@lru_cache(maxsize=256)
+def get_encoder(provider: str, model: str):
+    if tiktoken is None:
+        return None
+    if provider != "openai":
+        # Anthropic and Gemini tokenizers are not public; cl100k scaled by a calibration factor stands in
+        return _base_encoder()
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        return _base_encoder()
+
+
+@lru_cache(maxsize=8)
+def _parse_factors(spec: str) -> dict[str, float]:
+    # TOKENIZER_CALIBRATION format: "provider=factor,provider=factor"
+    factors = {}
+    for item in spec.split(","):
+        provider, _, value = item.partition("=")
+        try:
+            factors[provider.strip()] = float(value)
+        except ValueError:
+            continue
+    return factors
+
+
+def calibration(provider: str) -> float:
+    if provider == "openai":
+        return 1.0
+    return _parse_factors(_settings.tokenizer_calibration).get(provider, 1.0)
+
+
+def _scale(provider: str, n: int) -> int:
+    factor = calibration(provider)
+    return max(1, math.ceil(n * factor) if factor != 1.0 else n)
+
+
+def _count(provider: str, model: str, text: str) -> int:
+    enc = get_encoder(provider, model)
+    if enc is None:
+        return max(1, math.ceil(len(text) / _settings.tokenizer_chars_per_token))
+    return _scale(provider, len(enc.encode(text, disallowed_special=())))
+
+
+@lru_cache(maxsize=16384)
+def _count_short(provider: str, model: str, text: str) -> int:
+    return _count(provider, model, text)
+
+
+def count_tokens(provider: str, text: str, model: str) -> int:
+    if not text:
+        return 0
+    if len(text) <= FAST_PATH_CHARS:
+        return _count_short(provider, model, text)
+    return _count(provider, model, text)
+
+
+def count_tokens_batch(provider: str, texts: Sequence[str], model: str) -> list[int]:
+    enc = get_encoder(provider, model)
+    if enc is None or len(texts) < 2:
+        return [count_tokens(provider, t, model) for t in texts]
+    encoded = enc.encode_batch(list(texts), disallowed_special=())
+    return [_scale(provider, len(tokens)) if text else 0 for text, tokens in zip(texts, encoded)]
+
+
+async def acount_tokens(provider: str, text: str, model: str) -> int:
+    # Large inputs are encoded off the event loop; small ones are cheaper inline than a thread hop
+    if len(text) < _settings.tokenizer_offload_chars:
+        return count_tokens(provider, text, model)
+    return await run_in_threadpool(count_tokens, provider, text, model)
+
+
+def warm(models: Iterable[tuple[str, str]]) -> None:
+    # Loading BPE ranks takes hundreds of milliseconds; do it before the first request
+    for provider, model in models:
+        count_tokens(provider, "warm up", model)
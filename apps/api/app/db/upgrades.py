@@ -0,0 +1,12 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# create_all only creates missing tables, so columns added to existing tables are
+# applied here. Every statement must be safe to run on each startup.
+SCHEMA_UPGRADES = ("ALTER TABLE requests ADD COLUMN IF NOT EXISTS hedge_outcome VARCHAR(16)",)
+
+
+def apply_schema_upgrades(engine: Engine) -> None:
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
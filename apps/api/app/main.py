@@ -3,10 +3,21 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import PlainTextResponse
 
 from app.core.config import get_settings
+from app.core.billing import priced_models
+from app.core.crypto import warm_keys
+from app.core.tokenizer import warm as warm_tokenizer
+from app.core.invalidation import listen as listen_for_invalidations
+from app.core.plans import plan_catalog, run_plan_refresher
+from app.core.quota import run_reconciler as run_quota_reconciler
+from app.core.redis_pool import close_redis
 from app.api.v1.router import api_router
 from app.db.base import Base
-from app.db.session import engine
+from app.db.session import async_engine, engine
+from app.db.upgrades import apply_schema_upgrades
 from app.models.plan import Plan
+from app.services.adapters import close_clients
+from app.services.jobs import run_worker as run_job_worker, worker_name
+from app.services.request_log import request_log
 
 # Sentry
 import sentry_sdk
@@ -14,6 +25,8 @@ from sentry_sdk.integrations.fastapi import FastApiIntegration
 
 # Prometheus
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+import asyncio
+import threading
 import time
 
 REQUEST_COUNT = Counter("api_requests_total", "Total API requests", ["method", "path", "status"])
@@ -64,20 +77,55 @@ async def metrics():
 @app.on_event("startup")
 def on_startup() -> None:
     Base.metadata.create_all(bind=engine)
+    apply_schema_upgrades(engine)
     from sqlalchemy.orm import Session
 
     with Session(engine) as db:
       existing = {p.name for p in db.query(Plan).all()}
       seeds = [
-        ("Basic", 0.0, 5000),
-        ("Pro", 9.0, 100000),
-        ("Premium", 29.0, 500000),
+        ("Basic", 0.0, 5000, "20/minute;burst=5"),
+        ("Pro", 9.0, 100000, "60/minute;burst=15"),
+        ("Premium", 29.0, 500000, "120/minute;burst=30"),
       ]
-      for name, price, quota in seeds:
+      for name, price, quota, rate_limits in seeds:
         if name not in existing:
-          db.add(Plan(name=name, monthly_price=price, token_quota=quota))
+          db.add(Plan(name=name, monthly_price=price, token_quota=quota, rate_limits=rate_limits))
       db.commit()
 
+    # Derive encryption keys once up front instead of on the first request
+    warm_keys()
+    warm_tokenizer(priced_models())
+    if settings.encryption_previous_secrets:
+        from app.services.key_rotation import reencrypt_api_keys
+
+        threading.Thread(target=reencrypt_api_keys, name="key-rotation", daemon=True).start()
+
+
+_background_tasks: list[asyncio.Task] = []
+
+
+@app.on_event("startup")
+async def start_background_tasks() -> None:
+    await request_log.start()
+    await plan_catalog.load()
+    _background_tasks.append(asyncio.create_task(listen_for_invalidations()))
+    _background_tasks.append(asyncio.create_task(run_quota_reconciler()))
+    _background_tasks.append(asyncio.create_task(run_plan_refresher()))
+    for i in range(settings.job_workers):
+        _background_tasks.append(asyncio.create_task(run_job_worker(worker_name(i))))
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks() -> None:
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    await request_log.stop()
+    await close_redis()
+    await close_clients()
+    await async_engine.dispose()
+
 
 app.include_router(api_router, prefix=settings.api_v1_prefix)
 
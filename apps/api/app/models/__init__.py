@@ -1,4 +1,5 @@
 from app.models.user import User  # noqa: F401
 from app.models.key import ApiKey  # noqa: F401
 from app.models.request import RequestRecord  # noqa: F401
-from app.models.plan import Plan  # noqa: F401 
\ No newline at end of file
+from app.models.plan import Plan  # noqa: F401
+from app.models.usage import UsageDaily  # noqa: F401
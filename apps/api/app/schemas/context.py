@@ -0,0 +1,21 @@
+from pydantic import BaseModel, Field
+
+from app.core.config import get_settings
+
+_settings = get_settings()
+
+SHA256_PATTERN = r"^[0-9a-f]{64}$"
+
+
+class ContextManifest(BaseModel):
+    page_text_hash: str = Field(pattern=SHA256_PATTERN)
+    chunks: list[str] = Field(min_length=1, max_length=_settings.context_store_max_chunks)
+
+
+class ContextManifestResponse(BaseModel):
+    page_text_hash: str
+    missing: list[str]
+
+
+class ContextChunkUpload(BaseModel):
+    chunks: dict[str, str] = Field(description="Chunk text keyed by its SHA-256 hex digest")
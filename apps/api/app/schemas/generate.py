@@ -1,10 +1,13 @@
 from typing import Literal, Optional
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl, model_validator
 
 
 class GenerationContext(BaseModel):
     selected_text: Optional[str] = None
     page_text: Optional[str] = None
+    page_text_hash: Optional[str] = Field(
+        default=None, pattern=r"^[0-9a-f]{64}$", description="SHA-256 of page text uploaded via /context; used when page_text is omitted"
+    )
     url: Optional[HttpUrl] = None
     title: Optional[str] = None
 
@@ -13,19 +16,46 @@ class GenerationOptions(BaseModel):
     tone: Optional[str] = Field(default=None, description="Tone preset or freeform")
     max_tokens: Optional[int] = 512
     temperature: Optional[float] = 0.7
+    cache: bool = Field(default=False, description="Reuse a stored response for an identical prompt")
+    route: Optional[Literal["latency", "cost"]] = Field(default=None, description="Routing objective when model is \"auto\"")
+    fallback: bool = Field(default=True, description="Allow a backup model the user holds a key for when the primary is slow or failing")
 
 
 class GenerationRequest(BaseModel):
-    model: str
-    model_provider: Literal["openai", "anthropic", "gemini"]
+    model: str = Field(description='Model name, or "auto" to let the router pick provider and model')
+    model_provider: Optional[Literal["openai", "anthropic", "gemini", "stub"]] = None
     prompt: str
     context: Optional[GenerationContext] = None
     options: Optional[GenerationOptions] = None
     use_user_key: bool = True
 
+    @model_validator(mode="after")
+    def require_provider(self) -> "GenerationRequest":
+        if self.model != "auto" and self.model_provider is None:
+            raise ValueError('model_provider is required unless model is "auto"')
+        return self
+
+
+class PrepareRequest(BaseModel):
+    model: str
+    model_provider: Literal["openai", "anthropic", "gemini"]
+
+
+class PrepareResponse(BaseModel):
+    prepare_token: str
+    expires_in: int
+    quota_remaining: int
+
+
+class Usage(BaseModel):
+    tokens_in: int
+    tokens_out: int
+
 
 class GenerationResponse(BaseModel):
     id: str
     output_text: str
     model: str
-    provider: str 
\ No newline at end of file
+    provider: str
+    cached: bool = False
+    usage: Optional[Usage] = Field(default=None, description="Provider-reported token usage") 
\ No newline at end of file
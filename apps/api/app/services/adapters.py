@@ -1,13 +1,24 @@
 from abc import ABC, abstractmethod
-from typing import Iterator, Optional
+import asyncio
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, Union
+import hashlib
+import threading
+import time
 import uuid
 
-from openai import OpenAI
+import httpx
+from openai import APIConnectionError as OpenAIConnectionError, AsyncOpenAI, OpenAI
 import anthropic
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
 
-from app.models.user import User
-from app.schemas.generate import GenerationRequest, GenerationResponse
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.core.metrics import PROVIDER_CLIENT_POOL_SIZE, PROVIDER_CLIENT_REUSE
+from app.core.principal import Principal
+from app.schemas.generate import GenerationRequest, GenerationResponse, Usage
+from app.services.context_packer import pack_context
 
 
 def build_prompt(req: GenerationRequest) -> str:
@@ -20,125 +31,505 @@ def build_prompt(req: GenerationRequest) -> str:
         if req.context.selected_text:
             ctx_bits.append(f"Selected:\n{req.context.selected_text}")
         if req.context.page_text:
-            ctx_bits.append(f"Context:\n{req.context.page_text[:2000]}")
+            query = "\n".join(filter(None, [req.prompt, req.context.selected_text, req.context.title]))
+            url = str(req.context.url) if req.context.url else None
+            packed = pack_context(req.context.page_text, query, req.model_provider, req.model, url)
+            if packed:
+                ctx_bits.append(f"Context:\n{packed}")
         if ctx_bits:
             parts.append("\n\n" + "\n".join(ctx_bits))
     return "\n".join(parts)
 
 
+async def abuild_prompt(req: GenerationRequest) -> str:
+    # Packing a long page splits, indexes and tokenizes it; keep that off the event loop
+    if req.context and req.context.page_text and len(req.context.page_text) >= _settings.tokenizer_offload_chars:
+        return await run_in_threadpool(build_prompt, req)
+    return build_prompt(req)
+
+
+def _prompt(req: GenerationRequest, prompt: Optional[str]) -> str:
+    # Callers pass the prompt they already built (off the event loop) so adapters do not repack the page
+    return build_prompt(req) if prompt is None else prompt
+
+
+class ClientRegistry:
+    def __init__(self, maxsize: int, idle_seconds: float):
+        self._clients = TTLCache(maxsize=maxsize, ttl=idle_seconds, touch_on_get=True, on_evict=self._on_evict)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(kind: str, api_key: str) -> tuple[str, str]:
+        return kind, hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def get(self, kind: str, api_key: str, factory: Callable[[str], Any]) -> Any:
+        key = self._key(kind, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = factory(api_key)
+                    self._clients.set(key, client)
+                    PROVIDER_CLIENT_POOL_SIZE.labels(provider=kind).inc()
+                    PROVIDER_CLIENT_REUSE.labels(provider=kind, result="miss").inc()
+                    return client
+        PROVIDER_CLIENT_REUSE.labels(provider=kind, result="hit").inc()
+        return client
+
+    def clear(self) -> None:
+        self._clients.clear()
+
+    @staticmethod
+    def _on_evict(key, client) -> None:
+        # Clients share the provider's HTTP pool, so dropping one never closes
+        # sockets an in-flight call is still using.
+        PROVIDER_CLIENT_POOL_SIZE.labels(provider=key[0]).dec()
+
+
+_settings = get_settings()
+
+_limits = httpx.Limits(
+    max_connections=_settings.provider_max_connections,
+    max_keepalive_connections=_settings.provider_max_keepalive_connections,
+    keepalive_expiry=_settings.provider_keepalive_expiry_seconds,
+)
+_openai_http = httpx.Client(limits=_limits, timeout=httpx.Timeout(600.0, connect=10.0))
+_anthropic_http = httpx.Client(limits=_limits, timeout=httpx.Timeout(600.0, connect=10.0))
+_openai_async_http = httpx.AsyncClient(limits=_limits, timeout=httpx.Timeout(600.0, connect=10.0))
+_anthropic_async_http = httpx.AsyncClient(limits=_limits, timeout=httpx.Timeout(600.0, connect=10.0))
+
+client_registry = ClientRegistry(_settings.provider_client_pool_size, _settings.provider_client_idle_seconds)
+
+
+def get_openai_client(api_key: str) -> OpenAI:
+    return client_registry.get("openai", api_key, lambda k: OpenAI(api_key=k, http_client=_openai_http, max_retries=0))
+
+
+def get_anthropic_client(api_key: str) -> anthropic.Anthropic:
+    return client_registry.get("anthropic", api_key, lambda k: anthropic.Anthropic(api_key=k, http_client=_anthropic_http, max_retries=0))
+
+
+def get_gemini_client(api_key: str) -> glm.GenerativeServiceClient:
+    return client_registry.get("gemini", api_key, lambda k: glm.GenerativeServiceClient(client_options={"api_key": k}))
+
+
+def get_async_openai_client(api_key: str) -> AsyncOpenAI:
+    return client_registry.get("openai-async", api_key, lambda k: AsyncOpenAI(api_key=k, http_client=_openai_async_http, max_retries=0))
+
+
+def get_async_anthropic_client(api_key: str) -> anthropic.AsyncAnthropic:
+    return client_registry.get(
+        "anthropic-async", api_key, lambda k: anthropic.AsyncAnthropic(api_key=k, http_client=_anthropic_async_http, max_retries=0)
+    )
+
+
+def get_async_gemini_client(api_key: str) -> glm.GenerativeServiceAsyncClient:
+    return client_registry.get(
+        "gemini-async", api_key, lambda k: glm.GenerativeServiceAsyncClient(client_options={"api_key": k})
+    )
+
+
+_preconnected: dict[str, float] = {}
+
+
+async def _preconnect(http: httpx.AsyncClient, url: str) -> None:
+    # Any response, even a 401/404, leaves a warm TLS connection in the shared pool
+    now = time.monotonic()
+    if now - _preconnected.get(url, 0.0) < _settings.provider_keepalive_expiry_seconds / 2:
+        return
+    _preconnected[url] = now
+    try:
+        await http.head(url, timeout=2.0)
+    except httpx.HTTPError:
+        _preconnected.pop(url, None)
+
+
+async def close_clients() -> None:
+    client_registry.clear()
+    _openai_http.close()
+    _anthropic_http.close()
+    await _openai_async_http.aclose()
+    await _anthropic_async_http.aclose()
+
+
+SYSTEM_PROMPT = "You write concise, context-aware replies."
+
+
+def requested_temperature(req: GenerationRequest) -> float:
+    return req.options.temperature if req.options and req.options.temperature is not None else 0.7
+
+
+def requested_max_tokens(req: GenerationRequest) -> int:
+    return req.options.max_tokens if req.options and req.options.max_tokens is not None else 512
+
+
+def _timeout_kwargs(timeout: Optional[float]) -> dict:
+    # The SDKs treat an explicit None as "no timeout", so omit it to keep the client default
+    return {"timeout": timeout} if timeout is not None else {}
+
+
+# Streams yield text deltas and, once the provider reports it, a final Usage item
+StreamItem = Union[str, Usage]
+
+
+def _openai_usage(usage: Any) -> Optional[Usage]:
+    if usage is None:
+        return None
+    return Usage(tokens_in=usage.prompt_tokens or 0, tokens_out=usage.completion_tokens or 0)
+
+
+def _anthropic_usage(usage: Any) -> Optional[Usage]:
+    if usage is None:
+        return None
+    return Usage(tokens_in=usage.input_tokens or 0, tokens_out=usage.output_tokens or 0)
+
+
+def _gemini_usage(meta: Any) -> Optional[Usage]:
+    if meta is None or not getattr(meta, "prompt_token_count", None):
+        return None
+    return Usage(tokens_in=meta.prompt_token_count or 0, tokens_out=meta.candidates_token_count or 0)
+
+
+# Throttling, timeouts and upstream faults; another provider may well succeed
+_RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+# Rejected before any work started, so sending the same request again is safe
+_REJECTED_STATUS = frozenset({429, 503, 529})
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def status_code_of(error: BaseException) -> Optional[int]:
+    # openai/anthropic expose status_code; google.api_core errors carry the HTTP status as code
+    code = getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    if isinstance(error, (TimeoutError, httpx.TransportError, OpenAIConnectionError, anthropic.APIConnectionError)):
+        return True
+    return status_code_of(error) in _RETRYABLE_STATUS
+
+
+def is_idempotent_failure(error: BaseException) -> bool:
+    # The SDKs wrap transport errors, so look at the cause as well
+    if isinstance(error, _NOT_SENT) or isinstance(error.__cause__, _NOT_SENT):
+        return True
+    return status_code_of(error) in _REJECTED_STATUS
+
+
+def _openai_messages(full_prompt: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": full_prompt},
+    ]
+
+
 class ModelAdapter(ABC):
+    provider: str
+    requires_key = True
+
     @abstractmethod
-    def generate(self, user: User, req: GenerationRequest, api_key: Optional[str]) -> GenerationResponse:  # pragma: no cover - interface
+    def generate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:  # pragma: no cover - interface
         raise NotImplementedError
 
     @abstractmethod
-    def generate_stream(self, user: User, req: GenerationRequest, api_key: Optional[str]) -> Iterator[str]:  # pragma: no cover - interface
+    def generate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> Iterator[StreamItem]:  # pragma: no cover - interface
         raise NotImplementedError
 
+    # Async variants default to running the sync path in the threadpool so
+    # adapters without a native async client still keep the event loop free.
+    async def agenerate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        return await run_in_threadpool(self.generate, user, req, api_key, timeout, prompt)
+
+    async def agenerate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> AsyncIterator[StreamItem]:
+        async for delta in iterate_in_threadpool(self.generate_stream(user, req, api_key, timeout, prompt)):
+            yield delta
+
+    async def warm(self, api_key: str) -> None:
+        # Build (and pool) the SDK client and open the upstream connection ahead of a generation
+        return None
+
+    def _require_key(self, api_key: Optional[str]) -> str:
+        if not api_key:
+            raise ValueError(f"{self.label} API key is required")
+        return api_key
+
 
 class OpenAIAdapter(ModelAdapter):
     provider = "openai"
+    label = "OpenAI"
 
-    def generate(self, user: User, req: GenerationRequest, api_key: Optional[str]) -> GenerationResponse:
-        if not api_key:
-            raise ValueError("OpenAI API key is required")
-        client = OpenAI(api_key=api_key)
-        full_prompt = build_prompt(req)
+    async def warm(self, api_key: str) -> None:
+        client = get_async_openai_client(api_key)
+        await _preconnect(_openai_async_http, str(client.base_url))
+
+    def generate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        client = get_openai_client(self._require_key(api_key))
         completion = client.chat.completions.create(
             model=req.model,
-            messages=[
-                {"role": "system", "content": "You write concise, context-aware replies."},
-                {"role": "user", "content": full_prompt},
-            ],
-            temperature=(req.options.temperature if req.options and req.options.temperature is not None else 0.7),
-            max_tokens=(req.options.max_tokens if req.options and req.options.max_tokens is not None else 512),
+            messages=_openai_messages(_prompt(req, prompt)),
+            temperature=requested_temperature(req),
+            max_tokens=requested_max_tokens(req),
+            **_timeout_kwargs(timeout),
         )
         text = completion.choices[0].message.content or ""
-        return GenerationResponse(id=str(uuid.uuid4()), output_text=text, model=req.model, provider=self.provider)
+        return GenerationResponse(
+            id=str(uuid.uuid4()), output_text=text, model=req.model, provider=self.provider, usage=_openai_usage(completion.usage)
+        )
 
-    def generate_stream(self, user: User, req: GenerationRequest, api_key: Optional[str]) -> Iterator[str]:
-        if not api_key:
-            raise ValueError("OpenAI API key is required")
-        client = OpenAI(api_key=api_key)
-        full_prompt = build_prompt(req)
+    def generate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> Iterator[StreamItem]:
+        client = get_openai_client(self._require_key(api_key))
         stream = client.chat.completions.create(
             model=req.model,
-            messages=[
-                {"role": "system", "content": "You write concise, context-aware replies."},
-                {"role": "user", "content": full_prompt},
-            ],
-            temperature=(req.options.temperature if req.options and req.options.temperature is not None else 0.7),
-            max_tokens=(req.options.max_tokens if req.options and req.options.max_tokens is not None else 512),
+            messages=_openai_messages(_prompt(req, prompt)),
+            temperature=requested_temperature(req),
+            max_tokens=requested_max_tokens(req),
             stream=True,
+            stream_options={"include_usage": True},
+            **_timeout_kwargs(timeout),
         )
+        usage = None
         for event in stream:  # type: ignore[assignment]
-            delta = event.choices[0].delta.content or ""
+            delta = (event.choices[0].delta.content or "") if event.choices else ""
             if delta:
                 yield delta
+            # The usage chunk arrives last, with no choices
+            usage = _openai_usage(event.usage) or usage
+        if usage is not None:
+            yield usage
+
+    async def agenerate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        client = get_async_openai_client(self._require_key(api_key))
+        completion = await client.chat.completions.create(
+            model=req.model,
+            messages=_openai_messages(_prompt(req, prompt)),
+            temperature=requested_temperature(req),
+            max_tokens=requested_max_tokens(req),
+            **_timeout_kwargs(timeout),
+        )
+        text = completion.choices[0].message.content or ""
+        return GenerationResponse(
+            id=str(uuid.uuid4()), output_text=text, model=req.model, provider=self.provider, usage=_openai_usage(completion.usage)
+        )
+
+    async def agenerate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> AsyncIterator[StreamItem]:
+        client = get_async_openai_client(self._require_key(api_key))
+        stream = await client.chat.completions.create(
+            model=req.model,
+            messages=_openai_messages(_prompt(req, prompt)),
+            temperature=requested_temperature(req),
+            max_tokens=requested_max_tokens(req),
+            stream=True,
+            stream_options={"include_usage": True},
+            **_timeout_kwargs(timeout),
+        )
+        usage = None
+        async with stream:
+            async for event in stream:
+                delta = (event.choices[0].delta.content or "") if event.choices else ""
+                if delta:
+                    yield delta
+                usage = _openai_usage(event.usage) or usage
+        if usage is not None:
+            yield usage
 
 
 class AnthropicAdapter(ModelAdapter):
     provider = "anthropic"
+    label = "Anthropic"
 
-    def generate(self, user: User, req: GenerationRequest, api_key: Optional[str]) -> GenerationResponse:
-        if not api_key:
-            raise ValueError("Anthropic API key is required")
-        client = anthropic.Anthropic(api_key=api_key)
-        full_prompt = build_prompt(req)
+    async def warm(self, api_key: str) -> None:
+        client = get_async_anthropic_client(api_key)
+        await _preconnect(_anthropic_async_http, str(client.base_url))
+
+    def generate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        client = get_anthropic_client(self._require_key(api_key))
         msg = client.messages.create(
             model=req.model,
-            max_tokens=(req.options.max_tokens if req.options and req.options.max_tokens is not None else 512),
-            temperature=(req.options.temperature if req.options and req.options.temperature is not None else 0.7),
-            messages=[{"role": "user", "content": full_prompt}],
+            max_tokens=requested_max_tokens(req),
+            temperature=requested_temperature(req),
+            messages=[{"role": "user", "content": _prompt(req, prompt)}],
+            **_timeout_kwargs(timeout),
         )
         # content is a list of blocks; take text blocks
         text = "".join([c.text for c in msg.content if getattr(c, "text", None)])
-        return GenerationResponse(id=str(uuid.uuid4()), output_text=text, model=req.model, provider=self.provider)
+        return GenerationResponse(
+            id=str(uuid.uuid4()), output_text=text, model=req.model, provider=self.provider, usage=_anthropic_usage(msg.usage)
+        )
 
-    def generate_stream(self, user: User, req: GenerationRequest, api_key: Optional[str]) -> Iterator[str]:
-        if not api_key:
-            raise ValueError("Anthropic API key is required")
-        client = anthropic.Anthropic(api_key=api_key)
-        full_prompt = build_prompt(req)
+    def generate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> Iterator[StreamItem]:
+        client = get_anthropic_client(self._require_key(api_key))
         with client.messages.stream(
             model=req.model,
-            max_tokens=(req.options.max_tokens if req.options and req.options.max_tokens is not None else 512),
-            temperature=(req.options.temperature if req.options and req.options.temperature is not None else 0.7),
-            messages=[{"role": "user", "content": full_prompt}],
+            max_tokens=requested_max_tokens(req),
+            temperature=requested_temperature(req),
+            messages=[{"role": "user", "content": _prompt(req, prompt)}],
+            **_timeout_kwargs(timeout),
         ) as stream:
+            tokens_in = tokens_out = 0
             for event in stream:
                 if event.type == "content_block_delta":
                     delta = getattr(event.delta, "text", "")
                     if delta:
                         yield delta
+                elif event.type == "message_start":
+                    tokens_in = event.message.usage.input_tokens or 0
+                elif event.type == "message_delta":
+                    # Cumulative output tokens for the message so far
+                    tokens_out = event.usage.output_tokens or tokens_out
+        if tokens_in or tokens_out:
+            yield Usage(tokens_in=tokens_in, tokens_out=tokens_out)
+
+    async def agenerate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        client = get_async_anthropic_client(self._require_key(api_key))
+        msg = await client.messages.create(
+            model=req.model,
+            max_tokens=requested_max_tokens(req),
+            temperature=requested_temperature(req),
+            messages=[{"role": "user", "content": _prompt(req, prompt)}],
+            **_timeout_kwargs(timeout),
+        )
+        text = "".join([c.text for c in msg.content if getattr(c, "text", None)])
+        return GenerationResponse(
+            id=str(uuid.uuid4()), output_text=text, model=req.model, provider=self.provider, usage=_anthropic_usage(msg.usage)
+        )
+
+    async def agenerate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> AsyncIterator[StreamItem]:
+        client = get_async_anthropic_client(self._require_key(api_key))
+        async with client.messages.stream(
+            model=req.model,
+            max_tokens=requested_max_tokens(req),
+            temperature=requested_temperature(req),
+            messages=[{"role": "user", "content": _prompt(req, prompt)}],
+            **_timeout_kwargs(timeout),
+        ) as stream:
+            tokens_in = tokens_out = 0
+            async for event in stream:
+                if event.type == "content_block_delta":
+                    delta = getattr(event.delta, "text", "")
+                    if delta:
+                        yield delta
+                elif event.type == "message_start":
+                    tokens_in = event.message.usage.input_tokens or 0
+                elif event.type == "message_delta":
+                    tokens_out = event.usage.output_tokens or tokens_out
+        if tokens_in or tokens_out:
+            yield Usage(tokens_in=tokens_in, tokens_out=tokens_out)
 
 
 class GeminiAdapter(ModelAdapter):
     provider = "gemini"
+    label = "Gemini"
 
-    def _configure(self, api_key: str):
-        genai.configure(api_key=api_key)
+    def _model(self, api_key: str, model_name: str) -> genai.GenerativeModel:
+        # genai.configure() is process-global; bind per-key clients to the model instead
+        model = genai.GenerativeModel(model_name)
+        model._client = get_gemini_client(api_key)
+        return model
 
-    def generate(self, user: User, req: GenerationRequest, api_key: Optional[str]) -> GenerationResponse:
-        if not api_key:
-            raise ValueError("Gemini API key is required")
-        self._configure(api_key)
-        full_prompt = build_prompt(req)
-        model = genai.GenerativeModel(req.model)
-        res = model.generate_content(full_prompt)
+    def _async_model(self, api_key: str, model_name: str) -> genai.GenerativeModel:
+        model = genai.GenerativeModel(model_name)
+        model._async_client = get_async_gemini_client(api_key)
+        return model
+
+    async def warm(self, api_key: str) -> None:
+        # The gRPC channel connects lazily; constructing the pooled client is what can be done ahead
+        get_async_gemini_client(api_key)
+
+    def generate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        model = self._model(self._require_key(api_key), req.model)
+        res = model.generate_content(_prompt(req, prompt), request_options=_timeout_kwargs(timeout))
         text = getattr(res, "text", None) or ""
-        return GenerationResponse(id=str(uuid.uuid4()), output_text=text, model=req.model, provider=self.provider)
+        return GenerationResponse(
+            id=str(uuid.uuid4()),
+            output_text=text,
+            model=req.model,
+            provider=self.provider,
+            usage=_gemini_usage(getattr(res, "usage_metadata", None)),
+        )
 
-    def generate_stream(self, user: User, req: GenerationRequest, api_key: Optional[str]) -> Iterator[str]:
-        if not api_key:
-            raise ValueError("Gemini API key is required")
-        self._configure(api_key)
-        full_prompt = build_prompt(req)
-        model = genai.GenerativeModel(req.model)
-        for chunk in model.generate_content(full_prompt, stream=True):
+    def generate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> Iterator[StreamItem]:
+        model = self._model(self._require_key(api_key), req.model)
+        usage = None
+        for chunk in model.generate_content(_prompt(req, prompt), stream=True, request_options=_timeout_kwargs(timeout)):
             delta = getattr(chunk, "text", None) or ""
             if delta:
                 yield delta
+            # Each chunk carries running totals; the last one is final
+            usage = _gemini_usage(getattr(chunk, "usage_metadata", None)) or usage
+        if usage is not None:
+            yield usage
+
+    async def agenerate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        model = self._async_model(self._require_key(api_key), req.model)
+        res = await model.generate_content_async(_prompt(req, prompt), request_options=_timeout_kwargs(timeout))
+        text = getattr(res, "text", None) or ""
+        return GenerationResponse(
+            id=str(uuid.uuid4()),
+            output_text=text,
+            model=req.model,
+            provider=self.provider,
+            usage=_gemini_usage(getattr(res, "usage_metadata", None)),
+        )
+
+    async def agenerate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> AsyncIterator[StreamItem]:
+        model = self._async_model(self._require_key(api_key), req.model)
+        usage = None
+        async for chunk in await model.generate_content_async(_prompt(req, prompt), stream=True, request_options=_timeout_kwargs(timeout)):
+            delta = getattr(chunk, "text", None) or ""
+            if delta:
+                yield delta
+            usage = _gemini_usage(getattr(chunk, "usage_metadata", None)) or usage
+        if usage is not None:
+            yield usage
+
+
+class StubAdapter(ModelAdapter):
+    # Keyless, deterministic provider for load and admission tests (STUB_PROVIDER_ENABLED)
+    provider = "stub"
+    label = "Stub"
+    requires_key = False
+
+    @staticmethod
+    def _words(req: GenerationRequest) -> list[str]:
+        words = f"Stub reply to: {req.prompt}".split()
+        return [w + " " for w in words[: requested_max_tokens(req)]]
+
+    @staticmethod
+    def _usage(prompt: str, words: list[str]) -> Usage:
+        return Usage(tokens_in=len(prompt.split()), tokens_out=len(words))
+
+    def generate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        words = self._words(req)
+        time.sleep(_settings.stub_ttft_seconds + _settings.stub_token_interval_seconds * len(words))
+        return GenerationResponse(
+            id=str(uuid.uuid4()), output_text="".join(words), model=req.model, provider=self.provider, usage=self._usage(_prompt(req, prompt), words)
+        )
+
+    def generate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> Iterator[StreamItem]:
+        words = self._words(req)
+        time.sleep(_settings.stub_ttft_seconds)
+        for word in words:
+            yield word
+            time.sleep(_settings.stub_token_interval_seconds)
+        yield self._usage(_prompt(req, prompt), words)
+
+    async def agenerate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        words = self._words(req)
+        await asyncio.sleep(_settings.stub_ttft_seconds + _settings.stub_token_interval_seconds * len(words))
+        return GenerationResponse(
+            id=str(uuid.uuid4()), output_text="".join(words), model=req.model, provider=self.provider, usage=self._usage(_prompt(req, prompt), words)
+        )
+
+    async def agenerate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> AsyncIterator[StreamItem]:
+        words = self._words(req)
+        await asyncio.sleep(_settings.stub_ttft_seconds)
+        for word in words:
+            yield word
+            await asyncio.sleep(_settings.stub_token_interval_seconds)
+        yield self._usage(_prompt(req, prompt), words)
 
 
 def get_adapter(provider: str) -> ModelAdapter:
@@ -148,4 +539,6 @@ def get_adapter(provider: str) -> ModelAdapter:
         return AnthropicAdapter()
     if provider == "gemini":
         return GeminiAdapter()
-    raise ValueError(f"Unsupported provider: {provider}") 
\ No newline at end of file
+    if provider == "stub" and _settings.stub_provider_enabled:
+        return StubAdapter()
+    raise ValueError(f"Unsupported provider: {provider}")
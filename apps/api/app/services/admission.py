@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import AsyncIterator
+
+from fastapi import HTTPException, status
+
+from app.core.config import get_settings
+from app.core.deadline import DeadlineExceeded
+from app.core.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTIONS, ADMISSION_WAIT
+from app.core.plans import DEFAULT_PLAN, PlanSnapshot
+
+_settings = get_settings()
+
+
+class Overloaded(HTTPException):
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, retry shortly",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+@lru_cache(maxsize=8)
+def _head_starts(spec: str) -> dict[str, float]:
+    # "Premium=4,Pro=2,Basic=0": seconds each plan is treated as having arrived early
+    starts: dict[str, float] = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        try:
+            starts[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return starts
+
+
+def head_start(plan: str) -> float:
+    return _head_starts(_settings.admission_plan_head_start).get(plan, 0.0)
+
+
+@dataclass(order=True)
+class _Waiter:
+    key: float
+    seq: int
+    future: asyncio.Future = field(compare=False)
+
+
+class Ticket:
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._admitted_at)
+
+
+class AdmissionController:
+    # Waiters are ordered by arrival time minus their plan's head start, so higher
+    # plans overtake recent arrivals but every request ages to the front: no plan
+    # waits more than the largest head start behind anyone who arrived later.
+    def __init__(self, max_concurrent: int, max_queue: int, service_seconds: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._service_seconds = service_seconds
+        self._queue: list[_Waiter] = []
+        self._seq = itertools.count()
+
+    def estimated_wait(self, ahead: int) -> float:
+        if self.in_flight < self.max_concurrent and ahead == 0:
+            return 0.0
+        return (ahead + 1) * self._service_seconds / self.max_concurrent
+
+    async def admit(self, plan: PlanSnapshot | None, deadline: float) -> Ticket:
+        name = plan.name if plan is not None else DEFAULT_PLAN
+        now = time.monotonic()
+        if self.in_flight < self.max_concurrent and not self._queue:
+            return self._grant(name, 0.0)
+
+        key = now - head_start(name)
+        wait = self.estimated_wait(sum(1 for w in self._queue if w.key <= key))
+        if len(self._queue) >= self.max_queue:
+            self._reject(name, "queue_full", wait)
+        if wait > deadline - now:
+            # Fail fast rather than queue a request that cannot finish in time
+            self._reject(name, "deadline", wait)
+
+        waiter = _Waiter(key, next(self._seq), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+        try:
+            async with asyncio.timeout(max(0.0, deadline - now)):
+                await asyncio.shield(waiter.future)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as we gave up: hand the slot on
+                self._release(None)
+            else:
+                waiter.future.cancel()
+                self._forget(waiter)
+            if isinstance(e, TimeoutError):
+                ADMISSION_REJECTIONS.labels(plan=name, reason="timeout").inc()
+                raise DeadlineExceeded() from None
+            raise
+        ADMISSION_WAIT.labels(plan=name).observe(time.monotonic() - now)
+        return Ticket(self)
+
+    @asynccontextmanager
+    async def slot(self, plan: PlanSnapshot | None, deadline: float):
+        ticket = await self.admit(plan, deadline)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    async def hold(self, ticket: Ticket, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        # Keeps the slot for the life of a stream. The wrapper is started before it is
+        # returned so its cleanup runs even if the response is dropped unread.
+        async def held() -> AsyncIterator[str]:
+            try:
+                yield ""
+                async for delta in deltas:
+                    yield delta
+            finally:
+                ticket.release()
+                await deltas.aclose()
+
+        stream = held()
+        await anext(stream)
+        return stream
+
+    def _grant(self, plan: str, waited: float) -> Ticket:
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+        ADMISSION_WAIT.labels(plan=plan).observe(waited)
+        return Ticket(self)
+
+    def _reject(self, plan: str, reason: str, wait: float) -> None:
+        ADMISSION_REJECTIONS.labels(plan=plan, reason=reason).inc()
+        raise Overloaded(wait)
+
+    def _forget(self, waiter: _Waiter) -> None:
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            return
+        heapq.heapify(self._queue)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+
+    def _release(self, held_seconds: float | None) -> None:
+        if held_seconds is not None:
+            alpha = _settings.admission_service_ewma_alpha
+            self._service_seconds += alpha * (held_seconds - self._service_seconds)
+        self.in_flight -= 1
+        while self.in_flight < self.max_concurrent and self._queue:
+            waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                continue
+            self.in_flight += 1
+            waiter.future.set_result(None)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+
+admission = AdmissionController(
+    _settings.admission_max_concurrent, _settings.admission_max_queue, _settings.admission_initial_service_seconds
+)
@@ -0,0 +1,149 @@
+import hashlib
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.core.tokenizer import count_tokens_batch
+
+_settings = get_settings()
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+_STOPWORDS = frozenset(
+    "a about an and are as at be but by for from has have i in is it its of on or that the this to was were will with you your".split()
+)
+
+# BM25 parameters
+_K1 = 1.5
+_B = 0.75
+
+
+@dataclass(frozen=True, slots=True)
+class ChunkIndex:
+    chunks: tuple[str, ...]
+    tokens: tuple[int, ...]
+    terms: tuple[Counter, ...]
+    df: dict[str, int]
+    avgdl: float
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.tokens)
+
+
+_indexes = TTLCache(maxsize=_settings.context_index_cache_entries, ttl=_settings.context_index_ttl_seconds)
+
+
+def _terms(text: str) -> list[str]:
+    return [w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS]
+
+
+def split_chunks(text: str, target_chars: int | None = None) -> list[str]:
+    # Paragraphs are merged up to the target size; oversized ones are split on sentences
+    target = target_chars or _settings.context_chunk_chars
+    chunks: list[str] = []
+    current = ""
+    for para in _PARAGRAPH.split(text):
+        para = " ".join(para.split())
+        if not para:
+            continue
+        pieces = [para] if len(para) <= target else _SENTENCE.split(para)
+        for piece in pieces:
+            while len(piece) > target:
+                chunks.append(piece[:target])
+                piece = piece[target:]
+            if current and len(current) + len(piece) + 1 > target:
+                chunks.append(current)
+                current = ""
+            current = f"{current} {piece}" if current else piece
+        if current and len(current) >= target // 2:
+            chunks.append(current)
+            current = ""
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_index(text: str, provider: str, model: str) -> ChunkIndex:
+    chunks = split_chunks(text)
+    terms = [Counter(_terms(c)) for c in chunks]
+    df: Counter = Counter()
+    for t in terms:
+        df.update(t.keys())
+    avgdl = (sum(sum(t.values()) for t in terms) / len(terms)) if terms else 0.0
+    tokens = tuple(count_tokens_batch(provider, chunks, model))
+    return ChunkIndex(tuple(chunks), tokens, tuple(terms), dict(df), avgdl)
+
+
+def get_index(url: str | None, text: str, provider: str, model: str) -> ChunkIndex:
+    # Keyed by URL plus content hash so an edited page gets a fresh index
+    key = (url or "", hashlib.sha256(text.encode("utf-8")).hexdigest(), provider, model)
+    index = _indexes.get(key)
+    if index is None:
+        index = build_index(text, provider, model)
+        _indexes.set(key, index)
+    return index
+
+
+def bm25_scores(index: ChunkIndex, query: str) -> list[float]:
+    q = set(_terms(query))
+    n = len(index.chunks)
+    scores = []
+    for tf in index.terms:
+        dl = sum(tf.values())
+        score = 0.0
+        for term in q:
+            f = tf.get(term)
+            if not f:
+                continue
+            df = index.df[term]
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            score += idf * f * (_K1 + 1) / (f + _K1 * (1 - _B + _B * dl / (index.avgdl or 1)))
+        scores.append(score)
+    return scores
+
+
+@lru_cache(maxsize=64)
+def _parse_budgets(spec: str) -> dict[str, int]:
+    # CONTEXT_TOKEN_BUDGETS format: "model=tokens,model=tokens"
+    budgets = {}
+    for item in spec.split(","):
+        model, _, value = item.partition("=")
+        if model.strip() and value.strip().isdigit():
+            budgets[model.strip()] = int(value)
+    return budgets
+
+
+def token_budget(model: str) -> int:
+    return _parse_budgets(_settings.context_token_budgets).get(model, _settings.context_token_budget)
+
+
+def pack_context(page_text: str, query: str, provider: str, model: str, url: str | None = None) -> str:
+    budget = token_budget(model)
+    if budget <= 0 or not page_text.strip():
+        return ""
+    index = get_index(url, page_text, provider, model)
+    if index.total_tokens <= budget:
+        return "\n\n".join(index.chunks)
+
+    scores = bm25_scores(index, query)
+    if any(scores):
+        # Chunks sharing no terms with the query are boilerplate as far as ranking can tell
+        order = sorted((i for i, s in enumerate(scores) if s > 0), key=lambda i: (-scores[i], i))
+    else:
+        # Without any overlap with the query, fall back to the start of the page
+        order = range(len(scores))
+    picked: list[int] = []
+    used = 0
+    for i in order:
+        if used + index.tokens[i] > budget:
+            continue
+        picked.append(i)
+        used += index.tokens[i]
+    # Emit in page order so neighbouring chunks still read naturally
+    return "\n\n".join(index.chunks[i] for i in sorted(picked))
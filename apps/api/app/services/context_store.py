@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+
+from fastapi import HTTPException, status
+
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.core.redis_pool import get_redis
+from app.schemas.generate import GenerationRequest
+
+logger = logging.getLogger(__name__)
+_settings = get_settings()
+
+
+def sha256_hex(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ContextStore:
+    # Content-addressed page text, namespaced per user so one account cannot probe
+    # for another's pages. Chunks are cached in memory (LRU, capped by bytes) in
+    # front of Redis; both expire after CONTEXT_STORE_TTL_SECONDS.
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._bytes = 0
+        self._chunks = TTLCache(maxsize=1_000_000, ttl=ttl, on_evict=self._on_evict)
+        self._manifests = TTLCache(maxsize=10_000, ttl=ttl)
+
+    def _on_evict(self, key, value: str) -> None:
+        self._bytes -= len(value)
+
+    def _remember(self, key: tuple[str, str], text: str) -> None:
+        if len(text) > self.max_bytes or self._chunks.get(key) is not None:
+            return
+        self._chunks.set(key, text)
+        self._bytes += len(text)
+        while self._bytes > self.max_bytes and self._chunks.pop_oldest() is not None:
+            pass
+
+    @staticmethod
+    def _chunk_key(user_id: str, digest: str) -> str:
+        return f"ctx:{user_id}:c:{digest}"
+
+    @staticmethod
+    def _manifest_key(user_id: str, digest: str) -> str:
+        return f"ctx:{user_id}:m:{digest}"
+
+    async def _get_chunks(self, user_id: str, digests: list[str]) -> dict[str, str]:
+        found = {}
+        for d in digests:
+            text = self._chunks.get((user_id, d))
+            if text is not None:
+                found[d] = text
+        remote = [d for d in dict.fromkeys(digests) if d not in found]
+        if remote:
+            try:
+                values = await get_redis().mget([self._chunk_key(user_id, d) for d in remote])
+            except Exception:
+                logger.warning("context store unavailable; using in-memory chunks only")
+                values = [None] * len(remote)
+            for d, value in zip(remote, values):
+                if value is not None:
+                    text = value.decode("utf-8") if isinstance(value, bytes) else value
+                    found[d] = text
+                    self._remember((user_id, d), text)
+        return found
+
+    async def put_manifest(self, user_id: str, page_hash: str, digests: list[str]) -> list[str]:
+        self._manifests.set((user_id, page_hash), digests)
+        try:
+            await get_redis().set(self._manifest_key(user_id, page_hash), json.dumps(digests), ex=self.ttl)
+        except Exception:
+            logger.warning("context store unavailable; manifest kept in memory only")
+        present = await self._get_chunks(user_id, digests)
+        return [d for d in dict.fromkeys(digests) if d not in present]
+
+    async def put_chunks(self, user_id: str, chunks: dict[str, str]) -> int:
+        for digest, text in chunks.items():
+            if len(text.encode("utf-8")) > _settings.context_store_max_chunk_bytes:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Chunk {digest} is too large")
+            if sha256_hex(text) != digest:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Chunk {digest} does not match its hash")
+        for digest, text in chunks.items():
+            self._remember((user_id, digest), text)
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for digest, text in chunks.items():
+                    pipe.set(self._chunk_key(user_id, digest), text, ex=self.ttl)
+                await pipe.execute()
+        except Exception:
+            logger.warning("context store unavailable; chunks kept in memory only")
+        return len(chunks)
+
+    async def _get_manifest(self, user_id: str, page_hash: str) -> list[str] | None:
+        digests = self._manifests.get((user_id, page_hash))
+        if digests is not None:
+            return digests
+        try:
+            raw = await get_redis().get(self._manifest_key(user_id, page_hash))
+        except Exception:
+            return None
+        if raw is None:
+            return None
+        digests = json.loads(raw)
+        self._manifests.set((user_id, page_hash), digests)
+        return digests
+
+    async def get_page(self, user_id: str, page_hash: str) -> str | None:
+        digests = await self._get_manifest(user_id, page_hash)
+        if digests is None:
+            return None
+        chunks = await self._get_chunks(user_id, digests)
+        if len(chunks) < len(set(digests)):
+            return None
+        text = "".join(chunks[d] for d in digests)
+        return text if sha256_hex(text) == page_hash else None
+
+
+context_store = ContextStore(_settings.context_store_max_bytes, _settings.context_store_ttl_seconds)
+
+
+async def resolve_context(user_id, req: GenerationRequest) -> GenerationRequest:
+    # Fills page_text from the store when the client sent only its hash
+    ctx = req.context
+    if ctx is None or ctx.page_text is not None or not ctx.page_text_hash:
+        return req
+    text = await context_store.get_page(str(user_id), ctx.page_text_hash)
+    if text is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Unknown page_text_hash; upload the context manifest first")
+    return req.model_copy(update={"context": ctx.model_copy(update={"page_text": text})})
@@ -0,0 +1,424 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.billing import compute_cost_usd
+from app.core.config import get_settings
+from app.core.deadline import DeadlineExceeded, remaining, request_deadline
+from app.core.metrics import GENERATION_TTFT, HEDGE_OUTCOMES
+from app.core.principal import Principal
+from app.core.quota import QuotaReservation, peek_quota, release_quota, reserve_quota, settle_quota
+from app.core.rate_limit import RateLimitResult, check_rate_limit
+from app.core.tokenizer import acount_tokens
+from app.models.request import RequestRecord
+from app.schemas.generate import GenerationRequest, GenerationResponse, Usage
+from app.services.adapters import ModelAdapter, StreamItem, abuild_prompt, is_retryable_error, requested_max_tokens
+from app.services.context_store import resolve_context
+from app.services.keys import resolve_user_key
+from app.services.request_log import log_request, new_record
+from app.services.resilience import resilient_adapter
+from app.services.response_cache import cache_key, response_cache
+from app.services.router import model_router, route_request
+
+_settings = get_settings()
+
+
+@dataclass
+class GenerationCall:
+    principal: Principal
+    req: GenerationRequest
+    rate_limit: RateLimitResult | None
+    record: dict[str, Any]
+    prompt_hash: str
+    full_prompt: str
+    needed_in: int
+    deadline: float
+    prepared: bool = False
+    started_at: float = field(default_factory=time.monotonic)
+
+    def time_left(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def request_id(self) -> str:
+        return str(self.record["id"])
+
+    @property
+    def use_cache(self) -> bool:
+        return bool(self.req.options and self.req.options.cache)
+
+    @property
+    def allow_fallback(self) -> bool:
+        return _settings.hedge_enabled and (self.req.options is None or self.req.options.fallback)
+
+
+async def begin_generation(
+    principal: Principal, req: GenerationRequest, deadline: float | None = None, prepared: bool = False
+) -> GenerationCall:
+    limit = await check_rate_limit(str(principal.id), principal.plan)
+    if not limit.allowed:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded", headers=limit.headers())
+    req = await resolve_context(principal.id, req)
+    req = await route_request(principal, req)
+    call = await build_call(principal, req, limit, deadline=deadline)
+    call.prepared = prepared
+    return call
+
+
+async def build_call(
+    principal: Principal,
+    req: GenerationRequest,
+    rate_limit: RateLimitResult | None = None,
+    record: dict[str, Any] | None = None,
+    deadline: float | None = None,
+) -> GenerationCall:
+    if not req.use_user_key:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Server key flow not configured")
+
+    # Sizes the quota reservation and is the fallback when a provider reports no usage
+    full_prompt = await abuild_prompt(req)
+    needed_in = await acount_tokens(req.model_provider, full_prompt, req.model)
+
+    prompt_hash = cache_key(principal.id, req, full_prompt)
+    if record is None:
+        url_str = str(req.context.url) if (req.context and req.context.url) else None
+        domain, path = RequestRecord.parse_domain_path(url_str)
+        record = new_record(
+            user_id=principal.id,
+            domain=domain,
+            path=path,
+            model=req.model,
+            model_provider=req.model_provider,
+            prompt_hash=prompt_hash,
+            status="started",
+        )
+    return GenerationCall(principal, req, rate_limit, record, prompt_hash, full_prompt, needed_in, deadline or request_deadline())
+
+
+@dataclass
+class _Attempt:
+    req: GenerationRequest
+    adapter: ModelAdapter
+    api_key: str
+    prompt: str
+    reservation: QuotaReservation
+    upstream: AsyncIterator[StreamItem] | None = None
+    started_at: float = field(default_factory=time.monotonic)
+    answered_at: float | None = None
+    reason: str | None = None
+
+    async def abandon(self) -> None:
+        # Losers and failures are never billed: release the hold and hang up on the provider
+        await release_quota(self.reservation)
+        if self.upstream is not None:
+            await self.upstream.aclose()
+
+
+async def _resolve_adapter(db: AsyncSession, call: GenerationCall, req: GenerationRequest) -> tuple[ModelAdapter, str | None]:
+    try:
+        adapter = resilient_adapter(req.model_provider)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    api_key = await resolve_user_key(db, call.principal.id, req.model_provider)
+    if not api_key and adapter.requires_key:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No user key found for provider")
+    return adapter, api_key
+
+
+async def _authorize_cached(db: AsyncSession, call: GenerationCall) -> None:
+    # A replay skips the provider, but the caller must still be able to make the live call
+    await _resolve_adapter(db, call, call.req)
+    if await peek_quota(db, call.principal, call.principal.plan) <= 0:
+        raise HTTPException(status_code=402, detail="Monthly quota exceeded")
+
+
+async def _acquire(db: AsyncSession, call: GenerationCall, req: GenerationRequest | None = None) -> _Attempt:
+    req = req or call.req
+    adapter, api_key = await _resolve_adapter(db, call, req)
+    # Backups pack the page to their own model's budget
+    prompt = call.full_prompt if req is call.req else await abuild_prompt(req)
+    reservation = await reserve_quota(db, call.principal, call.principal.plan, call.needed_in + requested_max_tokens(req))
+    if reservation is None:
+        raise HTTPException(status_code=402, detail="Monthly quota exceeded")
+    return _Attempt(req, adapter, api_key, prompt, reservation)
+
+
+async def _race(
+    db: AsyncSession, call: GenerationCall, primary: _Attempt, answer: Callable[[_Attempt], Awaitable[Any]], kind: str
+) -> tuple[_Attempt, Any]:
+    # Runs the primary; a backup starts when it is slower than the hedge threshold
+    # ("hedge") or fails retryably ("fallback"). The first answer wins, the rest are canceled.
+    allowed = call.allow_fallback
+    pending: dict[asyncio.Task, _Attempt] = {}
+    backups: list[GenerationRequest] | None = None
+    launched = 0
+    hedge_delay = model_router.hedge_delay(primary.req.model_provider, primary.req.model, kind) if allowed else None
+    hedged = hedge_delay is None
+    error: BaseException | None = None
+
+    def launch(attempt: _Attempt, reason: str | None) -> None:
+        nonlocal launched
+        launched += 1
+        attempt.reason = reason
+        pending[asyncio.ensure_future(answer(attempt))] = attempt
+
+    async def launch_backup(reason: str) -> None:
+        nonlocal backups
+        if backups is None:
+            alternatives = await model_router.alternatives(call.principal, call.req, call.needed_in)
+            backups = [call.req.model_copy(update={"model_provider": p, "model": m}) for p, m in alternatives]
+        while backups and launched < _settings.hedge_max_attempts:
+            try:
+                attempt = await _acquire(db, call, backups.pop(0))
+            except HTTPException:
+                continue
+            launch(attempt, reason)
+            return
+
+    def finish(outcome: str | None) -> None:
+        if outcome is not None:
+            call.record["hedge_outcome"] = outcome
+            HEDGE_OUTCOMES.labels(outcome=outcome).inc()
+
+    launch(primary, None)
+    try:
+        while pending:
+            timeout = call.time_left()
+            if not hedged:
+                hedge_at = primary.started_at + hedge_delay
+                timeout = min(timeout, max(0.0, hedge_at - time.monotonic()))
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if call.time_left() <= 0:
+                    raise TimeoutError()
+                hedged = True
+                await launch_backup("hedge")
+                continue
+            for task in done:
+                attempt = pending.pop(task)
+                try:
+                    value = task.result()
+                except Exception as e:
+                    error = e
+                    model_router.record(attempt.req.model_provider, attempt.req.model, error=True)
+                    await attempt.abandon()
+                    if allowed and not pending and call.time_left() > 0 and is_retryable_error(e):
+                        await launch_backup("fallback")
+                    continue
+                attempt.answered_at = time.monotonic()
+                if attempt is not primary:
+                    finish(attempt.reason)
+                    call.record.update(model=attempt.req.model, model_provider=attempt.req.model_provider)
+                else:
+                    finish("primary" if launched > 1 else None)
+                return attempt, value
+        raise error or TimeoutError()
+    except Exception:
+        finish("exhausted" if launched > 1 else None)
+        raise
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for attempt in pending.values():
+            await attempt.abandon()
+
+
+async def _failed(call: GenerationCall, error: Exception) -> HTTPException:
+    # SDK timeouts surface as provider-specific errors; the clock decides
+    expired = isinstance(error, TimeoutError) or call.time_left() <= 0
+    call.record.update(status="timeout" if expired else "error")
+    await log_request(call.record)
+    if expired:
+        return DeadlineExceeded()
+    if isinstance(error, HTTPException):
+        return error
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+
+async def _log_cache_hit(call: GenerationCall) -> None:
+    # Replays cost nothing upstream, so they are recorded without tokens or cost
+    call.record.update(status="cached", tokens_in=0, tokens_out=0, cost_usd=0.0)
+    await log_request(call.record)
+
+
+async def run_generation(db: AsyncSession, call: GenerationCall) -> GenerationResponse:
+    req, rec = call.req, call.record
+
+    async def answer(attempt: _Attempt) -> GenerationResponse:
+        return await attempt.adapter.agenerate(call.principal, attempt.req, attempt.api_key, timeout=call.time_left(), prompt=attempt.prompt)
+
+    async def compute() -> dict[str, Any]:
+        remaining(call.deadline)
+        primary = await _acquire(db, call)
+        await log_request(rec)
+        try:
+            attempt, result = await _race(db, call, primary, answer, "latency")
+        except Exception as e:
+            raise await _failed(call, e) from e
+        won = attempt.req
+        if result.usage is not None:
+            tin, tout = result.usage.tokens_in, result.usage.tokens_out
+        else:
+            tin = call.needed_in
+            tout = await acount_tokens(won.model_provider, result.output_text, won.model)
+        elapsed = attempt.answered_at - attempt.started_at
+        model_router.record(won.model_provider, won.model, tokens_per_second=tout / elapsed if elapsed > 0 else None, latency=elapsed)
+        rec.update(tokens_in=tin, tokens_out=tout, cost_usd=compute_cost_usd(won.model_provider, won.model, tin, tout), status="success")
+        await log_request(rec)
+        await settle_quota(attempt.reservation, tin + tout)
+        return {"output_text": result.output_text, "tokens_in": tin, "tokens_out": tout, "model": won.model, "provider": won.model_provider}
+
+    cached = False
+    if call.use_cache:
+        await _authorize_cached(db, call)
+        value, cached = await response_cache.get_or_compute(call.prompt_hash, compute)
+        if cached:
+            await _log_cache_hit(call)
+    else:
+        value = await compute()
+    return GenerationResponse(
+        id=call.request_id,
+        output_text=value["output_text"],
+        model=value.get("model", req.model),
+        provider=value.get("provider", req.model_provider),
+        cached=cached,
+        usage=None if cached else Usage(tokens_in=value["tokens_in"], tokens_out=value["tokens_out"]),
+    )
+
+
+async def open_stream(db: AsyncSession, call: GenerationCall) -> AsyncIterator[str]:
+    # Everything that can fail with an HTTP status runs here, before the first byte is sent
+    lead = None
+    if call.use_cache:
+        await _authorize_cached(db, call)
+        cached = await response_cache.get(call.prompt_hash)
+        if cached is None and response_cache.in_flight(call.prompt_hash):
+            cached = await response_cache.wait(call.prompt_hash)
+        if cached is not None:
+            await _log_cache_hit(call)
+            return _replay(cached["output_text"])
+        # Lead before the provider call so duplicates arriving during TTFT wait for this one
+        lead = response_cache.lead(call.prompt_hash)
+    try:
+        stream = await _start_stream(db, call, lead)
+    except BaseException:
+        if lead is not None:
+            await response_cache.finish(call.prompt_hash, lead, None)
+        raise
+    # From here _stream owns the lead and finishes it when it ends
+    try:
+        head = await anext(stream)
+    except StopAsyncIteration:
+        return _replay("")
+    return _prepend(head, stream)
+
+
+async def _start_stream(db: AsyncSession, call: GenerationCall, lead) -> AsyncIterator[str]:
+    async def answer(attempt: _Attempt) -> StreamItem | None:
+        attempt.upstream = attempt.adapter.agenerate_stream(
+            call.principal, attempt.req, attempt.api_key, timeout=call.time_left(), prompt=attempt.prompt
+        )
+        try:
+            return await anext(attempt.upstream)
+        except StopAsyncIteration:
+            return None
+
+    remaining(call.deadline)
+    primary = await _acquire(db, call)
+    call.record.update(status="streaming", tokens_in=call.needed_in)
+    await log_request(call.record)
+    # Racing until the first token lets upstream failures and deadlines still map to an HTTP status
+    try:
+        attempt, first = await _race(db, call, primary, answer, "ttft")
+    except Exception as e:
+        raise await _failed(call, e) from e
+    return _stream(call, attempt, first, lead)
+
+
+async def _replay(text: str) -> AsyncIterator[str]:
+    if text:
+        yield text
+
+
+async def _prepend(first: str, rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    try:
+        yield first
+        async for delta in rest:
+            yield delta
+    finally:
+        await rest.aclose()
+
+
+async def _stream(call: GenerationCall, attempt: _Attempt, first: StreamItem | None, lead) -> AsyncIterator[str]:
+    req, rec, upstream = attempt.req, call.record, attempt.upstream
+    buffered = [] if first is None else [first]
+    parts: list[str] = []
+    usage: Usage | None = None
+    outcome = "error"
+    first_at: float | None = None
+    ttft = GENERATION_TTFT.labels(provider=req.model_provider, prepared=str(call.prepared).lower())
+    try:
+        while True:
+            if buffered:
+                delta = buffered.pop()
+            else:
+                try:
+                    async with asyncio.timeout(call.time_left()):
+                        delta = await anext(upstream)
+                except StopAsyncIteration:
+                    break
+            if isinstance(delta, Usage):
+                usage = delta
+                continue
+            if first_at is None:
+                first_at = time.monotonic()
+                ttft.observe(first_at - call.started_at)
+            parts.append(delta)
+            yield delta
+        outcome = "success"
+    except (GeneratorExit, asyncio.CancelledError):
+        # The client went away: stop pulling from the provider and bill what was delivered
+        outcome = "canceled"
+        raise
+    except Exception as e:
+        if isinstance(e, TimeoutError) or call.time_left() <= 0:
+            outcome = "timeout"
+            raise DeadlineExceeded() from e
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+    finally:
+        await upstream.aclose()
+        text = "".join(parts)
+        if usage is not None:
+            tokens_in, out_total = usage.tokens_in, usage.tokens_out
+        else:
+            # Canceled streams and providers without usage: one local pass over the delivered text
+            tokens_in = call.needed_in
+            out_total = await acount_tokens(req.model_provider, text, req.model)
+        if outcome == "success" and first_at is not None:
+            generating = time.monotonic() - first_at
+            model_router.record(
+                req.model_provider,
+                req.model,
+                ttft=attempt.answered_at - attempt.started_at,
+                tokens_per_second=out_total / generating if generating > 0 and out_total > 1 else None,
+            )
+        elif outcome in ("error", "timeout"):
+            model_router.record(req.model_provider, req.model, error=True)
+        value = None
+        if outcome == "success":
+            await settle_quota(attempt.reservation, tokens_in + out_total)
+            cost = compute_cost_usd(req.model_provider, req.model, tokens_in, out_total)
+            rec.update(tokens_in=tokens_in, tokens_out=out_total, cost_usd=cost, status="success")
+            value = {"output_text": text, "tokens_in": tokens_in, "tokens_out": out_total}
+        else:
+            await settle_quota(attempt.reservation, tokens_in + out_total if out_total > 0 else 0)
+            cost = compute_cost_usd(req.model_provider, req.model, tokens_in, out_total) if out_total > 0 else 0.0
+            rec.update(status=outcome, tokens_in=tokens_in, tokens_out=out_total, cost_usd=cost)
+        await log_request(rec)
+        if lead is not None:
+            await response_cache.finish(call.prompt_hash, lead, value)
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from fastapi import HTTPException, status
+
+from app.core.config import get_settings
+from app.core.redis_pool import get_redis
+from app.schemas.generate import GenerationRequest, GenerationResponse
+
+logger = logging.getLogger(__name__)
+_settings = get_settings()
+
+_POLL_INTERVAL = 0.25
+
+
+def fingerprint(req: GenerationRequest, kind: str) -> str:
+    body = json.dumps([kind, req.model_dump(mode="json")], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class _Live:
+    # In-process view of a running generation that retries on this worker can attach to
+    def __init__(self, fp: str):
+        self.fp = fp
+        self.parts: list[str] = []
+        self.result: dict[str, Any] | None = None
+        self.done = False
+        self.lease: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def append(self, part: str) -> None:
+        self.parts.append(part)
+        self._notify()
+
+    def finish(self, result: dict[str, Any] | None) -> None:
+        self.result = result
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self) -> dict[str, Any] | None:
+        while not self.done:
+            await self._changed.wait()
+        return self.result
+
+    async def follow(self) -> AsyncIterator[str]:
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.parts):
+                sent += 1
+                yield self.parts[sent - 1]
+            if self.done:
+                if self.result is None:
+                    raise RuntimeError("Original request failed")
+                return
+            await changed.wait()
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: int, wait_seconds: float, lease: int):
+        self.ttl = ttl
+        self.wait_seconds = wait_seconds
+        self.lease = lease
+        self._live: dict[str, _Live] = {}
+
+    @staticmethod
+    def _key(user_id, key: str) -> str:
+        return f"idem:{user_id}:{key}"
+
+    async def _claim(self, rkey: str, fp: str) -> dict[str, Any] | None:
+        # Pending claims only hold a short lease, so a crashed worker blocks retries briefly
+        pending = json.dumps({"fp": fp, "state": "pending"})
+        if await get_redis().set(rkey, pending, nx=True, ex=self.lease):
+            return None
+        raw = await get_redis().get(rkey)
+        return json.loads(raw) if raw else {"state": "gone"}
+
+    async def _renew(self, rkey: str, fp: str) -> None:
+        pending = json.dumps({"fp": fp, "state": "pending"})
+        while True:
+            await asyncio.sleep(max(1.0, self.lease / 3))
+            try:
+                await get_redis().set(rkey, pending, xx=True, ex=self.lease)
+            except Exception:
+                logger.warning("idempotency lease renewal failed for %s", rkey)
+
+    def _own(self, rkey: str, fp: str) -> _Live:
+        live = self._live[rkey] = _Live(fp)
+        live.lease = asyncio.create_task(self._renew(rkey, fp))
+        return live
+
+    async def _finish(self, rkey: str, fp: str, live: _Live, result: dict[str, Any] | None) -> None:
+        # Stop renewing before the final write so a late renewal cannot overwrite it
+        live.lease.cancel()
+        await asyncio.gather(live.lease, return_exceptions=True)
+        try:
+            if result is not None:
+                await get_redis().set(rkey, json.dumps({"fp": fp, "state": "done", "result": result}), ex=self.ttl)
+            else:
+                # Failed attempts are forgotten so the client may retry with the same key
+                await get_redis().delete(rkey)
+        except Exception:
+            logger.warning("idempotency store unavailable; %s not recorded", rkey)
+        live.finish(result)
+        self._live.pop(rkey, None)
+
+    async def _wait_remote(self, rkey: str) -> dict[str, Any] | None:
+        deadline = time.monotonic() + self.wait_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(_POLL_INTERVAL)
+            raw = await get_redis().get(rkey)
+            if not raw:
+                return None
+            entry = json.loads(raw)
+            if entry.get("state") == "done":
+                return entry
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A request with this Idempotency-Key is still in progress")
+
+    async def _existing(self, rkey: str, fp: str) -> tuple[dict[str, Any] | None, _Live | None]:
+        # Returns the stored result, a live run to attach to, or (None, None) if we now own the key
+        for _ in range(2):
+            entry = await self._claim(rkey, fp)
+            if entry is None:
+                return None, None
+            if entry.get("state") == "gone":
+                continue
+            if entry.get("fp") != fp:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT, detail="Idempotency-Key was already used with a different request body"
+                )
+            if entry.get("state") == "done":
+                return entry["result"], None
+            live = self._live.get(rkey)
+            if live is not None:
+                return None, live
+            done = await self._wait_remote(rkey)
+            if done is not None:
+                return done["result"], None
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A request with this Idempotency-Key is still in progress")
+
+    async def _lookup(self, rkey: str, fp: str) -> tuple[dict[str, Any] | None, _Live | None, bool]:
+        # Like rate limits and quota, a Redis outage degrades to running without replay protection
+        try:
+            stored, live = await self._existing(rkey, fp)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.warning("idempotency store unavailable; running %s unprotected", rkey)
+            return None, None, False
+        return stored, live, True
+
+    async def _once(self, rkey: str, fp: str, produce: Callable[[], Awaitable[dict[str, Any]]]) -> dict[str, Any]:
+        stored, live, available = await self._lookup(rkey, fp)
+        if not available:
+            return await produce()
+        if stored is not None:
+            return stored
+        if live is not None:
+            result = await live.wait()
+            return result if result is not None else await self._once(rkey, fp, produce)
+
+        live = self._own(rkey, fp)
+        result = None
+        try:
+            result = await produce()
+            return result
+        finally:
+            await self._finish(rkey, fp, live, result)
+
+    async def run(
+        self, user_id, key: str, req: GenerationRequest, produce: Callable[[], Awaitable[GenerationResponse]]
+    ) -> GenerationResponse:
+        async def compute() -> dict[str, Any]:
+            return {"response": (await produce()).model_dump(mode="json")}
+
+        result = await self._once(self._key(user_id, key), fingerprint(req, "generate"), compute)
+        return GenerationResponse(**result["response"])
+
+    async def run_job(
+        self, user_id, key: str, req: GenerationRequest, produce: Callable[[], Awaitable[dict[str, Any]]]
+    ) -> dict[str, Any]:
+        # Stores the 202 payload, so a retried submission gets the same job instead of queueing (and billing) another
+        async def compute() -> dict[str, Any]:
+            return {"job": await produce()}
+
+        result = await self._once(self._key(user_id, key), fingerprint(req, "job"), compute)
+        return result["job"]
+
+    async def run_stream(
+        self, user_id, key: str, req: GenerationRequest, produce: Callable[[], Awaitable[AsyncIterator[str]]]
+    ) -> AsyncIterator[str]:
+        rkey, fp = self._key(user_id, key), fingerprint(req, "stream")
+        stored, live, available = await self._lookup(rkey, fp)
+        if not available:
+            return await produce()
+        if stored is not None:
+            return _replay(stored["transcript"])
+        if live is not None:
+            return live.follow()
+
+        live = self._own(rkey, fp)
+        try:
+            deltas = await produce()
+        except BaseException:
+            await self._finish(rkey, fp, live, None)
+            raise
+        return self._record(rkey, fp, live, deltas)
+
+    async def _record(self, rkey: str, fp: str, live: _Live, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        result = None
+        try:
+            async for delta in deltas:
+                live.append(delta)
+                yield delta
+            result = {"transcript": "".join(live.parts)}
+        finally:
+            await self._finish(rkey, fp, live, result)
+
+
+async def _replay(text: str) -> AsyncIterator[str]:
+    if text:
+        yield text
+
+
+idempotency = IdempotencyStore(
+    ttl=_settings.idempotency_ttl_seconds,
+    wait_seconds=_settings.idempotency_wait_seconds,
+    lease=_settings.idempotency_lease_seconds,
+)
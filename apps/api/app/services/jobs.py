@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Any
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app.core.config import get_settings
+from app.core.principal import get_principal
+from app.core.redis_pool import get_redis
+from app.db.session import AsyncSessionLocal
+from app.models.request import RequestRecord
+from app.schemas.generate import GenerationRequest
+from app.services.generation import GenerationCall, build_call, run_generation
+from app.services.request_log import log_request
+from app.services.usage_rollup import FINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+_settings = get_settings()
+
+STREAM = "genz:jobs"
+GROUP = "generators"
+
+
+def _job_key(request_id: str) -> str:
+    return f"job:{request_id}"
+
+
+def _channel(request_id: str) -> str:
+    return f"job:{request_id}:events"
+
+
+async def enqueue_generation(call: GenerationCall) -> dict[str, Any]:
+    redis = get_redis()
+    call.record.update(status="queued")
+    await log_request(call.record)
+    key = _job_key(call.request_id)
+    await redis.hset(key, mapping={"status": "queued", "user_id": str(call.principal.id), "attempts": 0})
+    await redis.expire(key, _settings.job_result_ttl_seconds)
+    payload = {
+        "record": json.dumps(call.record, default=str),
+        "request": call.req.model_dump_json(),
+    }
+    await redis.xadd(STREAM, payload)
+    return {"id": call.request_id, "status": "queued"}
+
+
+async def get_job(request_id: str) -> dict[str, str] | None:
+    job = await get_redis().hgetall(_job_key(request_id))
+    return job or None
+
+
+async def wait_for_job(request_id: str, timeout: float) -> dict[str, str] | None:
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(_channel(request_id))
+    try:
+        # Check after subscribing so a completion between the two is not missed
+        job = await get_job(request_id)
+        deadline = time.monotonic() + timeout
+        while job is not None and job.get("status") not in FINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await pubsub.get_message(timeout=min(remaining, 1.0))
+            job = await get_job(request_id)
+        return job
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+
+async def _set_status(request_id: str, **fields: Any) -> None:
+    redis = get_redis()
+    await redis.hset(_job_key(request_id), mapping={k: v for k, v in fields.items() if v is not None})
+    # The hash is the source of truth; waiters also poll it, so a lost notification only delays them
+    try:
+        await redis.publish(_channel(request_id), fields.get("status", ""))
+    except Exception:
+        logger.warning("job %s status notification failed", request_id)
+
+
+async def _finished(request_id: str) -> bool:
+    # Redelivered messages must not call the provider (and bill) a second time
+    job = await get_job(request_id)
+    if job is not None and job.get("status") in FINAL_STATUSES:
+        return True
+    async with AsyncSessionLocal() as db:
+        status = await db.scalar(select(RequestRecord.status).where(RequestRecord.id == uuid.UUID(request_id)))
+    if status not in FINAL_STATUSES:
+        return False
+    # The worker died after the generation was logged but before the result was stored
+    if status == "success":
+        await _set_status(request_id, status="success", error="Result was lost; resubmit to regenerate")
+    else:
+        await _set_status(request_id, status="error", error=f"Generation ended with status {status}")
+    return True
+
+
+def _load_record(raw: str) -> dict[str, Any]:
+    rec = json.loads(raw)
+    rec["id"] = uuid.UUID(rec["id"])
+    rec["user_id"] = uuid.UUID(rec["user_id"]) if rec.get("user_id") else None
+    rec["created_at"] = datetime.fromisoformat(rec["created_at"])
+    return rec
+
+
+async def _process(fields: dict[str, str]) -> None:
+    rec = _load_record(fields["record"])
+    request_id = str(rec["id"])
+    if await _finished(request_id):
+        return
+    attempts = await get_redis().hincrby(_job_key(request_id), "attempts", 1)
+    if attempts > _settings.job_max_attempts:
+        rec.update(status="error")
+        await log_request(rec)
+        await _set_status(request_id, status="error", error="Job exceeded its retry budget")
+        return
+    principal = await get_principal(str(rec["user_id"]))
+    if principal is None or not principal.is_active:
+        rec.update(status="error")
+        await log_request(rec)
+        await _set_status(request_id, status="error", error="Inactive or missing user")
+        return
+
+    await _set_status(request_id, status="running")
+    req = GenerationRequest.model_validate_json(fields["request"])
+    rec.update(status="started")
+    try:
+        async with AsyncSessionLocal() as db:
+            call = await build_call(principal, req, record=rec)
+            result = await run_generation(db, call)
+    except HTTPException as e:
+        # A timeout or cancel was already logged as final; logging again would double-count it
+        if rec.get("status") not in FINAL_STATUSES:
+            rec.update(status="error")
+            await log_request(rec)
+        await _set_status(request_id, status="error", error=str(e.detail))
+        return
+    await _set_status(
+        request_id, status="success", output_text=result.output_text, model=result.model, provider=result.provider
+    )
+
+
+async def _heartbeat(redis, consumer: str, message_id: str) -> None:
+    # Re-claiming our own message resets its idle time, so long generations are not
+    # handed to another worker while this one is still alive
+    interval = max(1.0, _settings.job_visibility_timeout_seconds / 3)
+    while True:
+        await asyncio.sleep(interval)
+        await redis.xclaim(STREAM, GROUP, consumer, min_idle_time=0, message_ids=[message_id], justid=True)
+
+
+async def _ensure_group(redis) -> None:
+    try:
+        await redis.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+    except Exception as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def run_worker(consumer: str) -> None:
+    redis = get_redis()
+    visibility_ms = _settings.job_visibility_timeout_seconds * 1000
+    while True:
+        try:
+            await _ensure_group(redis)
+            # Jobs whose worker died are redelivered once they exceed the visibility timeout
+            claimed = await redis.xautoclaim(STREAM, GROUP, consumer, min_idle_time=visibility_ms, start_id="0-0", count=1)
+            entries = claimed[1] if claimed else []
+            if not entries:
+                response = await redis.xreadgroup(GROUP, consumer, {STREAM: ">"}, count=1, block=5000)
+                entries = response[0][1] if response else []
+            for message_id, fields in entries:
+                heartbeat = asyncio.create_task(_heartbeat(redis, consumer, message_id))
+                try:
+                    await _process(fields)
+                except Exception:
+                    logger.exception("generation job %s failed; it will be retried", message_id)
+                    continue
+                finally:
+                    heartbeat.cancel()
+                await redis.xack(STREAM, GROUP, message_id)
+                await redis.xdel(STREAM, message_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("generation worker %s error; retrying", consumer)
+            await asyncio.sleep(1.0)
+
+
+def worker_name(index: int) -> str:
+    return f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}-{index}"
+
+
+async def _main() -> None:
+    from app.core.plans import plan_catalog
+    from app.services.request_log import request_log
+
+    await request_log.start()
+    await plan_catalog.load()
+    try:
+        await asyncio.gather(*(run_worker(worker_name(i)) for i in range(max(1, _settings.job_workers))))
+    finally:
+        await request_log.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
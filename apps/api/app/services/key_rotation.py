@@ -0,0 +1,49 @@
+import logging
+
+from cryptography.fernet import InvalidToken
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.core.crypto import is_current_key, rotate_value
+from app.db.session import SessionLocal
+from app.models.key import ApiKey
+
+logger = logging.getLogger(__name__)
+
+
+def reencrypt_batch(db: Session, after_id=None, batch_size: int = 200) -> tuple[int, int, object]:
+    q = db.query(ApiKey).order_by(ApiKey.id)
+    if after_id is not None:
+        q = q.filter(ApiKey.id > after_id)
+    rows = q.limit(batch_size).all()
+    scanned, rotated = len(rows), 0
+    for row in rows:
+        if is_current_key(row.key_encrypted):
+            continue
+        try:
+            row.key_encrypted = rotate_value(row.key_encrypted)
+            rotated += 1
+        except InvalidToken:
+            logger.warning("api key %s cannot be decrypted with any configured secret", row.id)
+    if rotated:
+        db.commit()
+    return scanned, rotated, (rows[-1].id if rows else None)
+
+
+def reencrypt_api_keys() -> int:
+    settings = get_settings()
+    total, after_id = 0, None
+    while True:
+        with SessionLocal() as db:
+            scanned, rotated, after_id = reencrypt_batch(db, after_id, settings.key_rotation_batch_size)
+        total += rotated
+        if scanned < settings.key_rotation_batch_size:
+            break
+    if total:
+        logger.info("re-encrypted %d api keys under the current encryption secret", total)
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"re-encrypted {reencrypt_api_keys()} keys")
@@ -0,0 +1,48 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.core.crypto import decrypt_value
+from app.core.invalidation import on_invalidate, publish
+from app.core.metrics import KEY_CACHE_HITS, KEY_CACHE_MISSES
+from app.models.key import ApiKey
+
+_settings = get_settings()
+
+_cache = TTLCache(maxsize=_settings.key_cache_max_entries, ttl=_settings.key_cache_ttl_seconds)
+
+
+async def resolve_user_key(db: AsyncSession, user_id, provider: str) -> str | None:
+    cache_key = (str(user_id), provider)
+    cached = _cache.get(cache_key)
+    if cached is not None:
+        KEY_CACHE_HITS.labels(provider=provider).inc()
+        return cached
+    KEY_CACHE_MISSES.labels(provider=provider).inc()
+    key_row = await db.scalar(
+        select(ApiKey)
+        .where(ApiKey.user_id == user_id, ApiKey.provider == provider)
+        .order_by(ApiKey.created_at.desc())
+        .limit(1)
+    )
+    if not key_row:
+        return None
+    api_key = decrypt_value(key_row.key_encrypted)
+    _cache.set(cache_key, api_key)
+    return api_key
+
+
+def _invalidate_local(key: str) -> None:
+    user_id, _, provider = key.partition(":")
+    if provider:
+        _cache.pop((user_id, provider))
+    else:
+        _cache.pop_where(lambda k: k[0] == user_id)
+
+
+async def invalidate_user_key(user_id, provider: str | None = None) -> None:
+    await publish("key", f"{user_id}:{provider or ''}")
+
+
+on_invalidate("key", _invalidate_local)
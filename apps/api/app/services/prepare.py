@@ -0,0 +1,56 @@
+import secrets
+from dataclasses import dataclass
+
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.core.metrics import PREPARE_REQUESTS
+from app.core.principal import Principal
+from app.core.quota import peek_quota
+from app.core.tokenizer import warm as warm_tokenizer
+from app.services.adapters import get_adapter
+from app.services.keys import resolve_user_key
+
+_settings = get_settings()
+
+
+@dataclass(frozen=True, slots=True)
+class PreparedCall:
+    user_id: str
+    provider: str
+    model: str
+
+
+# The warmed state (key cache, client pool, connection, ledger) lives in this worker;
+# a token presented to another worker just takes the normal path.
+_prepared = TTLCache(maxsize=_settings.prepare_max_entries, ttl=_settings.prepare_token_ttl_seconds)
+
+
+async def prepare_generation(db: AsyncSession, principal: Principal, provider: str, model: str) -> tuple[str, int]:
+    api_key = await resolve_user_key(db, principal.id, provider)
+    if not api_key:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No user key found for provider")
+    remaining = await peek_quota(db, principal, principal.plan)
+    if remaining <= 0:
+        raise HTTPException(status_code=402, detail="Monthly quota exceeded")
+    await get_adapter(provider).warm(api_key)
+    # Loads the tokenizer used to size the quota reservation
+    await run_in_threadpool(warm_tokenizer, [(provider, model)])
+    token = secrets.token_urlsafe(24)
+    _prepared.set(token, PreparedCall(str(principal.id), provider, model))
+    PREPARE_REQUESTS.labels(result="issued").inc()
+    return token, remaining
+
+
+def consume_prepared(token: str | None, principal: Principal, provider: str) -> PreparedCall | None:
+    if not token:
+        return None
+    prepared = _prepared.pop(token)
+    if prepared is None or prepared.user_id != str(principal.id) or prepared.provider != provider:
+        PREPARE_REQUESTS.labels(result="miss").inc()
+        return None
+    PREPARE_REQUESTS.labels(result="used").inc()
+    return prepared
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.config import get_settings
+from app.core.metrics import REQUEST_LOG_BATCH_ROWS, REQUEST_LOG_DROPPED, REQUEST_LOG_FLUSH_SECONDS, REQUEST_LOG_QUEUE_DEPTH
+from app.db.session import AsyncSessionLocal
+from app.models.request import RequestRecord
+from app.services.usage_rollup import FINAL_STATUSES, apply_rollups
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = (
+    "id",
+    "user_id",
+    "domain",
+    "path",
+    "model",
+    "model_provider",
+    "prompt_hash",
+    "tokens_in",
+    "tokens_out",
+    "cost_usd",
+    "status",
+    "hedge_outcome",
+    "created_at",
+)
+_MUTABLE = ("model", "model_provider", "prompt_hash", "tokens_in", "tokens_out", "cost_usd", "status", "hedge_outcome")
+_FLUSH_ATTEMPTS = 3
+
+
+def new_record(**fields: Any) -> dict[str, Any]:
+    # IDs and timestamps are assigned here so callers never wait on the DB
+    record = {column: None for column in _COLUMNS}
+    record.update(id=uuid.uuid4(), created_at=datetime.now(tz=timezone.utc))
+    record.update(fields)
+    return record
+
+
+class RequestLogWriter:
+    def __init__(self, batch_size: int, flush_interval: float, buffer_size: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.buffer_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    async def submit(self, record: dict[str, Any]) -> None:
+        if self._queue is None:
+            # Writer not running (scripts, tests): persist synchronously
+            await self._flush([dict(record)])
+            return
+        # Blocks the producer when the buffer is full, which is our backpressure
+        await self._queue.put(dict(record))
+        REQUEST_LOG_QUEUE_DEPTH.set(self._queue.qsize())
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            REQUEST_LOG_QUEUE_DEPTH.set(self._queue.qsize())
+            await self._flush(batch)
+        # Drain whatever arrived after the stop sentinel
+        leftover = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                leftover.append(item)
+        if leftover:
+            await self._flush(leftover)
+
+    async def _flush(self, events: list[dict[str, Any]]) -> None:
+        latest: dict[Any, dict[str, Any]] = {}
+        finalized: list[dict[str, Any]] = []
+        for event in events:
+            latest[event["id"]] = event
+            if event.get("status") in FINAL_STATUSES:
+                finalized.append(event)
+        rows = [{column: row.get(column) for column in _COLUMNS} for row in latest.values()]
+        stmt = insert(RequestRecord).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RequestRecord.id],
+            set_={column: getattr(stmt.excluded, column) for column in _MUTABLE},
+            # Processes flush independently, so a late "queued" or "started" must not undo a final status
+            where=or_(RequestRecord.status.not_in(FINAL_STATUSES), stmt.excluded.status.in_(FINAL_STATUSES)),
+        )
+        for attempt in range(1, _FLUSH_ATTEMPTS + 1):
+            start = time.perf_counter()
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(stmt)
+                    await apply_rollups(db, finalized)
+                    await db.commit()
+                REQUEST_LOG_BATCH_ROWS.observe(len(rows))
+                REQUEST_LOG_FLUSH_SECONDS.observe(time.perf_counter() - start)
+                return
+            except Exception:
+                logger.exception("request log flush failed (attempt %d/%d)", attempt, _FLUSH_ATTEMPTS)
+                await asyncio.sleep(0.5 * attempt)
+        REQUEST_LOG_DROPPED.inc(len(rows))
+
+
+_settings = get_settings()
+
+request_log = RequestLogWriter(
+    batch_size=_settings.request_log_batch_size,
+    flush_interval=_settings.request_log_flush_interval_ms / 1000.0,
+    buffer_size=_settings.request_log_buffer_size,
+)
+
+
+async def log_request(record: dict[str, Any]) -> None:
+    await request_log.submit(record)
@@ -0,0 +1,234 @@
+import asyncio
+import math
+import random
+import time
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+from fastapi import HTTPException, status
+
+from app.core.config import get_settings
+from app.core.metrics import PROVIDER_BREAKER_STATE, PROVIDER_BULKHEAD_IN_FLIGHT, PROVIDER_BULKHEAD_QUEUE, PROVIDER_RETRIES
+from app.core.principal import Principal
+from app.schemas.generate import GenerationRequest, GenerationResponse
+from app.services.adapters import ModelAdapter, StreamItem, get_adapter, is_idempotent_failure, is_retryable_error, status_code_of
+
+_settings = get_settings()
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class ProviderUnavailable(HTTPException):
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+def _trips_breaker(error: BaseException) -> bool:
+    # 429s are usually one user's key hitting its limit, not the provider degrading
+    return is_retryable_error(error) and status_code_of(error) != 429
+
+
+class CircuitBreaker:
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self._gauge = PROVIDER_BREAKER_STATE.labels(provider=provider, model=model)
+        self._gauge.set(_STATE_VALUES[CLOSED])
+
+    def is_open(self) -> bool:
+        return self.state == OPEN and time.monotonic() - self.opened_at < _settings.breaker_open_seconds
+
+    def acquire(self) -> bool:
+        # Returns whether this call is a half-open probe
+        if self.state == OPEN:
+            wait = self.opened_at + _settings.breaker_open_seconds - time.monotonic()
+            if wait > 0:
+                raise ProviderUnavailable(f"{self.model} is temporarily unavailable", wait)
+            self._move(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probes >= _settings.breaker_half_open_probes:
+                raise ProviderUnavailable(f"{self.model} is temporarily unavailable", 1)
+            self.probes += 1
+            return True
+        return False
+
+    def release(self, probe: bool) -> None:
+        if probe:
+            self.probes = max(0, self.probes - 1)
+
+    def succeeded(self, probe: bool) -> None:
+        self.release(probe)
+        self.failures = 0
+        if self.state != CLOSED:
+            self._move(CLOSED)
+
+    def failed(self, probe: bool, error: BaseException) -> None:
+        self.release(probe)
+        if not _trips_breaker(error):
+            return
+        self.failures += 1
+        if (probe and self.state == HALF_OPEN) or self.failures >= _settings.breaker_failure_threshold:
+            self.opened_at = time.monotonic()
+            self._move(OPEN)
+
+    def _move(self, state: str) -> None:
+        self.state = state
+        if state != HALF_OPEN:
+            self.probes = 0
+        self._gauge.set(_STATE_VALUES[state])
+
+
+class Bulkhead:
+    # Caps in-flight calls to one provider in this worker so a slow provider
+    # cannot hold every slot (and threadpool thread) healthy providers need
+    def __init__(self, provider: str):
+        self.provider = provider
+        self._slots = asyncio.Semaphore(_settings.bulkhead_max_concurrent)
+        self._queued = PROVIDER_BULKHEAD_QUEUE.labels(provider=provider)
+        self._in_flight = PROVIDER_BULKHEAD_IN_FLIGHT.labels(provider=provider)
+
+    async def acquire(self, timeout: Optional[float]) -> None:
+        wait = _settings.bulkhead_wait_seconds if timeout is None else min(timeout, _settings.bulkhead_wait_seconds)
+        self._queued.inc()
+        try:
+            async with asyncio.timeout(wait):
+                await self._slots.acquire()
+        except TimeoutError:
+            raise ProviderUnavailable(f"Too many in-flight {self.provider} calls", wait) from None
+        finally:
+            self._queued.dec()
+        self._in_flight.inc()
+
+    def release(self) -> None:
+        self._slots.release()
+        self._in_flight.dec()
+
+
+_breakers: dict[tuple[str, str], CircuitBreaker] = {}
+_bulkheads: dict[str, Bulkhead] = {}
+
+
+def breaker(provider: str, model: str) -> CircuitBreaker:
+    if (provider, model) not in _breakers:
+        _breakers[(provider, model)] = CircuitBreaker(provider, model)
+    return _breakers[(provider, model)]
+
+
+def bulkhead(provider: str) -> Bulkhead:
+    if provider not in _bulkheads:
+        _bulkheads[provider] = Bulkhead(provider)
+    return _bulkheads[provider]
+
+
+def circuit_open(provider: str, model: str) -> bool:
+    cb = _breakers.get((provider, model))
+    return cb is not None and cb.is_open()
+
+
+def _left(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+async def _backoff(provider: str, error: Exception, attempt: int, deadline: Optional[float]) -> bool:
+    # Full-jitter exponential backoff, only when the provider never took the request
+    if isinstance(error, ProviderUnavailable) or attempt >= _settings.provider_retry_attempts or not is_idempotent_failure(error):
+        return False
+    delay = random.uniform(0, min(_settings.provider_retry_max_seconds, _settings.provider_retry_base_seconds * 2**attempt))
+    if deadline is not None and time.monotonic() + delay >= deadline:
+        return False
+    PROVIDER_RETRIES.labels(provider=provider).inc()
+    await asyncio.sleep(delay)
+    return True
+
+
+class ResilientAdapter(ModelAdapter):
+    def __init__(self, inner: ModelAdapter):
+        self.inner = inner
+        self.provider = inner.provider
+        self.label = inner.label
+        self.requires_key = inner.requires_key
+
+    def generate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        return self.inner.generate(user, req, api_key, timeout, prompt)
+
+    def generate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> Iterator[StreamItem]:
+        return self.inner.generate_stream(user, req, api_key, timeout, prompt)
+
+    async def warm(self, api_key: str) -> None:
+        await self.inner.warm(api_key)
+
+    @asynccontextmanager
+    async def _guarded(self, model: str, deadline: Optional[float]):
+        cb = breaker(self.provider, model)
+        probe = cb.acquire()
+        slots = bulkhead(self.provider)
+        try:
+            await slots.acquire(_left(deadline))
+        except BaseException:
+            cb.release(probe)
+            raise
+        try:
+            yield
+        except Exception as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                # The caller's own deadline ran out (clients pick it), which says nothing about the provider
+                cb.release(probe)
+            else:
+                cb.failed(probe, e)
+            raise
+        except BaseException:
+            # Canceled calls say nothing about provider health
+            cb.release(probe)
+            raise
+        else:
+            cb.succeeded(probe)
+        finally:
+            slots.release()
+
+    async def agenerate(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> GenerationResponse:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            try:
+                async with self._guarded(req.model, deadline):
+                    return await self.inner.agenerate(user, req, api_key, timeout=_left(deadline), prompt=prompt)
+            except Exception as e:
+                if not await _backoff(self.provider, e, attempt, deadline):
+                    raise
+            attempt += 1
+
+    async def agenerate_stream(self, user: Principal, req: GenerationRequest, api_key: Optional[str], timeout: Optional[float] = None, prompt: Optional[str] = None) -> AsyncIterator[StreamItem]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with self._guarded(req.model, deadline):
+                    async with aclosing(self.inner.agenerate_stream(user, req, api_key, timeout=_left(deadline), prompt=prompt)) as items:
+                        async for item in items:
+                            started = True
+                            yield item
+                return
+            except Exception as e:
+                # Once output has been delivered a retry would duplicate it
+                if started or not await _backoff(self.provider, e, attempt, deadline):
+                    raise
+            attempt += 1
+
+
+_adapters: dict[str, ResilientAdapter] = {}
+
+
+def resilient_adapter(provider: str) -> ModelAdapter:
+    if provider not in _adapters:
+        _adapters[provider] = ResilientAdapter(get_adapter(provider))
+    return _adapters[provider]
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable
+
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.core.metrics import RESPONSE_CACHE_REQUESTS
+from app.core.redis_pool import get_redis
+from app.schemas.generate import GenerationRequest
+from app.services.adapters import requested_max_tokens, requested_temperature
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(user_id, req: GenerationRequest, full_prompt: str) -> str:
+    # Scoped per user: a stored reply is never served to someone else
+    canonical = json.dumps(
+        [str(user_id), req.model_provider, req.model, full_prompt, requested_temperature(req), requested_max_tokens(req)],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, max_entry_bytes: int, ttl: int):
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self._memory = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _redis_key(key: str) -> str:
+        return f"rc:{key}"
+
+    async def get(self, key: str) -> dict[str, Any] | None:
+        value = self._memory.get(key)
+        if value is not None:
+            RESPONSE_CACHE_REQUESTS.labels(result="memory_hit").inc()
+            return value
+        try:
+            raw = await get_redis().get(self._redis_key(key))
+        except Exception:
+            raw = None
+        if raw:
+            value = json.loads(raw)
+            self._memory.set(key, value)
+            RESPONSE_CACHE_REQUESTS.labels(result="redis_hit").inc()
+            return value
+        RESPONSE_CACHE_REQUESTS.labels(result="miss").inc()
+        return None
+
+    async def set(self, key: str, value: dict[str, Any]) -> None:
+        raw = json.dumps(value, ensure_ascii=False)
+        if len(raw) > self.max_entry_bytes:
+            return
+        self._memory.set(key, value)
+        try:
+            await get_redis().set(self._redis_key(key), raw, ex=self.ttl)
+        except Exception:
+            logger.warning("response cache redis tier unavailable")
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def wait(self, key: str) -> dict[str, Any] | None:
+        # Resolves to None when the leading call failed or was abandoned
+        future = self._inflight.get(key)
+        if future is None:
+            return None
+        value = await asyncio.shield(future)
+        if value is not None:
+            RESPONSE_CACHE_REQUESTS.labels(result="coalesced").inc()
+        return value
+
+    def lead(self, key: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
+
+    async def finish(self, key: str, future: asyncio.Future, value: dict[str, Any] | None) -> None:
+        if value is not None:
+            await self.set(key, value)
+        if not future.done():
+            future.set_result(value)
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[dict[str, Any]]]
+    ) -> tuple[dict[str, Any], bool]:
+        cached = await self.get(key)
+        if cached is None and self.in_flight(key):
+            cached = await self.wait(key)
+        if cached is not None:
+            return cached, True
+        future = self.lead(key)
+        value = None
+        try:
+            value = await compute()
+            return value, False
+        finally:
+            await self.finish(key, future, value)
+
+
+_settings = get_settings()
+
+response_cache = ResponseCache(
+    max_entries=_settings.response_cache_max_entries,
+    max_entry_bytes=_settings.response_cache_max_entry_bytes,
+    ttl=_settings.response_cache_ttl_seconds,
+)
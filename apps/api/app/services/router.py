@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+
+from fastapi import HTTPException, status
+
+from app.core.billing import compute_cost_usd, priced_models
+from app.core.config import get_settings
+from app.core.metrics import ROUTER_DECISIONS
+from app.core.principal import Principal
+from app.core.redis_pool import get_redis
+from app.core.tokenizer import acount_tokens
+from app.db.session import AsyncSessionLocal
+from app.schemas.generate import GenerationRequest
+from app.services.adapters import abuild_prompt, requested_max_tokens
+from app.services.keys import resolve_user_key
+from app.services.resilience import circuit_open
+
+logger = logging.getLogger(__name__)
+_settings = get_settings()
+
+AUTO_MODEL = "auto"
+
+# EWMA update shared by every worker. ARGV: alpha, ttft, tokens/sec, error (0/1), ttl.
+# Empty values leave that statistic untouched.
+_RECORD_LUA = """
+local alpha = tonumber(ARGV[1])
+local function ewma(field, value)
+  if value == '' then
+    return
+  end
+  local v = tonumber(value)
+  local old = tonumber(redis.call('HGET', KEYS[1], field))
+  if old then
+    v = old + alpha * (v - old)
+  end
+  redis.call('HSET', KEYS[1], field, tostring(v))
+end
+ewma('ttft', ARGV[2])
+ewma('tput', ARGV[3])
+ewma('err', ARGV[4])
+redis.call('HINCRBY', KEYS[1], 'n', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+
+@dataclass(slots=True)
+class ModelStats:
+    ttft: float | None = None
+    tokens_per_second: float | None = None
+    error_rate: float = 0.0
+    samples: int = 0
+
+    def observe(self, alpha: float, ttft: float | None, tokens_per_second: float | None, error: bool) -> None:
+        def ewma(old: float | None, value: float) -> float:
+            return value if old is None else old + alpha * (value - old)
+
+        if ttft is not None:
+            self.ttft = ewma(self.ttft, ttft)
+        if tokens_per_second is not None:
+            self.tokens_per_second = ewma(self.tokens_per_second, tokens_per_second)
+        self.error_rate = ewma(self.error_rate if self.samples else None, 1.0 if error else 0.0)
+        self.samples += 1
+
+    def expected_seconds(self, max_tokens: int) -> float | None:
+        if self.ttft is None:
+            return None
+        return self.ttft + (max_tokens / self.tokens_per_second if self.tokens_per_second else 0.0)
+
+
+@dataclass(frozen=True, slots=True)
+class Candidate:
+    provider: str
+    model: str
+    cost_usd: float
+    stats: ModelStats
+
+
+@lru_cache(maxsize=8)
+def _fallback_chain(spec: str) -> tuple[tuple[str, str], ...]:
+    # "provider:model,provider:model" in order of preference
+    chain = []
+    for item in spec.split(","):
+        provider, _, model = item.partition(":")
+        if provider.strip() and model.strip():
+            chain.append((provider.strip(), model.strip()))
+    return tuple(chain)
+
+
+@lru_cache()
+def _record_script():
+    return get_redis().register_script(_RECORD_LUA)
+
+
+class ModelRouter:
+    def __init__(self):
+        self._stats: dict[tuple[str, str], ModelStats] = {}
+        self._refreshed_at = 0.0
+        self._pending: set[asyncio.Task] = set()
+        # Recent raw timings per (provider, model, "ttft" | "latency") for hedge thresholds
+        self._windows: dict[tuple[str, str, str], deque[float]] = {}
+
+    def stats(self, provider: str, model: str) -> ModelStats:
+        return self._stats.setdefault((provider, model), ModelStats())
+
+    def record(
+        self,
+        provider: str,
+        model: str,
+        ttft: float | None = None,
+        tokens_per_second: float | None = None,
+        error: bool = False,
+        latency: float | None = None,
+    ) -> None:
+        for kind, value in (("ttft", ttft), ("latency", latency)):
+            if value is not None:
+                self._windows.setdefault((provider, model, kind), deque(maxlen=_settings.hedge_window)).append(value)
+        self.stats(provider, model).observe(_settings.router_ewma_alpha, ttft, tokens_per_second, error)
+        task = asyncio.ensure_future(self._push(provider, model, ttft, tokens_per_second, error))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _push(self, provider: str, model: str, ttft: float | None, tokens_per_second: float | None, error: bool) -> None:
+        args = [
+            _settings.router_ewma_alpha,
+            "" if ttft is None else ttft,
+            "" if tokens_per_second is None else tokens_per_second,
+            1 if error else 0,
+            _settings.router_stats_ttl_seconds,
+        ]
+        try:
+            await _record_script()(keys=[f"router:{provider}:{model}"], args=args)
+        except Exception:
+            logger.debug("router stats not shared; redis unavailable")
+
+    def hedge_delay(self, provider: str, model: str, kind: str) -> float | None:
+        # No hedging until the model has a measured percentile: a guessed threshold
+        # would duplicate ordinary calls on the user's own keys
+        window = self._windows.get((provider, model, kind))
+        if not window or len(window) < _settings.hedge_min_samples:
+            return None
+        ordered = sorted(window)
+        delay = ordered[min(len(ordered) - 1, int(_settings.hedge_percentile * len(ordered)))]
+        return max(_settings.hedge_min_delay_seconds, delay)
+
+    async def refresh(self) -> None:
+        # Pull the fleet-wide view; local observations fill in between refreshes
+        if time.monotonic() - self._refreshed_at < _settings.router_refresh_seconds:
+            return
+        self._refreshed_at = time.monotonic()
+        models = priced_models()
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for provider, model in models:
+                    pipe.hgetall(f"router:{provider}:{model}")
+                rows = await pipe.execute()
+        except Exception:
+            return
+        for (provider, model), row in zip(models, rows):
+            if not row:
+                continue
+            row = {(k.decode() if isinstance(k, bytes) else k): float(v) for k, v in row.items()}
+            self._stats[(provider, model)] = ModelStats(
+                ttft=row.get("ttft"), tokens_per_second=row.get("tput"), error_rate=row.get("err", 0.0), samples=int(row.get("n", 0))
+            )
+
+    async def _providers_with_keys(self, principal: Principal) -> set[str]:
+        providers = {provider for provider, _ in priced_models()}
+        async with AsyncSessionLocal() as db:
+            keys = [await resolve_user_key(db, principal.id, p) for p in sorted(providers)]
+        return {p for p, key in zip(sorted(providers), keys) if key}
+
+    async def choose(self, principal: Principal, req: GenerationRequest) -> Candidate:
+        await self.refresh()
+        available = await self._providers_with_keys(principal)
+        if not available:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No user key found for any provider")
+        max_tokens = requested_max_tokens(req)
+        prompt = await abuild_prompt(req)
+        candidates: list[Candidate] = []
+        for provider, model in priced_models():
+            if provider not in available or (req.model_provider and provider != req.model_provider):
+                continue
+            tokens_in = await acount_tokens(provider, prompt, model)
+            cost = compute_cost_usd(provider, model, tokens_in, max_tokens)
+            candidates.append(Candidate(provider, model, cost, self.stats(provider, model)))
+
+        if not candidates:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No user key found for provider")
+        objective = (req.options.route if req.options and req.options.route else None) or _settings.router_objective
+        eligible = [c for c in candidates if self._within_limits(c) and not circuit_open(c.provider, c.model)]
+        if eligible and random.random() < _settings.router_epsilon:
+            choice, reason = random.choice(eligible), "explore"
+        elif eligible:
+            choice, reason = min(eligible, key=lambda c: self._rank(c, objective, max_tokens)), "best"
+        else:
+            # Nothing meets the SLO and cost cap: degrade to the best available rather than failing
+            choice, reason = min(candidates, key=lambda c: self._rank(c, objective, max_tokens)), "fallback"
+        ROUTER_DECISIONS.labels(provider=choice.provider, model=choice.model, reason=reason).inc()
+        return choice
+
+    async def alternatives(self, principal: Principal, req: GenerationRequest, tokens_in: int) -> list[tuple[str, str]]:
+        # Backups for hedging and fallback: the configured chain, else other models of the same
+        # provider, healthiest and fastest first. Either way they must fit the router's cost cap.
+        await self.refresh()
+        chain = _fallback_chain(_settings.fallback_chain)
+        if chain:
+            available = await self._providers_with_keys(principal)
+        else:
+            available = {req.model_provider}
+            chain = sorted(
+                (pm for pm in priced_models() if pm[0] == req.model_provider), key=lambda pm: self._backup_rank(self.stats(*pm))
+            )
+        max_tokens = requested_max_tokens(req)
+        backups = []
+        for provider, model in chain:
+            if provider not in available or (provider, model) == (req.model_provider, req.model) or circuit_open(provider, model):
+                continue
+            cost = compute_cost_usd(provider, model, tokens_in, max_tokens)
+            if self._within_limits(Candidate(provider, model, cost, self.stats(provider, model))):
+                backups.append((provider, model))
+        return backups
+
+    @staticmethod
+    def _backup_rank(stats: ModelStats) -> tuple:
+        unhealthy = stats.samples >= _settings.router_min_samples and stats.error_rate > _settings.router_max_error_rate
+        return (unhealthy, _settings.router_ttft_slo_seconds if stats.ttft is None else stats.ttft)
+
+    @staticmethod
+    def _within_limits(c: Candidate) -> bool:
+        if c.cost_usd > _settings.router_max_cost_usd:
+            return False
+        if c.stats.samples < _settings.router_min_samples:
+            # Unmeasured models stay eligible so they can earn statistics
+            return True
+        if c.stats.error_rate > _settings.router_max_error_rate:
+            return False
+        return c.stats.ttft is None or c.stats.ttft <= _settings.router_ttft_slo_seconds
+
+    @staticmethod
+    def _rank(c: Candidate, objective: str, max_tokens: int) -> tuple:
+        latency = c.stats.expected_seconds(max_tokens)
+        # Unmeasured models rank as if they just met the SLO
+        latency = _settings.router_ttft_slo_seconds if latency is None else latency
+        penalty = c.stats.error_rate
+        if objective == "cost":
+            return (c.cost_usd * (1 + penalty), latency)
+        return (latency * (1 + penalty), c.cost_usd)
+
+
+model_router = ModelRouter()
+
+
+async def route_request(principal: Principal, req: GenerationRequest) -> GenerationRequest:
+    if req.model != AUTO_MODEL:
+        return req
+    choice = await model_router.choose(principal, req)
+    return req.model_copy(update={"model": choice.model, "model_provider": choice.provider})
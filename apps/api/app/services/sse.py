@@ -0,0 +1,107 @@
+import asyncio
+import re
+from typing import AsyncIterator
+
+from starlette.requests import Request
+
+from app.core.config import get_settings
+
+_settings = get_settings()
+
+DONE = b"data: [DONE]\n\n"
+HEARTBEAT = b": keep-alive\n\n"
+_DATA = b"data: "
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+def data_frame(text: str, event: str | None = None) -> bytes:
+    # Every line of a multi-line payload needs its own data: field; clients rejoin them with \n
+    head = f"event: {event}\n".encode() if event else b""
+    if "\n" not in text and "\r" not in text:
+        return head + _DATA + text.encode() + b"\n\n"
+    return head + b"".join(_DATA + line.encode() + b"\n" for line in _LINE_BREAK.split(text)) + b"\n"
+
+
+async def _poll_disconnect(request: Request) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(_settings.disconnect_poll_seconds)
+
+
+def watch_disconnect(request: Request) -> asyncio.Task:
+    return asyncio.ensure_future(_poll_disconnect(request))
+
+
+async def encode_stream(
+    deltas: AsyncIterator[str],
+    disconnected: asyncio.Future | None = None,
+    flush_ms: int | None = None,
+    flush_bytes: int | None = None,
+    heartbeat_seconds: float | None = None,
+) -> AsyncIterator[bytes]:
+    window = (_settings.sse_flush_interval_ms if flush_ms is None else flush_ms) / 1000.0
+    max_bytes = _settings.sse_flush_bytes if flush_bytes is None else flush_bytes
+    heartbeat = _settings.sse_heartbeat_seconds if heartbeat_seconds is None else heartbeat_seconds
+    loop = asyncio.get_running_loop()
+
+    it = deltas.__aiter__()
+    buf: list[str] = []
+    size = 0
+    flush_at = 0.0
+    # The first delta is flushed immediately so coalescing never delays time-to-first-token
+    emitted = False
+    pending = asyncio.ensure_future(it.__anext__())
+    waiters = {pending} if disconnected is None else {pending, disconnected}
+    try:
+        while True:
+            if buf:
+                timeout = max(0.0, flush_at - loop.time())
+            else:
+                timeout = heartbeat
+            done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected is not None and disconnected.done():
+                return
+            if not done:
+                if buf:
+                    yield data_frame("".join(buf))
+                    emitted = True
+                    buf.clear()
+                    size = 0
+                else:
+                    yield HEARTBEAT
+                continue
+            try:
+                delta = pending.result()
+            except StopAsyncIteration:
+                break
+            except Exception as e:
+                if buf:
+                    yield data_frame("".join(buf))
+                elif not emitted:
+                    yield data_frame(str(getattr(e, "detail", None) or e), event="error")
+                return
+            pending = asyncio.ensure_future(it.__anext__())
+            waiters = {pending} if disconnected is None else {pending, disconnected}
+            if not delta:
+                continue
+            if not buf and emitted:
+                flush_at = loop.time() + window
+            buf.append(delta)
+            size += len(delta)
+            if size >= max_bytes or not emitted:
+                yield data_frame("".join(buf))
+                emitted = True
+                buf.clear()
+                size = 0
+        if buf:
+            yield data_frame("".join(buf))
+        yield DONE
+    finally:
+        # Runs on client disconnect too: stop the upstream generator so its cleanup settles billing
+        if disconnected is not None:
+            disconnected.cancel()
+        if not pending.done():
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        aclose = getattr(it, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,99 @@
+import argparse
+from datetime import date, datetime, timezone
+from typing import Any, Iterable, Mapping
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import SessionLocal
+from app.models.request import RequestRecord
+from app.models.usage import UsageDaily
+
+FINAL_STATUSES = ("success", "cached", "error", "canceled", "timeout")
+
+_KEY = ("day", "user_id", "model_provider", "model", "status")
+
+
+def _day_of(created_at: datetime | None) -> date:
+    if created_at is None:
+        return datetime.now(tz=timezone.utc).date()
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    return created_at.date()
+
+
+def _aggregate(records: Iterable[Mapping[str, Any]]) -> list[dict]:
+    buckets: dict[tuple, dict] = {}
+    for rec in records:
+        if rec.get("user_id") is None or rec.get("status") not in FINAL_STATUSES:
+            continue
+        row = {
+            "day": _day_of(rec.get("created_at")),
+            "user_id": rec["user_id"],
+            "model_provider": rec["model_provider"],
+            "model": rec["model"],
+            "status": rec["status"],
+        }
+        key = tuple(row[k] for k in _KEY)
+        bucket = buckets.setdefault(key, {**row, "count": 0, "tokens_in": 0, "tokens_out": 0, "cost_usd": 0.0})
+        bucket["count"] += 1
+        bucket["tokens_in"] += int(rec.get("tokens_in") or 0)
+        bucket["tokens_out"] += int(rec.get("tokens_out") or 0)
+        bucket["cost_usd"] += float(rec.get("cost_usd") or 0.0)
+    return list(buckets.values())
+
+
+async def apply_rollups(db: AsyncSession, records: Iterable[Mapping[str, Any]]) -> None:
+    # Call once per finalized request, in the same transaction that persists it
+    rows = _aggregate(records)
+    if not rows:
+        return
+    stmt = insert(UsageDaily).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(_KEY),
+        set_={
+            "count": UsageDaily.count + stmt.excluded.count,
+            "tokens_in": UsageDaily.tokens_in + stmt.excluded.tokens_in,
+            "tokens_out": UsageDaily.tokens_out + stmt.excluded.tokens_out,
+            "cost_usd": UsageDaily.cost_usd + stmt.excluded.cost_usd,
+        },
+    )
+    await db.execute(stmt)
+
+
+def backfill(since: date | None = None) -> int:
+    day = func.date(func.timezone("UTC", RequestRecord.created_at))
+    source = (
+        select(
+            day,
+            RequestRecord.user_id,
+            RequestRecord.model_provider,
+            RequestRecord.model,
+            RequestRecord.status,
+            func.count(RequestRecord.id),
+            func.coalesce(func.sum(RequestRecord.tokens_in), 0),
+            func.coalesce(func.sum(RequestRecord.tokens_out), 0),
+            func.coalesce(func.sum(RequestRecord.cost_usd), 0),
+        )
+        .where(RequestRecord.user_id.is_not(None), RequestRecord.status.in_(FINAL_STATUSES))
+        .group_by(day, RequestRecord.user_id, RequestRecord.model_provider, RequestRecord.model, RequestRecord.status)
+    )
+    clear = delete(UsageDaily)
+    if since is not None:
+        source = source.where(day >= since)
+        clear = clear.where(UsageDaily.day >= since)
+    columns = list(_KEY) + ["count", "tokens_in", "tokens_out", "cost_usd"]
+    with SessionLocal() as db:
+        db.execute(clear)
+        result = db.execute(insert(UsageDaily).from_select(columns, source))
+        db.commit()
+        return result.rowcount or 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild usage_daily rollups from the requests table")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--since", type=date.fromisoformat, default=None, help="Only rebuild days on or after YYYY-MM-DD")
+    args = parser.parse_args()
+    print(f"wrote {backfill(args.since)} rollup rows")
@@ -0,0 +1,58 @@
+# Per-plan admission waits and rejections when a burst exceeds the generation cap.
+# Drives the admission controller and the stub adapter in-process, no providers or DB.
+# Run from apps/api: STUB_PROVIDER_ENABLED=true python -m benchmarks.admission_bench
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from collections import defaultdict
+
+from fastapi import HTTPException
+
+from app.core.plans import PlanSnapshot
+from app.core.principal import Principal
+from app.schemas.generate import GenerationRequest
+from app.services.adapters import get_adapter
+from app.services.admission import AdmissionController
+
+PLANS = {name: PlanSnapshot(name, 0.0, 0, None) for name in ("Basic", "Pro", "Premium")}
+MIX = ["Basic"] * 6 + ["Pro"] * 3 + ["Premium"]
+REQUESTS = 400
+CONCURRENCY = 16
+DEADLINE_SECONDS = 10.0
+
+
+async def one(controller: AdmissionController, plan: str, waits: dict, rejected: dict) -> None:
+    principal = Principal(uuid.uuid4(), True, PLANS[plan])
+    req = GenerationRequest(model="stub-1", model_provider="stub", prompt="Reply to this thread briefly " * 4)
+    queued = time.monotonic()
+    try:
+        async with controller.slot(principal.plan, queued + DEADLINE_SECONDS):
+            waits[plan].append(time.monotonic() - queued)
+            async for _ in get_adapter("stub").agenerate_stream(principal, req, None):
+                pass
+    except HTTPException as e:
+        rejected[plan][e.status_code] += 1
+
+
+async def run() -> None:
+    controller = AdmissionController(CONCURRENCY, REQUESTS, service_seconds=1.0)
+    waits: dict[str, list[float]] = defaultdict(list)
+    rejected: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    tasks = []
+    for _ in range(REQUESTS):
+        tasks.append(asyncio.ensure_future(one(controller, random.choice(MIX), waits, rejected)))
+        await asyncio.sleep(0.002)
+    await asyncio.gather(*tasks)
+    for plan in ("Premium", "Pro", "Basic"):
+        samples = sorted(waits[plan]) or [0.0]
+        p99 = samples[max(0, int(len(samples) * 0.99) - 1)]
+        print(
+            f"{plan:>8}: admitted {len(waits[plan]):4d}  wait p50 {statistics.median(samples):6.2f}s  "
+            f"p99 {p99:6.2f}s  rejected {dict(rejected[plan])}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
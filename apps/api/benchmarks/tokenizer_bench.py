@@ -0,0 +1,67 @@
+# Per-request tokenization overhead, before and after app.core.tokenizer.
+# Run from apps/api: python -m benchmarks.tokenizer_bench
+import statistics
+import time
+
+import tiktoken
+
+from app.core.tokenizer import count_tokens, count_tokens_batch, warm
+
+PROMPT = "Write a friendly reply that thanks them for the detailed feedback. " * 4
+OUTPUT = (
+    "Thanks so much for taking the time to write this up! The points about onboarding are spot on, "
+    "and we're already looking at how to shorten the first-run flow. "
+) * 6
+# Roughly what providers stream: a few characters per delta
+DELTAS = [OUTPUT[i : i + 4] for i in range(0, len(OUTPUT), 4)]
+CHUNKS = [PROMPT * 3] * 12
+MODEL = "gpt-4o-mini"
+
+
+def legacy_count(text: str, model: str) -> int:
+    # The previous billing.estimate_tokens_openai: encoder lookup on every call
+    try:
+        enc = tiktoken.encoding_for_model(model)
+    except Exception:
+        enc = tiktoken.get_encoding("cl100k_base")
+    return len(enc.encode(text))
+
+
+def legacy_request() -> int:
+    total = legacy_count(PROMPT, MODEL)
+    for delta in DELTAS:
+        total += legacy_count(delta, MODEL)
+    for chunk in CHUNKS:
+        total += legacy_count(chunk, MODEL)
+    return total
+
+
+def current_request() -> int:
+    total = count_tokens("openai", PROMPT, MODEL)
+    total += count_tokens("openai", "".join(DELTAS), MODEL)
+    total += sum(count_tokens_batch("openai", CHUNKS, MODEL))
+    return total
+
+
+def bench(fn, rounds: int = 200) -> tuple[float, float]:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main() -> None:
+    start = time.perf_counter()
+    warm([("openai", MODEL), ("anthropic", "claude-3-haiku-20240307")])
+    print(f"warm-up (encoder load): {(time.perf_counter() - start) * 1e3:.1f} ms, paid once at startup")
+    print(f"{len(DELTAS)} deltas, {len(CHUNKS)} context chunks per request")
+    for name, fn in (("before", legacy_request), ("after", current_request)):
+        p50, p99 = bench(fn)
+        print(f"{name:>6}: p50 {p50:8.1f} us  p99 {p99:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
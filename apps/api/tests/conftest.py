@@ -0,0 +1,37 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+# Settings are read when app modules are imported, so these must be set first
+os.environ["STUB_PROVIDER_ENABLED"] = "true"
+os.environ["STUB_TTFT_SECONDS"] = "0.01"
+os.environ["STUB_TOKEN_INTERVAL_SECONDS"] = "0"
+
+# Lua script tests need a real server, e.g. TEST_REDIS_URL=redis://localhost:6379/15
+REDIS_URL = os.environ.get("TEST_REDIS_URL")
+
+
+@pytest.fixture
+def redis_scenario():
+    # Runs scenario(client, prefix) on a fresh connection and removes every key under prefix
+    if not REDIS_URL:
+        pytest.skip("TEST_REDIS_URL is not set")
+    from redis.asyncio import Redis
+
+    def run(scenario) -> None:
+        async def main():
+            client = Redis.from_url(REDIS_URL)
+            prefix = f"test:{uuid.uuid4().hex}"
+            try:
+                await scenario(client, prefix)
+            finally:
+                keys = [key async for key in client.scan_iter(f"{prefix}*")]
+                if keys:
+                    await client.delete(*keys)
+                await client.aclose()
+
+        asyncio.run(main())
+
+    return run
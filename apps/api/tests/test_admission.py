@@ -0,0 +1,169 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from app.core.config import get_settings
+from app.core.plans import PlanSnapshot
+from app.core.principal import Principal
+from app.schemas.generate import GenerationRequest
+from app.services.adapters import get_adapter
+from app.services.admission import AdmissionController, Overloaded
+
+PLANS = {name: PlanSnapshot(name, 0.0, 0, None) for name in ("Basic", "Pro", "Premium")}
+HEAD_START = 0.2
+
+
+@pytest.fixture(autouse=True)
+def head_starts(monkeypatch):
+    monkeypatch.setattr(get_settings(), "admission_plan_head_start", f"Premium={HEAD_START},Pro={HEAD_START / 2},Basic=0")
+
+
+def _deadline(seconds: float = 30.0) -> float:
+    return time.monotonic() + seconds
+
+
+def _request() -> GenerationRequest:
+    return GenerationRequest(model="stub-1", model_provider="stub", prompt="Reply to this thread briefly")
+
+
+async def _generate(controller: AdmissionController, plan: str, admitted: list) -> None:
+    arrived = time.monotonic()
+    async with controller.slot(PLANS[plan], _deadline()):
+        admitted.append((plan, arrived))
+        await get_adapter("stub").agenerate(Principal(uuid.uuid4(), True, PLANS[plan]), _request(), None)
+
+
+async def _deltas():
+    async for item in get_adapter("stub").agenerate_stream(Principal(uuid.uuid4(), True, PLANS["Basic"]), _request(), None):
+        if isinstance(item, str):
+            yield item
+
+
+def test_higher_plans_are_admitted_first():
+    async def scenario():
+        controller = AdmissionController(1, 10, service_seconds=0.1)
+        holder = await controller.admit(PLANS["Basic"], _deadline())
+        admitted: list = []
+        tasks = []
+        for plan in ("Basic", "Pro", "Premium"):
+            tasks.append(asyncio.ensure_future(_generate(controller, plan, admitted)))
+            await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*tasks)
+        return [plan for plan, _ in admitted], controller.in_flight
+
+    order, in_flight = asyncio.run(scenario())
+    assert order == ["Premium", "Pro", "Basic"]
+    assert in_flight == 0
+
+
+def test_lower_plans_are_not_starved():
+    async def scenario():
+        controller = AdmissionController(1, 1000, service_seconds=0.01)
+        holder = await controller.admit(PLANS["Premium"], _deadline())
+        admitted: list = []
+        basic_arrived = time.monotonic()
+        tasks = [asyncio.ensure_future(_generate(controller, "Basic", admitted))]
+        await asyncio.sleep(0)
+        # A steady stream of Premium arrivals that outpaces the single slot
+        while time.monotonic() < basic_arrived + 3 * HEAD_START:
+            if holder is not None and time.monotonic() >= basic_arrived + 2 * HEAD_START:
+                holder.release()
+                holder = None
+            tasks.append(asyncio.ensure_future(_generate(controller, "Premium", admitted)))
+            await asyncio.sleep(0.005)
+        await asyncio.gather(*tasks)
+        return admitted, basic_arrived
+
+    admitted, basic_arrived = asyncio.run(scenario())
+    i = next(i for i, (plan, _) in enumerate(admitted) if plan == "Basic")
+    assert 0 < i < len(admitted) - 1
+    # Only requests that arrived within the head start may overtake it
+    assert all(arrived <= basic_arrived + HEAD_START + 0.01 for _, arrived in admitted[:i])
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(1, 1, service_seconds=1.0)
+        holder = await controller.admit(PLANS["Basic"], _deadline())
+        waiter = asyncio.ensure_future(controller.admit(PLANS["Basic"], _deadline()))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as excinfo:
+            await controller.admit(PLANS["Premium"], _deadline())
+        holder.release()
+        (await waiter).release()
+        return excinfo.value, controller.in_flight
+
+    error, in_flight = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert int(error.headers["Retry-After"]) >= 1
+    assert in_flight == 0
+
+
+def test_wait_past_deadline_is_rejected_up_front():
+    async def scenario():
+        controller = AdmissionController(1, 10, service_seconds=5.0)
+        holder = await controller.admit(PLANS["Basic"], _deadline())
+        with pytest.raises(Overloaded) as excinfo:
+            await controller.admit(PLANS["Premium"], _deadline(1.0))
+        queued = len(controller._queue)
+        holder.release()
+        return excinfo.value, queued
+
+    error, queued = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "5"
+    assert queued == 0
+
+
+def test_canceled_generation_releases_its_slot():
+    async def scenario():
+        controller = AdmissionController(1, 10, service_seconds=0.1)
+        admitted: list = []
+        running = asyncio.ensure_future(_generate(controller, "Basic", admitted))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(_generate(controller, "Pro", admitted))
+        await asyncio.sleep(0)
+        running.cancel()
+        await asyncio.gather(running, return_exceptions=True)
+        await waiting
+        return [plan for plan, _ in admitted], controller.in_flight
+
+    order, in_flight = asyncio.run(scenario())
+    assert order == ["Basic", "Pro"]
+    assert in_flight == 0
+
+
+def test_canceled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(1, 10, service_seconds=0.1)
+        holder = await controller.admit(PLANS["Basic"], _deadline())
+        waiter = asyncio.ensure_future(controller.admit(PLANS["Premium"], _deadline()))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        queued = len(controller._queue)
+        holder.release()
+        return queued, controller.in_flight
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+
+def test_held_stream_releases_its_slot_when_closed():
+    async def scenario():
+        controller = AdmissionController(1, 10, service_seconds=0.1)
+        read = await controller.hold(await controller.admit(PLANS["Basic"], _deadline()), _deltas())
+        first = await anext(read)
+        await read.aclose()
+        after_read = controller.in_flight
+        # Dropped before the first delta was read
+        unread = await controller.hold(await controller.admit(PLANS["Basic"], _deadline()), _deltas())
+        await unread.aclose()
+        return first, after_read, controller.in_flight
+
+    first, after_read, in_flight = asyncio.run(scenario())
+    assert first == "Stub "
+    assert after_read == 0
+    assert in_flight == 0
@@ -0,0 +1,63 @@
+from app.core.quota import _INIT_LUA, _RAISE_USED_LUA, _RESERVE_LUA, _SETTLE_LUA
+
+
+def test_quota_reserve_and_settle(redis_scenario):
+    async def scenario(client, prefix):
+        keys = [f"{prefix}:ledger", f"{prefix}:res"]
+        reserve, settle, init = (client.register_script(s) for s in (_RESERVE_LUA, _SETTLE_LUA, _INIT_LUA))
+
+        # Cold ledger asks the caller to load it
+        assert await reserve(keys=keys, args=[100, 10, "r1", 60, 60]) == [-1, 0]
+        await init(keys=[keys[0], f"{prefix}:active"], args=[20, 60, "user"])
+        assert await reserve(keys=keys, args=[100, 50, "r1", 60, 60]) == [1, 30]
+        assert await reserve(keys=keys, args=[100, 50, "r2", 60, 60]) == [0, 30]
+
+        assert await settle(keys=keys, args=["r1", 40]) == 50
+        assert await client.hmget(keys[0], "used", "reserved") == [b"60", b"0"]
+        # Releasing an unknown reservation changes nothing
+        assert await settle(keys=keys, args=["r1", 0]) == 0
+        assert await client.hmget(keys[0], "used", "reserved") == [b"60", b"0"]
+
+    redis_scenario(scenario)
+
+
+def test_quota_expired_reservations_are_reclaimed(redis_scenario):
+    async def scenario(client, prefix):
+        keys = [f"{prefix}:ledger", f"{prefix}:res"]
+        reserve, init = client.register_script(_RESERVE_LUA), client.register_script(_INIT_LUA)
+        await init(keys=[keys[0], f"{prefix}:active"], args=[0, 60, "user"])
+        # A worker that died holding a reservation: already past its expiry
+        assert await reserve(keys=keys, args=[100, 80, "lost", -1, 60]) == [1, 20]
+        assert await reserve(keys=keys, args=[100, 90, "r1", 60, 60]) == [1, 10]
+        assert await client.hget(keys[0], "r:lost") is None
+        assert await client.hget(keys[0], "reserved") == b"90"
+
+    redis_scenario(scenario)
+
+
+def test_quota_init_keeps_an_existing_ledger(redis_scenario):
+    async def scenario(client, prefix):
+        key, active = f"{prefix}:ledger", f"{prefix}:active"
+        init = client.register_script(_INIT_LUA)
+        await init(keys=[key, active], args=[20, 60, "user"])
+        await init(keys=[key, active], args=[5, 60, "user"])
+        assert await client.hget(key, "used") == b"20"
+        assert await client.smembers(active) == {b"user"}
+
+    redis_scenario(scenario)
+
+
+def test_quota_reconciliation_only_raises_used(redis_scenario):
+    async def scenario(client, prefix):
+        key = f"{prefix}:ledger"
+        raise_used = client.register_script(_RAISE_USED_LUA)
+        assert await raise_used(keys=[key], args=[50]) == 0
+        assert not await client.exists(key)
+
+        await client.hset(key, mapping={"used": 60, "reserved": 0})
+        assert await raise_used(keys=[key], args=[50]) == 0
+        assert await client.hget(key, "used") == b"60"
+        assert await raise_used(keys=[key], args=[75]) == 1
+        assert await client.hget(key, "used") == b"75"
+
+    redis_scenario(scenario)
@@ -0,0 +1,25 @@
+from app.core.rate_limit import _TOKEN_BUCKET_LUA, parse_rate_limits
+
+
+def test_rate_limit_spec_parsing():
+    policy = parse_rate_limits("60/minute;burst=10")
+    assert (policy.limit, policy.window_seconds, policy.burst) == (60, 60, 10)
+    assert parse_rate_limits("5/s").burst == 5
+    assert parse_rate_limits("nonsense") == parse_rate_limits(None)
+
+
+def test_token_bucket_allows_a_burst_then_asks_to_retry(redis_scenario):
+    async def scenario(client, prefix):
+        bucket = client.register_script(_TOKEN_BUCKET_LUA)
+        # burst of 2, refilled at 2 per minute
+        args = [2, 2 / 60000]
+        first = await bucket(keys=[f"{prefix}:rl"], args=args)
+        second = await bucket(keys=[f"{prefix}:rl"], args=args)
+        third = await bucket(keys=[f"{prefix}:rl"], args=args)
+        assert first[:2] == [1, 1]
+        assert second[:2] == [1, 0]
+        allowed, remaining, retry_ms, _ = third
+        assert (allowed, remaining) == (0, 0)
+        assert 29000 < retry_ms <= 30000
+
+    redis_scenario(scenario)
@@ -0,0 +1,154 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from app.core.config import get_settings
+from app.core.plans import PlanSnapshot
+from app.core.principal import Principal
+from app.schemas.generate import GenerationRequest
+from app.services.adapters import StubAdapter
+from app.services.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    Bulkhead,
+    CircuitBreaker,
+    ProviderUnavailable,
+    ResilientAdapter,
+    breaker,
+)
+
+OPEN_SECONDS = 0.05
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"upstream returned {status_code}")
+        self.status_code = status_code
+
+
+class SlowFailingAdapter(StubAdapter):
+    def __init__(self, delay: float, error: Exception):
+        self.delay = delay
+        self.error = error
+
+    async def agenerate(self, user, req, api_key, timeout=None, prompt=None):
+        await asyncio.sleep(self.delay)
+        raise self.error
+
+
+@pytest.fixture(autouse=True)
+def breaker_settings(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "breaker_failure_threshold", 2)
+    monkeypatch.setattr(settings, "breaker_open_seconds", OPEN_SECONDS)
+    monkeypatch.setattr(settings, "breaker_half_open_probes", 1)
+    monkeypatch.setattr(settings, "provider_retry_attempts", 0)
+
+
+def _breaker() -> CircuitBreaker:
+    return CircuitBreaker("stub", f"stub-{uuid.uuid4().hex}")
+
+
+def _fail(cb: CircuitBreaker, status_code: int = 500) -> None:
+    cb.failed(cb.acquire(), UpstreamError(status_code))
+
+
+def test_opens_after_consecutive_retryable_failures():
+    cb = _breaker()
+    _fail(cb)
+    assert cb.state == CLOSED
+    _fail(cb)
+    assert cb.state == OPEN
+    with pytest.raises(ProviderUnavailable) as excinfo:
+        cb.acquire()
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers["Retry-After"] == "1"
+
+
+def test_client_errors_and_rate_limits_do_not_trip():
+    cb = _breaker()
+    for code in (400, 401, 429, 429):
+        _fail(cb, code)
+    assert cb.state == CLOSED
+    assert cb.failures == 0
+
+
+def test_success_resets_the_failure_count():
+    cb = _breaker()
+    _fail(cb)
+    cb.succeeded(cb.acquire())
+    _fail(cb)
+    assert cb.state == CLOSED
+
+
+def test_half_open_admits_one_probe_and_closes_on_success():
+    cb = _breaker()
+    _fail(cb)
+    _fail(cb)
+    time.sleep(OPEN_SECONDS)
+    probe = cb.acquire()
+    assert probe and cb.state == HALF_OPEN
+    with pytest.raises(ProviderUnavailable):
+        cb.acquire()
+    cb.succeeded(probe)
+    assert cb.state == CLOSED
+    assert cb.acquire() is False
+
+
+def test_failed_probe_reopens():
+    cb = _breaker()
+    _fail(cb)
+    _fail(cb)
+    time.sleep(OPEN_SECONDS)
+    _fail(cb)
+    assert cb.state == OPEN
+    assert cb.is_open()
+
+
+def test_released_probe_frees_the_half_open_slot():
+    cb = _breaker()
+    _fail(cb)
+    _fail(cb)
+    time.sleep(OPEN_SECONDS)
+    cb.release(cb.acquire())
+    assert cb.acquire() is True
+
+
+def test_bulkhead_rejects_when_full_and_frees_on_release(monkeypatch):
+    monkeypatch.setattr(get_settings(), "bulkhead_max_concurrent", 1)
+    slots = Bulkhead(f"stub-{uuid.uuid4().hex}")
+
+    async def scenario():
+        await slots.acquire(1.0)
+        with pytest.raises(ProviderUnavailable) as excinfo:
+            await slots.acquire(0.01)
+        slots.release()
+        await slots.acquire(0.01)
+        slots.release()
+        return excinfo.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert "Retry-After" in error.headers
+
+
+def _call(delay: float, timeout: float, error: Exception) -> CircuitBreaker:
+    req = GenerationRequest(model=f"stub-{uuid.uuid4().hex}", model_provider="stub", prompt="hi")
+    adapter = ResilientAdapter(SlowFailingAdapter(delay, error))
+    principal = Principal(uuid.uuid4(), True, PlanSnapshot("Basic", 0.0, 0, None))
+    with pytest.raises(type(error)):
+        asyncio.run(adapter.agenerate(principal, req, None, timeout=timeout))
+    return breaker("stub", req.model)
+
+
+def test_failures_within_the_deadline_count():
+    assert _call(0.0, 5.0, UpstreamError(500)).failures == 1
+
+
+def test_failures_past_the_callers_deadline_do_not_count():
+    cb = _call(0.05, 0.01, TimeoutError())
+    assert cb.failures == 0
+    assert cb.probes == 0
@@ -0,0 +1,30 @@
+import pytest
+
+from app.services.router import _RECORD_LUA, ModelStats
+
+
+def test_router_stats_ewma(redis_scenario):
+    async def scenario(client, prefix):
+        key = f"{prefix}:router"
+        record = client.register_script(_RECORD_LUA)
+        await record(keys=[key], args=[0.5, 0.5, 100, 0, 60])
+        await record(keys=[key], args=[0.5, 1.5, "", 1, 60])
+        stats = await client.hgetall(key)
+        assert float(stats[b"ttft"]) == pytest.approx(1.0)
+        assert float(stats[b"tput"]) == pytest.approx(100)
+        assert float(stats[b"err"]) == pytest.approx(0.5)
+        assert stats[b"n"] == b"2"
+
+    redis_scenario(scenario)
+
+
+def test_model_stats_ewma_and_expected_latency():
+    stats = ModelStats()
+    assert stats.expected_seconds(100) is None
+    stats.observe(0.5, ttft=1.0, tokens_per_second=50.0, error=False)
+    stats.observe(0.5, ttft=2.0, tokens_per_second=None, error=True)
+    assert stats.ttft == pytest.approx(1.5)
+    assert stats.tokens_per_second == pytest.approx(50.0)
+    assert stats.error_rate == pytest.approx(0.5)
+    assert stats.samples == 2
+    assert stats.expected_seconds(100) == pytest.approx(3.5)
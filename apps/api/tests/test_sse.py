@@ -0,0 +1,78 @@
+import asyncio
+
+from app.services.sse import DONE, HEARTBEAT, data_frame, encode_stream
+
+
+async def _deltas(*items, delay: float = 0.0):
+    await asyncio.sleep(delay)
+    for item in items:
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _frames(deltas, **kwargs) -> list[bytes]:
+    async def collect():
+        return [frame async for frame in encode_stream(deltas, **kwargs)]
+
+    return asyncio.run(collect())
+
+
+def test_single_line_frame():
+    assert data_frame("hello") == b"data: hello\n\n"
+    assert data_frame("oops", event="error") == b"event: error\ndata: oops\n\n"
+
+
+def test_multi_line_frame_gets_one_data_field_per_line():
+    assert data_frame("a\nb\r\nc\rd") == b"data: a\ndata: b\ndata: c\ndata: d\n\n"
+    assert data_frame("end\n") == b"data: end\ndata: \n\n"
+
+
+def test_first_delta_is_flushed_and_the_rest_coalesced():
+    frames = _frames(_deltas("Hel", "lo", ", ", "world"), flush_ms=1000, flush_bytes=1024)
+    assert frames == [b"data: Hel\n\n", b"data: lo, world\n\n", DONE]
+
+
+def test_size_threshold_flushes_early():
+    frames = _frames(_deltas("a", "bb", "cc", "d"), flush_ms=1000, flush_bytes=2)
+    assert frames == [b"data: a\n\n", b"data: bb\n\n", b"data: cc\n\n", b"data: d\n\n", DONE]
+
+
+def test_empty_deltas_are_skipped():
+    assert _frames(_deltas("", "x", ""), flush_ms=1000) == [b"data: x\n\n", DONE]
+
+
+def test_heartbeat_while_waiting_for_the_first_delta():
+    frames = _frames(_deltas("x", delay=0.05), heartbeat_seconds=0.01)
+    assert frames[0] == HEARTBEAT
+    assert frames[-2:] == [b"data: x\n\n", DONE]
+
+
+def test_error_before_output_is_sent_as_an_error_event():
+    assert _frames(_deltas(RuntimeError("boom"))) == [b"event: error\ndata: boom\n\n"]
+
+
+def test_error_after_output_flushes_without_done():
+    frames = _frames(_deltas("a", "b", RuntimeError("boom")), flush_ms=1000)
+    assert frames == [b"data: a\n\n", b"data: b\n\n"]
+
+
+def test_disconnect_stops_the_stream_and_closes_upstream():
+    closed = []
+
+    async def endless():
+        try:
+            while True:
+                yield "x"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.append(True)
+
+    async def collect():
+        disconnected = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().call_later(0.05, disconnected.set_result, None)
+        return [frame async for frame in encode_stream(endless(), disconnected, flush_ms=1)]
+
+    frames = asyncio.run(collect())
+    assert frames and DONE not in frames
+    assert closed == [True]
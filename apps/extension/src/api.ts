@@ -15,6 +15,85 @@ export async function apiLogin(
   return data.access_token as string;
 }
 
+// Page text is uploaded once per page as content-addressed chunks; generation
+// requests then carry only its SHA-256.
+const CONTEXT_CHUNK_CHARS = 8192;
+const CONTEXT_SYNC_TTL_MS = 10 * 60 * 1000;
+const syncedPages = new Map<string, number>();
+
+// Must stay byte-for-byte stable: the server verifies the joined chunks
+// against the page hash.
+export function normalizePageText(text: string): string {
+  return text
+    .replace(/\r\n?/g, "\n")
+    .replace(/[ \t]+\n/g, "\n")
+    .replace(/\n{3,}/g, "\n\n")
+    .trim();
+}
+
+async function sha256Hex(text: string): Promise<string> {
+  const digest = await crypto.subtle.digest(
+    "SHA-256",
+    new TextEncoder().encode(text)
+  );
+  return Array.from(new Uint8Array(digest), (b) =>
+    b.toString(16).padStart(2, "0")
+  ).join("");
+}
+
+function splitChunks(text: string): string[] {
+  const chunks: string[] = [];
+  let start = 0;
+  while (start < text.length) {
+    let end = Math.min(start + CONTEXT_CHUNK_CHARS, text.length);
+    // Never split a surrogate pair across chunks
+    const code = text.charCodeAt(end - 1);
+    if (end < text.length && code >= 0xd800 && code <= 0xdbff) end -= 1;
+    chunks.push(text.slice(start, end));
+    start = end;
+  }
+  return chunks;
+}
+
+export async function syncPageContext(
+  pageText: string
+): Promise<string | undefined> {
+  const text = normalizePageText(pageText);
+  if (!text) return undefined;
+  const hash = await sha256Hex(text);
+  if ((syncedPages.get(hash) ?? 0) > Date.now()) return hash;
+
+  const { apiBaseUrl, authToken } = await getSettings();
+  if (!authToken) throw new Error("Not authenticated");
+  const headers = {
+    "Content-Type": "application/json",
+    Authorization: `Bearer ${authToken}`,
+  };
+  const chunks = splitChunks(text);
+  const digests = await Promise.all(chunks.map(sha256Hex));
+  const res = await fetch(`${apiBaseUrl}/api/v1/context/manifest`, {
+    method: "POST",
+    headers,
+    body: JSON.stringify({ page_text_hash: hash, chunks: digests }),
+  });
+  if (!res.ok) throw new Error(`Context sync failed: ${res.status}`);
+  const missing = new Set<string>((await res.json()).missing);
+  if (missing.size) {
+    const upload: Record<string, string> = {};
+    digests.forEach((d, i) => {
+      if (missing.has(d)) upload[d] = chunks[i];
+    });
+    const put = await fetch(`${apiBaseUrl}/api/v1/context/chunks`, {
+      method: "PUT",
+      headers,
+      body: JSON.stringify({ chunks: upload }),
+    });
+    if (!put.ok) throw new Error(`Context upload failed: ${put.status}`);
+  }
+  syncedPages.set(hash, Date.now() + CONTEXT_SYNC_TTL_MS);
+  return hash;
+}
+
 export async function apiGenerate(params: {
   model: string;
   provider: "openai" | "anthropic" | "gemini";
@@ -25,26 +104,198 @@ export async function apiGenerate(params: {
 }): Promise<string> {
   const { apiBaseUrl, authToken } = await getSettings();
   if (!authToken) throw new Error("Not authenticated");
-  const body = {
-    model: params.model,
-    model_provider: params.provider,
-    prompt: params.prompt,
-    context: {
-      selected_text: params.selectedText,
-      page_text: params.pageText,
-    },
-    options: { tone: params.tone, max_tokens: 128, temperature: 0.7 },
-    use_user_key: true,
-  };
-  const res = await fetch(`${apiBaseUrl}/api/v1/generate`, {
+  let pageTextHash: string | undefined;
+  if (params.pageText) {
+    try {
+      pageTextHash = await syncPageContext(params.pageText);
+    } catch {
+      pageTextHash = undefined;
+    }
+  }
+  const send = (hash: string | undefined) =>
+    fetch(`${apiBaseUrl}/api/v1/generate`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        Authorization: `Bearer ${authToken}`,
+      },
+      body: JSON.stringify({
+        model: params.model,
+        model_provider: params.provider,
+        prompt: params.prompt,
+        context: {
+          selected_text: params.selectedText,
+          ...(hash ? { page_text_hash: hash } : { page_text: params.pageText }),
+        },
+        options: { tone: params.tone, max_tokens: 128, temperature: 0.7 },
+        use_user_key: true,
+      }),
+    });
+  let res = await send(pageTextHash);
+  if (res.status === 409 && pageTextHash) {
+    // The server evicted the page; send it inline this time
+    syncedPages.delete(pageTextHash);
+    res = await send(undefined);
+  }
+  if (!res.ok) throw new Error(`Generate failed: ${res.status}`);
+  const data = await res.json();
+  return data.output_text as string;
+}
+
+export async function apiPrepare(
+  provider: string,
+  model: string
+): Promise<{ token: string; expiresAt: number }> {
+  const { apiBaseUrl, authToken } = await getSettings();
+  if (!authToken) throw new Error("Not authenticated");
+  const res = await fetch(`${apiBaseUrl}/api/v1/generate/prepare`, {
     method: "POST",
     headers: {
       "Content-Type": "application/json",
       Authorization: `Bearer ${authToken}`,
     },
-    body: JSON.stringify(body),
+    body: JSON.stringify({ model, model_provider: provider }),
   });
-  if (!res.ok) throw new Error(`Generate failed: ${res.status}`);
+  if (!res.ok) throw new Error(`Prepare failed: ${res.status}`);
   const data = await res.json();
-  return data.output_text as string;
+  return {
+    token: data.prepare_token as string,
+    expiresAt: Date.now() + (data.expires_in as number) * 1000,
+  };
+}
+
+export type StreamHandlers = {
+  onStart?: (requestId: string) => void;
+  onDelta: (text: string) => void;
+  onDone: () => void;
+  onCanceled?: () => void;
+  onError: (error: string, status?: number) => void;
+};
+
+// Grant the server more delta frames after this many have been consumed.
+const ACK_BATCH = 16;
+
+type SocketStream = { handlers: StreamHandlers; unacked: number };
+
+// One authenticated WebSocket carries every generation stream, so a Compose
+// click costs a single frame instead of a new HTTPS request.
+class GenerationSocket {
+  private ready: Promise<WebSocket> | null = null;
+  private token: string | undefined;
+  private streams = new Map<string, SocketStream>();
+  private nextId = 0;
+
+  private async connect(): Promise<WebSocket> {
+    const { apiBaseUrl, authToken } = await getSettings();
+    if (!authToken) throw new Error("Not authenticated");
+    if (this.ready && this.token !== authToken) {
+      this.ready.then((ws) => ws.close()).catch(() => {});
+      this.ready = null;
+    }
+    if (!this.ready) {
+      this.token = authToken;
+      const url = `${apiBaseUrl.replace(/^http/, "ws")}/api/v1/ws`;
+      this.ready = this.open(url, authToken);
+      this.ready.catch(() => {
+        this.ready = null;
+      });
+    }
+    return this.ready;
+  }
+
+  warm() {
+    this.connect().catch(() => {});
+  }
+
+  private open(url: string, token: string): Promise<WebSocket> {
+    return new Promise((resolve, reject) => {
+      const ws = new WebSocket(url);
+      ws.onopen = () => ws.send(JSON.stringify({ type: "auth", token }));
+      ws.onerror = () => reject(new Error("WebSocket connection failed"));
+      ws.onclose = () => reject(new Error("WebSocket closed"));
+      ws.onmessage = (ev) => {
+        if (JSON.parse(ev.data)?.type !== "ready") return;
+        ws.onmessage = (e) => this.dispatch(ws, JSON.parse(e.data));
+        ws.onclose = () => this.closed(ws);
+        resolve(ws);
+      };
+    });
+  }
+
+  private closed(ws: WebSocket) {
+    this.ready?.then((current) => {
+      if (current === ws) this.ready = null;
+    });
+    for (const stream of this.streams.values()) {
+      stream.handlers.onError("Connection closed");
+    }
+    this.streams.clear();
+  }
+
+  private dispatch(ws: WebSocket, msg: any) {
+    const stream = this.streams.get(msg?.id);
+    if (!stream) return;
+    const { handlers } = stream;
+    if (msg.type === "start") {
+      handlers.onStart?.(msg.request_id);
+    } else if (msg.type === "delta") {
+      handlers.onDelta(msg.text);
+      if (++stream.unacked >= ACK_BATCH) {
+        ws.send(JSON.stringify({ type: "ack", id: msg.id, credits: stream.unacked }));
+        stream.unacked = 0;
+      }
+    } else if (msg.type === "done") {
+      this.streams.delete(msg.id);
+      handlers.onDone();
+    } else if (msg.type === "canceled") {
+      this.streams.delete(msg.id);
+      handlers.onCanceled?.();
+    } else if (msg.type === "error") {
+      this.streams.delete(msg.id);
+      const detail =
+        typeof msg.detail === "string" ? msg.detail : "Generation failed";
+      handlers.onError(detail, msg.status);
+    }
+  }
+
+  async stream(
+    body: unknown,
+    handlers: StreamHandlers,
+    prepareToken?: string
+  ): Promise<() => void> {
+    const ws = await this.connect();
+    const id = `s${++this.nextId}`;
+    this.streams.set(id, { handlers, unacked: 0 });
+    ws.send(
+      JSON.stringify({
+        type: "generate",
+        id,
+        request: body,
+        prepare_token: prepareToken,
+      })
+    );
+    return () => {
+      if (this.streams.has(id) && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: "cancel", id }));
+      }
+    };
+  }
+}
+
+const generationSocket = new GenerationSocket();
+
+// Resolves with a cancel function once the request is on the wire; rejects if
+// the socket cannot be opened so callers can fall back to HTTP streaming.
+export function apiStream(
+  body: unknown,
+  handlers: StreamHandlers,
+  prepareToken?: string
+): Promise<() => void> {
+  return generationSocket.stream(body, handlers, prepareToken);
+}
+
+// Opening the socket early means the first Compose click does not pay for the
+// handshake either.
+export function warmSocket(): void {
+  generationSocket.warm();
 }
@@ -1,12 +1,25 @@
-import { apiGenerate } from "./api";
+import { apiGenerate, apiPrepare, apiStream, warmSocket } from "./api";
 import { getSettings } from "./storage";
 
 chrome.runtime.onInstalled.addListener(() => {
   console.debug("[genz] extension installed");
 });
 
-const streams = new Map<number, AbortController>();
+const streams = new Map<number, () => void>();
 const streamState = new Map<number, { emitted: boolean }>();
+const prepared = new Map<
+  number,
+  { provider: string; model: string; token: string; expiresAt: number }
+>();
+
+// Prepare tokens are single use; hand one out only if it matches the request.
+function takePrepareToken(tabId: number, provider: string, model: string) {
+  const entry = prepared.get(tabId);
+  prepared.delete(tabId);
+  if (!entry || entry.expiresAt <= Date.now()) return undefined;
+  if (entry.provider !== provider || entry.model !== model) return undefined;
+  return entry.token;
+}
 
 async function getActiveTabMeta(tabId: number) {
   try {
@@ -18,11 +31,130 @@ async function getActiveTabMeta(tabId: number) {
   }
 }
 
+async function streamOverHttp(
+  tabId: number,
+  apiBaseUrl: string,
+  authToken: string,
+  body: unknown,
+  prepareToken?: string
+) {
+  const controller = new AbortController();
+  streams.set(tabId, () => controller.abort());
+  streamState.set(tabId, { emitted: false });
+  try {
+    const res = await fetch(`${apiBaseUrl}/api/v1/generate/stream`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        Authorization: `Bearer ${authToken}`,
+        ...(prepareToken ? { "X-Prepare-Token": prepareToken } : {}),
+      },
+      body: JSON.stringify(body),
+      signal: controller.signal,
+    });
+    if (!res.ok || !res.body) {
+      chrome.tabs.sendMessage(tabId, {
+        type: "GENZ_STREAM_ERROR",
+        error: `HTTP ${res.status}`,
+      });
+      streams.delete(tabId);
+      streamState.delete(tabId);
+      return;
+    }
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_BEGIN" });
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let idx;
+      while ((idx = buffer.indexOf("\n\n")) !== -1) {
+        const chunk = buffer.slice(0, idx);
+        buffer = buffer.slice(idx + 2);
+        // One event may carry several data: lines; they join with "\n".
+        // Lines starting with ":" are keep-alive comments.
+        let event = "message";
+        const dataLines: string[] = [];
+        for (const line of chunk.split("\n")) {
+          if (line.startsWith("event:")) {
+            event = line.slice(6).trim();
+          } else if (line.startsWith("data:")) {
+            const value = line.slice(5);
+            dataLines.push(value.startsWith(" ") ? value.slice(1) : value);
+          }
+        }
+        if (!dataLines.length) continue;
+        const data = dataLines.join("\n");
+        if (event === "error") {
+          chrome.tabs.sendMessage(tabId, {
+            type: "GENZ_STREAM_ERROR",
+            error: data || "Stream failed",
+          });
+        } else if (data === "[DONE]") {
+          chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_DONE" });
+        } else if (data) {
+          streamState.set(tabId, { emitted: true });
+          chrome.tabs.sendMessage(tabId, {
+            type: "GENZ_STREAM_DELTA",
+            delta: data,
+          });
+        }
+      }
+    }
+    chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_FINISH" });
+  } catch (e: any) {
+    if (controller.signal.aborted) {
+      chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_ABORTED" });
+    } else {
+      chrome.tabs.sendMessage(tabId, {
+        type: "GENZ_STREAM_ERROR",
+        error: e?.message || "Stream failed",
+      });
+    }
+  } finally {
+    streams.delete(tabId);
+    streamState.delete(tabId);
+  }
+}
+
 chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
   if (message?.type === "PING") {
     sendResponse({ ok: true });
     return true;
   }
+  if (message?.type === "GENZ_PREPARE") {
+    const tabId = sender?.tab?.id;
+    if (tabId == null) {
+      sendResponse({ ok: false });
+      return true;
+    }
+    (async () => {
+      const { authToken, defaultProvider, defaultModel } = await getSettings();
+      if (!authToken) return;
+      const provider = message.provider || defaultProvider || "openai";
+      const model = message.model || defaultModel || "gpt-4o-mini";
+      const current = prepared.get(tabId);
+      if (
+        current &&
+        current.provider === provider &&
+        current.model === model &&
+        current.expiresAt > Date.now() + 5000
+      ) {
+        return;
+      }
+      warmSocket();
+      try {
+        const { token, expiresAt } = await apiPrepare(provider, model);
+        prepared.set(tabId, { provider, model, token, expiresAt });
+      } catch {
+        // Preparing is best effort; Compose works without it
+      }
+    })();
+    sendResponse({ ok: true });
+    return true;
+  }
   if (message?.type === "GENZ_REQUEST_GENERATE") {
     (async () => {
       try {
@@ -111,70 +243,58 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
         },
         use_user_key: true,
       };
-      const controller = new AbortController();
-      streams.set(tabId, controller);
+      const prepareToken = takePrepareToken(
+        tabId,
+        body.model_provider,
+        body.model
+      );
       streamState.set(tabId, { emitted: false });
-      try {
-        const res = await fetch(`${apiBaseUrl}/api/v1/generate/stream`, {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-            Authorization: `Bearer ${authToken}`,
-          },
-          body: JSON.stringify(body),
-          signal: controller.signal,
-        });
-        if (!res.ok || !res.body) {
-          chrome.tabs.sendMessage(tabId, {
-            type: "GENZ_STREAM_ERROR",
-            error: `HTTP ${res.status}`,
-          });
-          streams.delete(tabId);
-          streamState.delete(tabId);
-          return;
-        }
-        const reader = res.body.getReader();
-        const decoder = new TextDecoder();
-        let buffer = "";
-        chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_BEGIN" });
-        while (true) {
-          const { value, done } = await reader.read();
-          if (done) break;
-          buffer += decoder.decode(value, { stream: true });
-          let idx;
-          while ((idx = buffer.indexOf("\n\n")) !== -1) {
-            const chunk = buffer.slice(0, idx);
-            buffer = buffer.slice(idx + 2);
-            const lines = chunk.split("\n");
-            for (const line of lines) {
-              if (line.startsWith("data: ")) {
-                const data = line.slice(6);
-                if (data === "[DONE]") {
-                  chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_DONE" });
-                } else if (data) {
-                  streamState.set(tabId, { emitted: true });
-                  chrome.tabs.sendMessage(tabId, {
-                    type: "GENZ_STREAM_DELTA",
-                    delta: data,
-                  });
-                }
-              }
-            }
-          }
-        }
-        chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_FINISH" });
-      } catch (e: any) {
-        if (controller.signal.aborted) {
-          chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_ABORTED" });
-        } else {
-          chrome.tabs.sendMessage(tabId, {
-            type: "GENZ_STREAM_ERROR",
-            error: e?.message || "Stream failed",
-          });
-        }
-      } finally {
+      const finish = () => {
         streams.delete(tabId);
         streamState.delete(tabId);
+      };
+      try {
+        const cancel = await apiStream(
+          body,
+          {
+            onStart: () =>
+              chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_BEGIN" }),
+            onDelta: (delta) => {
+              streamState.set(tabId, { emitted: true });
+              chrome.tabs.sendMessage(tabId, {
+                type: "GENZ_STREAM_DELTA",
+                delta,
+              });
+            },
+            onDone: () => {
+              chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_DONE" });
+              chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_FINISH" });
+              finish();
+            },
+            onCanceled: () => {
+              chrome.tabs.sendMessage(tabId, { type: "GENZ_STREAM_ABORTED" });
+              finish();
+            },
+            onError: (error) => {
+              chrome.tabs.sendMessage(tabId, {
+                type: "GENZ_STREAM_ERROR",
+                error,
+              });
+              finish();
+            },
+          },
+          prepareToken
+        );
+        if (streamState.has(tabId)) streams.set(tabId, cancel);
+      } catch {
+        // No WebSocket (proxy, older API): fall back to the SSE endpoint
+        await streamOverHttp(
+          tabId,
+          apiBaseUrl,
+          authToken,
+          body,
+          prepareToken
+        );
       }
     })();
     sendResponse({ ok: true });
@@ -183,8 +303,8 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
   if (message?.type === "GENZ_STREAM_CANCEL") {
     const tabId = sender?.tab?.id;
     if (tabId != null) {
-      const ctrl = streams.get(tabId);
-      if (ctrl) ctrl.abort();
+      const cancel = streams.get(tabId);
+      if (cancel) cancel();
       streams.delete(tabId);
       streamState.delete(tabId);
     }
@@ -168,9 +168,17 @@ function openPopover(target: HTMLElement) {
       pop.providerSel.value = defProv;
       const dms = (cfg.defaultModels || {}) as Record<string, string>;
       pop.modelInp.value = dms[defProv] || cfg.defaultModel || "gpt-4o-mini";
+      const prepare = () =>
+        chrome.runtime.sendMessage({
+          type: "GENZ_PREPARE",
+          provider: pop.providerSel.value,
+          model: pop.modelInp.value,
+        });
+      prepare();
       pop.providerSel.addEventListener("change", () => {
         const p = pop.providerSel.value;
         pop.modelInp.value = dms[p] || pop.modelInp.value;
+        prepare();
       });
     });
   } catch {}
@@ -326,6 +334,8 @@ function injectForElement(el: Element) {
 
   el.addEventListener("focus", () => {
     lastFocused = el;
+    // Warm the API side (key, client, connection) before Compose is clicked
+    chrome.runtime.sendMessage({ type: "GENZ_PREPARE" });
   });
 }
 